@@ -0,0 +1,122 @@
+"""Helpers for the static assets of the website.
+
+When the application starts, the static assets are "built": each asset is copied to a
+build folder under a path containing a hash of its contents, and compressed variants
+(gzip, and brotli if the brotli package is installed) are written next to it.
+Since the URL of a built asset changes whenever its contents change, built assets can be
+served with a long-lived, immutable caching policy.
+"""
+import gzip
+import hashlib
+import os
+
+from collections import namedtuple
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Length of the content hash used for cache busting
+HASH_LENGTH = 12
+
+# Extensions of the assets which are worth compressing
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".json", ".webmanifest", ".svg", ".ico", ".txt", ".html"}
+
+# A built asset: The hash of its contents, the path of the built file and a dictionary
+# mapping each available content encoding to the path of the precompressed file
+Asset = namedtuple("Asset", "hash path encodings")
+
+def _get_compressors() -> List[Tuple[str, str, Callable[[bytes], bytes]]]:
+    """Returns the available compressors by order of preference, as (encoding, file suffix, compress)."""
+    res = []
+    if brotli is not None:
+        res.append(("br", ".br", lambda data: brotli.compress(data, quality = 11)))
+    res.append(("gzip", ".gz", lambda data: gzip.compress(data, compresslevel = 9, mtime = 0)))
+    return res
+
+_COMPRESSORS = _get_compressors()
+
+def get_content_hash(path: str) -> str:
+    """Returns a short hash of the contents of the given file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+def _write_file(path: str, data: bytes) -> None:
+    """Atomically writes a file, so that concurrently starting workers never observe partial files."""
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def build_assets(static_folder: str, build_folder: str) -> Dict[str, Asset]:
+    """Builds the static assets.
+
+    Each asset is written to <build_folder>/<hash>/<relative path>, together with its
+    compressed variants (if the asset is compressible and compression makes it smaller).
+    Files which already exist in the build folder are not rewritten, since their path
+    identifies their contents.
+
+    Args:
+        static_folder:
+            The root folder of the static assets.
+        build_folder:
+            The folder to write the built assets to.
+
+    Returns:
+        A dictionary mapping the path of each asset (relative to the static folder,
+        using forward slashes) to the built Asset.
+    """
+    res = {}
+    for root, _, files in os.walk(static_folder):
+        for filename in files:
+            source_path = os.path.join(root, filename)
+            relative_path = os.path.relpath(source_path, static_folder).replace(os.sep, "/")
+            content_hash = get_content_hash(source_path)
+            target_path = os.path.join(build_folder, content_hash, *relative_path.split("/"))
+
+            data = None
+            if not os.path.exists(target_path):
+                with open(source_path, "rb") as f:
+                    data = f.read()
+                _write_file(target_path, data)
+
+            encodings = {}
+            if os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                for encoding, suffix, compress in _COMPRESSORS:
+                    compressed_path = target_path + suffix
+                    if not os.path.exists(compressed_path):
+                        if data is None:
+                            with open(source_path, "rb") as f:
+                                data = f.read()
+                        compressed = compress(data)
+                        if len(compressed) >= len(data):
+                            continue
+                        _write_file(compressed_path, compressed)
+                    encodings[encoding] = compressed_path
+
+            res[relative_path] = Asset(content_hash, target_path, encodings)
+    return res
+
+def select_encoding(asset: Asset, accept_encodings) -> Tuple[str, Optional[str]]:
+    """Selects the variant of an asset to serve, according to the encodings accepted by the client.
+
+    Args:
+        asset:
+            The built asset.
+        accept_encodings:
+            The parsed Accept-Encoding header of the request (a Werkzeug Accept object).
+
+    Returns:
+        A tuple of the path of the file to serve and its content encoding
+        (None for the uncompressed file).
+    """
+    for encoding, _, _ in _COMPRESSORS:
+        if encoding in asset.encodings and accept_encodings[encoding] > 0:
+            return asset.encodings[encoding], encoding
+    return asset.path, None
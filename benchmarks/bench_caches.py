@@ -0,0 +1,76 @@
+"""Stress test of the memory-bounded caches with a large synthetic user population.
+
+Simulates readers polling the filtered feed over several feed versions. Most readers share one of a
+few popular filters, while the rest follow their own unique filter. The rendered feeds are cached
+within the memory budget using each policy, reporting hit rates, evictions, rejected insertions and
+resident bytes.
+
+Usage:
+    python -m benchmarks.bench_caches [--users N] [--versions N] [--items N] [--budget-mb N]
+"""
+from benchmarks.common import generate_feed, generate_ctf_list
+from caches import CachePolicy, MemoryBudget
+from ctf_names import CtfNameSet
+from filter import ParsedFeed
+from formats import OutputFormat, render
+import argparse
+import random
+import resource
+import sys
+import time
+
+def generate_users(num_users: int, shared_ratio: float, num_shared: int, seed: int = 0):
+    """Generates the CTF name sets of the users: shared (Zipf-distributed popular) filters, and unique filters."""
+    rng = random.Random(seed)
+    shared = [CtfNameSet.from_names(generate_ctf_list(5, i)) for i in range(num_shared)]
+    weights = [1 / (rank + 1) for rank in range(num_shared)]
+    res = []
+    for uid in range(num_users):
+        if rng.random() < shared_ratio:
+            res.append(rng.choices(shared, weights)[0])
+        else:
+            res.append(CtfNameSet.from_names(generate_ctf_list(3, uid) + [f"ctf{uid}"]))
+    return res
+
+def main():
+    parser = argparse.ArgumentParser(description = "Stress test the memory-bounded caches.")
+    parser.add_argument("--users", type = int, default = 100000, help = "Amount of users")
+    parser.add_argument("--versions", type = int, default = 3, help = "Amount of feed versions")
+    parser.add_argument("--polls", type = float, default = 2, help = "Average amount of polls per user per feed version")
+    parser.add_argument("--items", type = int, default = 100, help = "Amount of items in the feed")
+    parser.add_argument("--budget-mb", type = float, default = 64, help = "Total memory budget (MiB)")
+    parser.add_argument("--shared-ratio", type = float, default = 0.7, help = "Ratio of users following a popular filter")
+    args = parser.parse_args()
+
+    users = generate_users(args.users, args.shared_ratio, 200)
+    rng = random.Random(1)
+    # Readers poll at different rates
+    activity = [rng.paretovariate(1.5) for _ in users]
+    feeds = [ParsedFeed(generate_feed(args.items, seed)) for seed in range(args.versions)]
+    polls = [rng.choices(range(len(users)), activity, k = int(len(users) * args.polls)) for _ in feeds]
+
+    print(f"{len(users)} users, {CtfNameSet.interned_count()} distinct filters, {args.versions} feed versions, "
+          f"{sum(len(p) for p in polls)} polls, budget {args.budget_mb} MiB\n")
+    print(f"{'Policy':<10}{'Hit rate':>10}{'Evictions':>11}{'Rejections':>12}{'Entries':>9}{'Resident (MiB)':>16}{'Time (s)':>10}")
+
+    for policy in CachePolicy:
+        budget = MemoryBudget(int(args.budget_mb * (1 << 20)))
+        cache = budget.create_cache("rendered_feeds", policy, sizeof = sys.getsizeof)
+        start = time.perf_counter()
+        for parsed_feed, version_polls in zip(feeds, polls):
+            for uid in version_polls:
+                key = (parsed_feed.version, users[uid], OutputFormat.RSS)
+                if cache.get(key) is None:
+                    cache.put(key, render(parsed_feed, parsed_feed.match(users[uid]), OutputFormat.RSS))
+            cache.evict(lambda key: key[0] != parsed_feed.version)
+        seconds = time.perf_counter() - start
+
+        stats = cache.stats
+        hit_rate = stats["hits"] / (stats["hits"] + stats["misses"])
+        print(f"{policy.value:<10}{hit_rate:>10.1%}{stats['evictions']:>11}{stats['rejections']:>12}{stats['entries']:>9}"
+              f"{stats['resident_bytes'] / (1 << 20):>16.1f}{seconds:>10.1f}")
+
+    print(f"\nPeak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Measures how parsing new versions of a large feed stalls concurrent request threads,
+parsing inline (GIL bound) versus offloaded to a FilterPool.
+
+While a thread parses a few new versions of the feed, request threads keep filtering an already
+parsed version for distinct CTF lists (as happens on rendered feed cache misses). The throughput
+of these requests, compared to their throughput while nothing is parsed, shows how much the
+parsing held the GIL.
+
+Usage:
+    python -m benchmarks.bench_filter_pool [--items N] [--versions N] [--threads N]
+"""
+from benchmarks.common import generate_feed, generate_ctf_list
+from ctf_names import CtfNameSet
+from filter import MatchMode, get_feed_version
+from filter_pool import FilterPool, is_gil_enabled, parse_feed
+from formats import OutputFormat, render
+from typing import Tuple
+import argparse
+import itertools
+import threading
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark offloading the parsing to worker processes.")
+    parser.add_argument("--items", type = int, default = 20000, help = "Amount of items in the feed")
+    parser.add_argument("--versions", type = int, default = 3, help = "Amount of new feed versions parsed")
+    parser.add_argument("--threads", type = int, default = 8, help = "Amount of concurrent request threads")
+    args = parser.parse_args()
+
+    parsed_feed = parse_feed(generate_feed(args.items), MatchMode.CASEFOLD)
+    feeds = [generate_feed(args.items, seed) for seed in range(1, args.versions + 1)]
+    ctf_lists = [CtfNameSet.from_names(generate_ctf_list(5, seed)) for seed in range(1000)]
+
+    def run(parse_func) -> Tuple[float, float]:
+        """Returns the total parse time, and the throughput of the requests meanwhile."""
+        stop = threading.Event()
+        lists = itertools.cycle(ctf_lists)
+        served = []
+
+        def serve():
+            while not stop.is_set():
+                render(parsed_feed, parsed_feed.match(next(lists)), OutputFormat.RSS)
+                served.append(None)
+
+        threads = [threading.Thread(target = serve) for _ in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        for feed in feeds:
+            parse_func(feed)
+        duration = time.perf_counter() - start
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return duration, len(served) / duration
+
+    print(f"Feed: {args.items} items ({len(feeds[0].encode()) / (1 << 20):.1f} MiB), {args.versions} versions, "
+          f"{args.threads} threads, GIL {'enabled' if is_gil_enabled() else 'disabled'}\n")
+    print(f"{'Mode':<12}{'Parse time (s)':>16}{'Requests/s':>12}{'Relative':>10}")
+
+    duration, baseline = run(lambda feed: time.sleep(1))
+    print(f"{'no parsing':<12}{'-':>16}{baseline:>12.1f}{1:>10.2f}")
+
+    duration, throughput = run(lambda feed: parse_feed(feed, MatchMode.CASEFOLD))
+    print(f"{'inline':<12}{duration:>16.2f}{throughput:>12.1f}{throughput / baseline:>10.2f}")
+
+    pool = FilterPool(1, min_feed_size = 0)
+    try:
+        # Warm up: start the worker
+        pool.parse(parsed_feed.version, generate_feed(1))
+        duration, throughput = run(lambda feed: pool.parse(get_feed_version(feed), feed))
+    finally:
+        pool.close()
+    print(f"{'pool':<12}{duration:>16.2f}{throughput:>12.1f}{throughput / baseline:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Compares the render time and size of the different output formats.
+
+Usage:
+    python -m benchmarks.bench_formats [--items N] [--names N]
+"""
+from benchmarks.common import generate_feed, generate_ctf_list, measure
+from filter import ParsedFeed, filter_writeups
+from formats import OutputFormat, render
+import argparse
+import gzip
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the feed output formats.")
+    parser.add_argument("--items", type = int, default = 500, help = "Amount of items in the feed")
+    parser.add_argument("--names", type = int, default = 5, help = "Amount of CTF names in the filter")
+    args = parser.parse_args()
+
+    feed = generate_feed(args.items)
+    ctf_list = generate_ctf_list(args.names)
+    parsed_feed = ParsedFeed(feed)
+    indices = parsed_feed.match(ctf_list)
+
+    print(f"Feed: {args.items} items ({len(feed.encode())} bytes), {len(indices)} matching {args.names} names\n")
+    print(f"{'Format':<28}{'Render (ms)':>14}{'Bytes':>10}{'Gzipped':>10}")
+
+    rows = [("RSS (parse + filter)", lambda: filter_writeups(feed, ctf_list))]
+    for output_format in OutputFormat:
+        rows.append((f"{output_format.name} (pre-parsed)", lambda f = output_format: render(parsed_feed, indices, f)))
+
+    for name, func in rows:
+        seconds, content = measure(func)
+        data = content.encode()
+        print(f"{name:<28}{seconds * 1000:>14.3f}{len(data):>10}{len(gzip.compress(data)):>10}")
+
+if __name__ == "__main__":
+    main()
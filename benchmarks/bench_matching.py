@@ -0,0 +1,36 @@
+"""Compares the cost of the title matching modes, showing that title normalization is amortized.
+
+Title normalization is done once per feed version (see filter.ParsedFeed.normalized_titles),
+so its cost is divided between all the users filtering the same version of the feed.
+
+Usage:
+    python -m benchmarks.bench_matching [--items N] [--users N]
+"""
+from benchmarks.common import generate_feed, generate_ctf_list, measure
+from ctf_names import CtfNameSet
+from filter import ParsedFeed, MatchMode
+import argparse
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the title matching modes.")
+    parser.add_argument("--items", type = int, default = 500, help = "Amount of items in the feed")
+    parser.add_argument("--users", type = int, default = 1000, help = "Amount of users filtering each feed version")
+    args = parser.parse_args()
+
+    feed = generate_feed(args.items)
+    parsed_feed = ParsedFeed(feed)
+    ctf_lists = [CtfNameSet.from_names(generate_ctf_list(5, seed)) for seed in range(args.users)]
+
+    print(f"Feed: {args.items} items, {args.users} users per feed version\n")
+    print(f"{'Mode':<12}{'Normalize (ms)':>16}{'Match/user (ms)':>18}{'Amortized/user (ms)':>22}")
+
+    for mode in MatchMode:
+        normalize_seconds, _ = measure(lambda: [mode.normalize(title) for title in parsed_feed.titles], repeat = 20)
+        parsed_feed.normalized_titles(mode)
+        match_seconds, _ = measure(lambda: [parsed_feed.match(ctf_list, mode) for ctf_list in ctf_lists], repeat = 5)
+        match_seconds /= len(ctf_lists)
+        amortized = match_seconds + normalize_seconds / len(ctf_lists)
+        print(f"{mode.value:<12}{normalize_seconds * 1000:>16.3f}{match_seconds * 1000:>18.4f}{amortized * 1000:>22.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Shared helpers for the benchmarks.
+
+The benchmarks are executed from the repository root as modules, e.g.:
+
+    python -m benchmarks.bench_formats
+"""
+from typing import Callable, List, Tuple
+from xml.sax.saxutils import escape
+import random
+import string
+import time
+
+# A list of CTF names in the spirit of the real feed
+CTF_NAMES = ["DEF CON CTF Qualifier", "HITCON CTF", "PlaidCTF", "Google CTF", "0CTF/TCTF",
+             "DiceCTF", "corCTF", "UIUCTF", "picoCTF", "SECCON CTF", "hxp CTF", "Pwn2Win CTF",
+             "ASIS CTF Quals", "Balsn CTF", "RealWorld CTF", "justCTF", "ImaginaryCTF", "BSides CTF"]
+
+def _get_random_word(rng: random.Random, length: int = 6) -> str:
+    return ''.join(rng.choice(string.ascii_letters) for _ in range(length))
+
+def generate_feed(num_items: int, seed: int = 0) -> str:
+    """Generates a synthetic CTFTime writeups RSS feed with the given amount of items."""
+    rng = random.Random(seed)
+    items = []
+    for _ in range(num_items):
+        link = "https://ctftime.org/writeup/" + str(rng.randrange(10000, 99999))
+        title = f"{rng.choice(CTF_NAMES)} {rng.randrange(2015, 2027)} / {_get_random_word(rng)} team {_get_random_word(rng)}"
+        items.append(f"""
+        <item>
+            <title>{escape(title)}</title>
+            <link>{link}</link>
+            <description>{" ".join(_get_random_word(rng) for _ in range(20))}</description>
+            <guid>{link}</guid>
+            <original_url>https://example.com/{_get_random_word(rng)}</original_url>
+        </item>""")
+
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<rss xmlns:atom="http://www.w3.org/2005/Atom" version="2.0">
+    <channel>
+        <title>CTFtime.org: New writeups</title>
+        <link>https://ctftime.org/writeups/rss/</link>
+        <description>CTFtime.org: CTF Task writeups feed.</description>
+        <atom:link href="https://ctftime.org/writeups/rss/" rel="self"></atom:link>
+        <language>en-us</language>
+        <lastBuildDate>Sat, 21 Nov 2020 17:56:26 -0000</lastBuildDate>{"".join(items)}
+    </channel>
+</rss>
+"""
+
+def generate_ctf_list(num_names: int, seed: int = 0) -> List[str]:
+    """Generates a random list of CTF names, as stored for a user."""
+    rng = random.Random(seed)
+    return rng.sample(CTF_NAMES, num_names)
+
+def measure(func: Callable[[], object], repeat: int = 200) -> Tuple[float, object]:
+    """Executes func repeatedly, returning the mean execution time (in seconds) and the last result."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        res = func()
+    end = time.perf_counter()
+    return (end - start) / repeat, res
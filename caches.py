@@ -0,0 +1,340 @@
+"""Memory-bounded caches.
+
+All the in-memory caches of the application share a single memory budget, configured in one place:
+the total budget is read from the environment (CACHE_MEMORY_BUDGET_MB), and is split between the
+caches by CACHE_BUDGET_SHARES. Each cache tracks the approximate size (in bytes) of its entries,
+and evicts entries once its share of the budget is exceeded.
+
+Two policies are supported:
+  - LRU: Evicts the least recently used entries.
+  - TINYLFU: LRU eviction, with TinyLFU-style admission: when inserting an entry requires evicting
+    others, the entry is only admitted if it was requested more frequently than the entries it
+    would evict. Access frequencies are approximated by a compact count-min sketch, which is
+    periodically halved so that old popularity fades. This keeps one-off entries (e.g. filters
+    polled by a single reader) from flushing popular ones.
+"""
+from collections import OrderedDict
+from enum import Enum
+from types import FunctionType, ModuleType
+from typing import Callable, Dict, Hashable, Optional
+import os
+import sys
+import threading
+
+# Environment variable holding the total memory budget (in MiB) of the caches
+ENV_CACHE_MEMORY_BUDGET = "CACHE_MEMORY_BUDGET_MB"
+DEFAULT_CACHE_MEMORY_BUDGET_MB = 64
+
+# Share of the total memory budget of each cache
+CACHE_BUDGET_SHARES = {
+    "parsed_feeds":     0.3,
+    "rendered_feeds":   0.5,
+    "last_responses":   0.2,
+}
+
+# Approximate memory overhead (in bytes) of a cache entry, in addition to its value
+ENTRY_OVERHEAD = 200
+
+class CacheException(Exception):
+    """Represents an exception thrown by the caches module."""
+    pass
+
+class CachePolicy(Enum):
+    """Eviction and admission policies."""
+    LRU         = "lru"
+    TINYLFU     = "tinylfu"
+
+_ATOMIC_TYPES = (str, bytes, bytearray, int, float, bool, type(None))
+_SKIPPED_TYPES = (type, Enum, ModuleType, FunctionType)
+
+def estimate_size(obj: object) -> int:
+    """Returns the approximate memory size (in bytes) of an object, including the objects it references.
+
+    Objects referenced more than once are counted once. Classes, enum members, modules and functions
+    are shared by the whole process, and aren't counted.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while len(stack) > 0:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SKIPPED_TYPES):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, _ATOMIC_TYPES):
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        else:
+            if hasattr(o, "__dict__"):
+                stack.append(o.__dict__)
+            for cls in type(o).__mro__:
+                for slot in getattr(cls, "__slots__", ()):
+                    if slot not in ("__dict__", "__weakref__") and hasattr(o, slot):
+                        stack.append(getattr(o, slot))
+    return total
+
+class _FrequencySketch(object):
+    """A count-min sketch of access frequencies, with 4-bit counters which are halved periodically."""
+
+    _DEPTH = 4
+    _SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5)
+    _MAX_COUNT = 15
+
+    def __init__(self, width: int):
+        """Initialize the sketch. The width is rounded up to a power of 2."""
+        self._width = 1 << max(6, (width - 1).bit_length())
+        self._mask = self._width - 1
+        self._rows = [bytearray(self._width) for _ in range(self._DEPTH)]
+        self._additions = 0
+        self._sample_size = 10 * self._width
+
+    def _indices(self, key: Hashable):
+        h = hash(key)
+        for seed in self._SEEDS:
+            yield (((h ^ seed) * 0x9E3779B1) >> 16) & self._mask
+
+    def increment(self, key: Hashable) -> None:
+        for row, index in zip(self._rows, self._indices(key)):
+            if row[index] < self._MAX_COUNT:
+                row[index] += 1
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._age()
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[index] for row, index in zip(self._rows, self._indices(key)))
+
+    def _age(self) -> None:
+        """Halves all the counters, so that the sketch reflects recent frequencies."""
+        for row in self._rows:
+            row[:] = bytes(count >> 1 for count in row)
+        self._additions //= 2
+
+class BoundedCache(object):
+    """A thread-safe cache bounded by the approximate memory size of its entries."""
+
+    def __init__(self, name: str, max_bytes: int, policy: CachePolicy = CachePolicy.LRU,
+                 max_entries: Optional[int] = None, sizeof: Callable[[object], int] = estimate_size):
+        """Initialize the cache.
+
+        Args:
+            name:
+                The name of the cache, for reporting.
+            max_bytes:
+                The maximal total size (in bytes) of the entries.
+            policy:
+                The eviction and admission policy.
+            max_entries:
+                An optional maximal amount of entries.
+            sizeof:
+                Returns the approximate size (in bytes) of a value.
+        """
+        self._name = name
+        self._max_bytes = max_bytes
+        self._policy = policy
+        self._max_entries = max_entries
+        self._sizeof = sizeof
+
+        # Maps each key to (value, size), by order of use
+        self._entries = OrderedDict()
+        self._resident_bytes = 0
+        self._sketch = _FrequencySketch(max_entries or max(1024, max_bytes // 4096)) if policy == CachePolicy.TINYLFU else None
+        self._lock = threading.Lock()
+        self._stats = dict(hits = 0, misses = 0, evictions = 0, rejections = 0)
+
+    @property
+    def name(self) -> str:
+        """The name of the cache."""
+        return self._name
+
+    @property
+    def max_bytes(self) -> int:
+        """The maximal total size (in bytes) of the entries."""
+        return self._max_bytes
+
+    @property
+    def resident_bytes(self) -> int:
+        """The approximate total size (in bytes) of the entries."""
+        with self._lock:
+            return self._resident_bytes
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """The amount and total size of the entries, and counters of hits, misses, evictions and rejected insertions."""
+        with self._lock:
+            return dict(self._stats, entries = len(self._entries), resident_bytes = self._resident_bytes,
+                        max_bytes = self._max_bytes)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: Hashable, default: object = None) -> object:
+        """Returns the value cached for the given key, or the default value if missing."""
+        with self._lock:
+            if self._sketch is not None:
+                self._sketch.increment(key)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: object, size: Optional[int] = None) -> bool:
+        """Caches a value, evicting other entries if needed.
+
+        Args:
+            key:
+                The key.
+            value:
+                The value.
+            size:
+                The approximate size (in bytes) of the value. Estimated if missing.
+
+        Returns:
+            True if the value was cached, False if it wasn't admitted (see CachePolicy).
+        """
+        size = (size if size is not None else self._sizeof(value)) + ENTRY_OVERHEAD
+        with self._lock:
+            if size > self._max_bytes:
+                self._stats["rejections"] += 1
+                return False
+
+            existing = self._entries.pop(key, None)
+            if existing is not None:
+                self._resident_bytes -= existing[1]
+
+            # Find the least recently used entries which must be evicted to make room
+            victims = []
+            freed = 0
+            max_entries = self._max_entries if self._max_entries is not None else sys.maxsize
+            for victim_key, (_, victim_size) in self._entries.items():
+                if (self._resident_bytes - freed + size <= self._max_bytes
+                    and len(self._entries) - len(victims) < max_entries):
+                    break
+                victims.append(victim_key)
+                freed += victim_size
+
+            if existing is None and len(victims) > 0 and self._sketch is not None:
+                candidate_frequency = self._sketch.estimate(key)
+                if any(self._sketch.estimate(victim_key) >= candidate_frequency for victim_key in victims):
+                    self._stats["rejections"] += 1
+                    return False
+
+            for victim_key in victims:
+                self._resident_bytes -= self._entries.pop(victim_key)[1]
+            self._stats["evictions"] += len(victims)
+
+            self._entries[key] = (value, size)
+            self._resident_bytes += size
+            return True
+
+    def __setitem__(self, key: Hashable, value: object) -> None:
+        self.put(key, value)
+
+    def pop(self, key: Hashable, default: object = None) -> object:
+        """Removes the entry of the given key, returning its value (or the default value if missing)."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._resident_bytes -= entry[1]
+            return entry[0]
+
+    def evict(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Evicts the entries whose keys match the given predicate.
+
+        Returns:
+            The amount of evicted entries.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._resident_bytes -= self._entries.pop(key)[1]
+            self._stats["evictions"] += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        """Removes all the entries."""
+        with self._lock:
+            self._entries.clear()
+            self._resident_bytes = 0
+
+class MemoryBudget(object):
+    """The memory budget shared by the caches of the application, see CACHE_BUDGET_SHARES."""
+
+    def __init__(self, total_bytes: int, shares: Dict[str, float] = CACHE_BUDGET_SHARES):
+        """Initialize the budget.
+
+        Args:
+            total_bytes:
+                The total memory budget (in bytes) of the caches.
+            shares:
+                The share of the total budget of each cache, by name.
+        """
+        if sum(shares.values()) > 1:
+            raise CacheException("The cache budget shares exceed the total budget")
+        self._total_bytes = total_bytes
+        self._shares = shares
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls) -> "MemoryBudget":
+        """Returns a budget of the total size set in the environment."""
+        return cls(int(float(os.environ.get(ENV_CACHE_MEMORY_BUDGET, DEFAULT_CACHE_MEMORY_BUDGET_MB)) * (1 << 20)))
+
+    @property
+    def total_bytes(self) -> int:
+        """The total memory budget (in bytes) of the caches."""
+        return self._total_bytes
+
+    @property
+    def resident_bytes(self) -> int:
+        """The approximate total size (in bytes) of the entries of all the caches."""
+        with self._lock:
+            caches = list(self._caches.values())
+        return sum(cache.resident_bytes for cache in caches)
+
+    def create_cache(self, name: str, policy: CachePolicy = CachePolicy.LRU, max_entries: Optional[int] = None,
+                     sizeof: Callable[[object], int] = estimate_size) -> BoundedCache:
+        """Creates a cache, bounded by its share of the budget.
+
+        Args:
+            name:
+                The name of the cache, which must appear in the budget shares.
+            policy:
+                The eviction and admission policy.
+            max_entries:
+                An optional maximal amount of entries.
+            sizeof:
+                Returns the approximate size (in bytes) of a value.
+
+        Raises:
+            CacheException: The cache has no share of the budget, or was already created.
+        """
+        if name not in self._shares:
+            raise CacheException(f"No memory budget share for cache {name}")
+        with self._lock:
+            if name in self._caches:
+                raise CacheException(f"Cache {name} was already created")
+            cache = BoundedCache(name, int(self._total_bytes * self._shares[name]), policy, max_entries, sizeof)
+            self._caches[name] = cache
+        return cache
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Returns the statistics of each cache, by name (see BoundedCache.stats)."""
+        with self._lock:
+            caches = dict(self._caches)
+        return {name: cache.stats for name, cache in caches.items()}
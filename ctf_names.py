@@ -0,0 +1,88 @@
+"""A compact, normalized representation of a user's CTF names.
+
+Many users follow the same CTFs, and therefore store the same (or equivalent) lists of
+CTF names. This module normalizes such lists into immutable sets of casefolded names,
+and interns them: equivalent lists are represented by the very same CtfNameSet object,
+and each distinct name is stored only once in memory.
+
+Since sets are interned, comparing them is O(1) (by identity), and their hash is computed
+once from their names, which makes them efficient keys for caches holding per-filter results.
+The hash being derived from the names, it stays the same when a set is released and
+interned again (e.g. for the frequency sketch of caches.CachePolicy.TINYLFU).
+A name set stays interned only while it is referenced (e.g. by a cache entry), so the
+interned sets don't grow with the amount of users over time.
+"""
+import sys
+import threading
+import weakref
+from typing import Dict, Iterable, Iterator, Tuple
+
+def normalize_name(name: str) -> str:
+    """Returns the normalized (casefolded) form of a CTF name."""
+    return name.casefold()
+
+class CtfNameSet(object):
+    """An immutable, normalized and interned set of CTF names.
+
+    Use CtfNameSet.from_names() to create instances. The names are casefolded, deduplicated
+    and sorted, and empty names are dropped. Equality is by identity, which is safe since equivalent
+    sets are always represented by the same instance. The hash is derived from the names.
+    """
+    __slots__ = ("_names", "_hash", "__weakref__")
+
+    # Maps each normalized tuple of names to its canonical instance, while the instance is referenced
+    _interned: Dict[Tuple[str, ...], "CtfNameSet"] = weakref.WeakValueDictionary()
+    _interned_lock = threading.Lock()
+
+    def __init__(self, names: Tuple[str, ...]):
+        """Initialize a name set. Should only be called by from_names()."""
+        self._names = names
+        self._hash = hash(names)
+
+    @classmethod
+    def from_names(cls, names: Iterable[str]) -> "CtfNameSet":
+        """Returns the interned name set for the given names.
+
+        Args:
+            names:
+                CTF names, as entered by the user.
+
+        Returns:
+            The canonical CtfNameSet holding the normalized names.
+        """
+        normalized = tuple(sorted({normalize_name(name) for name in names} - {''}))
+        with cls._interned_lock:
+            res = cls._interned.get(normalized)
+            if res is None:
+                res = cls(tuple(sys.intern(name) for name in normalized))
+                cls._interned[normalized] = res
+        return res
+
+    @classmethod
+    def interned_count(cls) -> int:
+        """Returns the amount of distinct name sets currently interned."""
+        return len(cls._interned)
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        """The normalized names, sorted."""
+        return self._names
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._names
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __reduce__(self):
+        # Re-intern when unpickled (e.g. in another process)
+        return (CtfNameSet.from_names, (self._names,))
+
+    def __repr__(self) -> str:
+        return f"CtfNameSet({list(self._names)!r})"
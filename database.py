@@ -7,6 +7,7 @@ while hiding the Firebase specifics.
 expose some implementation details in the form of constants which are propagated to the frontend 
 implementation).
 """
+import atexit
 import os
 import re
 import base64
@@ -15,7 +16,10 @@ import json
 import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import db
-from typing import List
+from collections import namedtuple
+from typing import Dict, Iterable, Optional, Set, Tuple
+from ctf_names import CtfNameSet
+from resilience import ResilienceException, ResilientReader, UserListSnapshot
 
 """
 The Firebase Realtime Database is built as a large JSON structure.
@@ -37,6 +41,10 @@ The main reason for choosing such a structure is the fact that Firebase do not p
 for limiting the number of children for a given key, but they do allow limiting the length of a value.
 Therefore, in order to be able to set limits, the ctf_names list length is limited via the Realtime
 Database Rules (see below). 
+
+A user may also have a "webhook_url" child key, holding a URL to which newly published writeups 
+matching the user's CTF names are pushed (see webhooks.py), and a "webhook_secret" child key, holding
+the secret (generated by the frontend) which the deliveries are signed with.
 """
 
 
@@ -44,9 +52,25 @@ ENTRY_SEPARATOR = "␞" # Used to separate entries in the database
 
 # Definitions for paths in the database
 UID_PLACEHOLDER = "##UID##"
-PATH_TO_USER_DATA = "data/" + UID_PLACEHOLDER + "/"
+PATH_TO_ALL_USER_DATA = "data"
+PATH_TO_USER_DATA = PATH_TO_ALL_USER_DATA + "/" + UID_PLACEHOLDER + "/"
 KEY_USER_CTF_NAMES = "ctf_names"
 PATH_TO_CTF_NAMES = PATH_TO_USER_DATA + KEY_USER_CTF_NAMES
+KEY_USER_WEBHOOK_URL = "webhook_url"
+KEY_USER_WEBHOOK_SECRET = "webhook_secret"
+
+# A user's subscription to push notifications: The webhook URL, the webhook secret and the normalized set of CTF names
+Subscription = namedtuple("Subscription", "webhook_url webhook_secret ctf_names")
+
+# Maximal duration (in seconds) of a single HTTP request to the database. Reads are bounded further by the
+# reader (see resilience.py), but attempts which outlive their read only release their thread after this timeout
+HTTP_TIMEOUT = 30
+
+# Maximal total duration (in seconds) of reading the data of all users
+ALL_USER_DATA_READ_TIMEOUT = 25
+
+# When set, the database is accessed through the given local emulator (or stand-in) instead of Firebase
+ENV_EMULATOR_HOST = "FIREBASE_DATABASE_EMULATOR_HOST"
 
 
 class DatabaseException(Exception):
@@ -94,7 +118,7 @@ def _is_legal_key(key: str):
     """
     return not _INVALID_KEY_CHARS.search(key)
 
-def get_ctf_names(uid: str) -> List[str]:
+def get_ctf_names(uid: str) -> CtfNameSet:
     """Returns the list of CTF Names for a give user
 
     Args:
@@ -102,7 +126,7 @@ def get_ctf_names(uid: str) -> List[str]:
             The user ID for the requested user
     
     Returns:
-        A list containing the CTF names for the given user
+        The normalized set of CTF names for the given user
 
     Raises:
         ValueError: User ID is not legal
@@ -113,36 +137,122 @@ def get_ctf_names(uid: str) -> List[str]:
         raise ValueError(f"Invalid DB key: {uid}")
     
     ref = db.reference(PATH_TO_CTF_NAMES.replace(UID_PLACEHOLDER, uid))
-    ctf_names = ref.get()
+    try:
+        # Falls back to the snapshot of user lists if the database is slow or unavailable
+        ctf_names = _reader.read_user_list(uid, ref.get)
+    except ResilienceException as e:
+        raise DatabaseException(f"Failed to read CTF names for user {uid}") from e
     if ctf_names is None:
         raise DatabaseException(f"Unknown user: {uid}")
 
-    res = ctf_names.split(ENTRY_SEPARATOR)
+    res = CtfNameSet.from_names(ctf_names.split(ENTRY_SEPARATOR))
 
     return res
 
+def get_ctf_names_bulk(uids: Iterable[str]) -> Tuple[Dict[str, CtfNameSet], Set[str]]:
+    """Returns the lists of CTF Names for multiple users.
+
+    Only the lists of the given users are read (concurrently), so the cost grows with the
+    amount of users rather than with the amount of users in the database.
+
+    Args:
+        uids:
+            The user IDs for the requested users
+    
+    Returns:
+        A dictionary mapping each known user ID to the normalized set of CTF names for that user
+        (unknown users are omitted), and the set of user IDs whose list is currently unavailable.
+        If the database is slow or unavailable, the lists are read from the snapshot of user lists,
+        and the users missing from it are unavailable.
+
+    Raises:
+        ValueError: One of the user IDs is not legal
+
+    """
+    uids = set(uids)
+    for uid in uids:
+        if not _is_legal_key(uid):
+            raise ValueError(f"Invalid DB key: {uid}")
+
+    def read_ctf_names(uid: str) -> Optional[str]:
+        return db.reference(PATH_TO_CTF_NAMES.replace(UID_PLACEHOLDER, uid)).get()
+
+    user_lists = _reader.read_user_lists(uids, read_ctf_names)
+    return ({uid: CtfNameSet.from_names(ctf_names.split(ENTRY_SEPARATOR)) for uid, ctf_names in user_lists.lists.items()},
+            user_lists.unavailable)
+
+def get_subscriptions() -> Dict[str, Subscription]:
+    """Returns the subscriptions of all users who registered a webhook URL and secret, using a single database read.
+
+    Returns:
+        A dictionary mapping the user ID of each subscribed user to the user's subscription.
+
+    Raises:
+        DatabaseException: Unable to retrive the user data
+    """
+    try:
+        users_data = _reader.read(db.reference(PATH_TO_ALL_USER_DATA).get, timeout = ALL_USER_DATA_READ_TIMEOUT) or {}
+    except ResilienceException as e:
+        raise DatabaseException("Failed to read user data") from e
+
+    res = {}
+    for uid, user_data in users_data.items():
+        webhook_url = user_data.get(KEY_USER_WEBHOOK_URL)
+        webhook_secret = user_data.get(KEY_USER_WEBHOOK_SECRET)
+        ctf_names = user_data.get(KEY_USER_CTF_NAMES)
+        if webhook_url and webhook_secret and ctf_names is not None:
+            res[uid] = Subscription(webhook_url, webhook_secret, CtfNameSet.from_names(ctf_names.split(ENTRY_SEPARATOR)))
+
+    return res
+
+def get_read_metrics() -> Dict[str, int]:
+    """Returns counters of the database reads, including reads served from the snapshot of user lists.
+
+    See ResilientReader.metrics.
+    """
+    return _reader.metrics
+
 # Setup DB Access:
-cred = credentials.Certificate(_get_private_key())
-firebase_admin.initialize_app(cred, {
+_options = {
     'databaseURL': 'https://ctftime-writeups.firebaseio.com',
     'databaseAuthVariableOverride': {
         'uid': 'feed-reader'
-    }
-})
+    },
+    'httpTimeout': HTTP_TIMEOUT
+}
+if os.environ.get(ENV_EMULATOR_HOST):
+    # The emulator doesn't check credentials
+    firebase_admin.initialize_app(options = _options)
+else:
+    firebase_admin.initialize_app(credentials.Certificate(_get_private_key()), _options)
+
+_reader = ResilientReader(snapshot = UserListSnapshot.from_environment())
+atexit.register(_reader.snapshot.persist)
 
 # Maximum length of the ctf_names DB entry for a given user (composed of the list of names separated by the record separator)
 MAX_CTF_NAMES_LENGTH = 620 # Needs to be kept in sync with Realtime Database Rules
+# Maximum length of the webhook_url DB entry for a given user
+MAX_WEBHOOK_URL_LENGTH = 512 # Needs to be kept in sync with Realtime Database Rules
+# Length of the webhook_secret DB entry for a given user (hex encoded 256 bit secret)
+WEBHOOK_SECRET_LENGTH = 64 # Needs to be kept in sync with Realtime Database Rules
 # Realtime Database Rules:
 """
 {
   "rules": {
     "data" : {
+          ".read" : "auth != null && auth.uid === 'feed-reader'",
           "$uid" : {
              ".read" : "auth != null && (auth.uid == $uid || auth.uid === 'feed-reader')" ,
              ".write" : "auth != null && auth.uid == $uid",
              "ctf_names": {
              			".validate": "newData.isString() && newData.val().length < 620"
              },
+             "webhook_url": {
+             			".validate": "newData.isString() && newData.val().beginsWith('https://') && newData.val().length < 512"
+             },
+             "webhook_secret": {
+             			".validate": "newData.isString() && newData.val().matches(/^[0-9a-f]{64}$/)"
+             },
              "$other": { ".validate": false }
            }
       }
@@ -0,0 +1,159 @@
+"""Access to the upstream CTFTime writeups RSS feed.
+
+Besides fetching the feed, this module can capture every fetched snapshot of the feed to a
+local directory (see FeedRecorder), in order to build realistic, reproducible workloads
+for offline benchmarking (see replay.py).
+"""
+from collections import namedtuple
+from typing import Iterator, Optional
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+
+WRITEUPS_FEED_URL = "https://ctftime.org/writeups/rss/"
+
+REQUEST_HEADERS = {
+    'User-Agent': 'CTFTime Writeups Filter 1.0',
+}
+
+# Content type expected from the upstream feed
+EXPECTED_CONTENT_TYPE = "application/rss+xml"
+
+# Timeouts (in seconds) for connecting to CTFTime and for each read of the response, so that a
+# hung connection can't stall the request threads, nor the loops polling the feed (streams, webhooks)
+FETCH_TIMEOUT = (5, 15)
+
+# A snapshot of the upstream feed
+UpstreamFeed = namedtuple("UpstreamFeed", "text status_code content_type last_modified")
+
+class FeedException(Exception):
+    """Represents an exception thrown by the feed module."""
+    pass
+
+def fetch_feed() -> UpstreamFeed:
+    """Fetches the current CTFTime writeups RSS feed.
+
+    Returns:
+        An UpstreamFeed holding the feed XML, the HTTP status code, the content type and
+        the Last-Modified header (None if missing).
+
+    Raises:
+        FeedException: The feed could not be fetched or has an unexpected content type.
+    """
+    try:
+        r = requests.get(WRITEUPS_FEED_URL, headers = REQUEST_HEADERS, timeout = FETCH_TIMEOUT)
+    except requests.RequestException as e:
+        raise FeedException("Failed to fetch feed from CTFTime") from e
+
+    content_type = r.headers.get('content-type', '')
+    if (not content_type.startswith(EXPECTED_CONTENT_TYPE)):
+        raise FeedException("Invalid content type received from CTFTime: {}".format(content_type))
+
+    return UpstreamFeed(r.text, r.status_code, content_type, r.headers.get('last-modified'))
+
+# Environment variable holding the directory to which upstream snapshots are captured
+ENV_CAPTURE_DIR = "FEED_CAPTURE_DIR"
+
+# A captured fetch of the upstream feed: The fetch time (seconds since the epoch),
+# the SHA-256 digest of the feed text and the fetched feed
+CapturedFeed = namedtuple("CapturedFeed", "time digest upstream")
+
+_CAPTURE_INDEX = "index.jsonl"
+_CAPTURE_SNAPSHOTS = "snapshots"
+
+class FeedRecorder(object):
+    """Captures fetched snapshots of the upstream feed to a directory.
+
+    The directory layout is:
+        index.jsonl:
+            A line per fetch, holding the fetch time, the digest of the feed and
+            the response metadata.
+        snapshots/<digest>.xml.gz:
+            The compressed feed text, stored once per distinct snapshot.
+    """
+
+    def __init__(self, capture_dir: str):
+        """Initialize a recorder.
+
+        Args:
+            capture_dir:
+                The directory to capture to. Created if missing.
+        """
+        self._capture_dir = capture_dir
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(capture_dir, _CAPTURE_SNAPSHOTS), exist_ok = True)
+
+    @classmethod
+    def from_environment(cls) -> Optional["FeedRecorder"]:
+        """Returns a recorder capturing to the directory set in the environment, or None if capturing isn't enabled."""
+        capture_dir = os.environ.get(ENV_CAPTURE_DIR)
+        if not capture_dir:
+            return None
+        return cls(capture_dir)
+
+    def record(self, upstream: UpstreamFeed, fetch_time: Optional[float] = None) -> str:
+        """Captures a snapshot of the upstream feed.
+
+        Args:
+            upstream:
+                The fetched feed.
+            fetch_time:
+                The time of the fetch, in seconds since the epoch. Defaults to the current time.
+
+        Returns:
+            The digest identifying the snapshot.
+        """
+        data = upstream.text.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        snapshot_path = os.path.join(self._capture_dir, _CAPTURE_SNAPSHOTS, f"{digest}.xml.gz")
+        if not os.path.exists(snapshot_path):
+            tmp_path = f"{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(gzip.compress(data))
+            os.replace(tmp_path, snapshot_path)
+
+        entry = dict(time = fetch_time if fetch_time is not None else time.time(),
+                     digest = digest,
+                     status_code = upstream.status_code,
+                     content_type = upstream.content_type,
+                     last_modified = upstream.last_modified)
+        with self._lock:
+            with open(os.path.join(self._capture_dir, _CAPTURE_INDEX), "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+        return digest
+
+def load_captured_feeds(capture_dir: str) -> Iterator[CapturedFeed]:
+    """Loads the fetches captured by a FeedRecorder, in the order they were captured.
+
+    Args:
+        capture_dir:
+            The capture directory.
+
+    Returns:
+        An iterator of CapturedFeed entries.
+
+    Raises:
+        FeedException: The capture directory is missing or corrupt.
+    """
+    # Consecutive fetches usually return the same snapshot, so the last snapshot is kept loaded
+    last_digest, last_text = None, None
+    try:
+        with open(os.path.join(capture_dir, _CAPTURE_INDEX)) as index:
+            for line in index:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                digest = entry["digest"]
+                if digest != last_digest:
+                    with open(os.path.join(capture_dir, _CAPTURE_SNAPSHOTS, f"{digest}.xml.gz"), "rb") as f:
+                        last_digest, last_text = digest, gzip.decompress(f.read()).decode()
+                upstream = UpstreamFeed(last_text, entry["status_code"],
+                                        entry["content_type"], entry["last_modified"])
+                yield CapturedFeed(entry["time"], digest, upstream)
+    except (OSError, ValueError, KeyError) as e:
+        raise FeedException(f"Failed to load captured feeds from {capture_dir}") from e
@@ -0,0 +1,95 @@
+"""Caching layers for the filtered writeups feed.
+
+The upstream feed changes rarely compared to the rate at which it is requested, and many users
+share the same filters. Therefore, the feed is parsed once per version, and each rendered output
+is cached by feed version, (normalized) CTF names and output format.
+Both caches are bounded by their share of the memory budget (see caches.py). The most recently
+parsed version is always kept, even if it doesn't fit in the share of the parsed feeds.
+"""
+from caches import CachePolicy, MemoryBudget, estimate_size
+from ctf_names import CtfNameSet
+from filter_pool import FilterPool, parse_feed
+from typing import Dict, Optional
+import filter
+import formats
+import logging
+import sys
+
+# Maximal amount of upstream feed versions to keep parsed in memory
+PARSED_FEEDS_CACHE_SIZE = 2
+
+logger = logging.getLogger(__name__)
+
+class FeedCache(object):
+    """A thread-safe cache of parsed upstream feeds and rendered filtered feeds."""
+
+    def __init__(self, match_mode: filter.MatchMode = filter.MatchMode.CASEFOLD, filter_pool: Optional[FilterPool] = None,
+                 memory_budget: Optional[MemoryBudget] = None):
+        """Initialize the cache.
+
+        Args:
+            match_mode:
+                The mode used for matching CTF names to titles.
+            filter_pool:
+                A pool to offload the parsing of large feeds to (see filter_pool.py).
+                If None, feeds are always parsed inline.
+            memory_budget:
+                The memory budget to create the caches from. If None, a budget is configured
+                from the environment.
+        """
+        memory_budget = memory_budget or MemoryBudget.from_environment()
+        self._match_mode = match_mode
+        self._filter_pool = filter_pool
+        self._parsed_feeds = memory_budget.create_cache("parsed_feeds", CachePolicy.LRU, max_entries = PARSED_FEEDS_CACHE_SIZE)
+        # Most filters are polled by a single reader, so admission favors the filters shared by many readers
+        self._rendered_feeds = memory_budget.create_cache("rendered_feeds", CachePolicy.TINYLFU, sizeof = sys.getsizeof)
+        # The most recently parsed feed, kept even if it wasn't admitted to the parsed feeds cache
+        self._latest_feed = None
+
+    @property
+    def match_mode(self) -> filter.MatchMode:
+        """The mode used for matching CTF names to titles."""
+        return self._match_mode
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counters of the parsed and rendered feed caches."""
+        parsed_stats = self._parsed_feeds.stats
+        rendered_stats = self._rendered_feeds.stats
+        return dict(parsed_hits = parsed_stats["hits"], parsed_misses = parsed_stats["misses"],
+                    rendered_hits = rendered_stats["hits"], rendered_misses = rendered_stats["misses"])
+
+    def get_parsed_feed(self, feed: str) -> filter.ParsedFeed:
+        """Returns the parsed feed, parsing it only if this version wasn't seen before.
+
+        Raises:
+            FilterException: An error occurred during the processing of the feed.
+        """
+        version = filter.get_feed_version(feed)
+        parsed_feed = self._parsed_feeds.get(version)
+        if parsed_feed is None:
+            latest_feed = self._latest_feed
+            if latest_feed is not None and latest_feed.version == version:
+                return latest_feed
+            if self._filter_pool is not None:
+                parsed_feed = self._filter_pool.parse(version, feed, self._match_mode)
+            else:
+                parsed_feed = parse_feed(feed, self._match_mode)
+            self._latest_feed = parsed_feed
+            # The name matches cached by the parsed feed grow after it is cached, up to their bound
+            size = estimate_size(parsed_feed) + filter.MAX_CACHED_NAME_MATCHES_BYTES
+            if not self._parsed_feeds.put(version, parsed_feed, size = size):
+                logger.warning(f"Parsed feed {version} exceeds the parsed feeds cache ({self._parsed_feeds.max_bytes} bytes), "
+                               "keeping only the latest version")
+            # Feeds rendered from versions which are no longer kept won't be requested again
+            self._rendered_feeds.evict(lambda key: key[0] != version and key[0] not in self._parsed_feeds)
+        return parsed_feed
+
+    def render(self, parsed_feed: filter.ParsedFeed, ctf_names: CtfNameSet, output_format: formats.OutputFormat) -> str:
+        """Returns the feed filtered by the given CTF names and rendered in the given format."""
+        key = (parsed_feed.version, ctf_names, output_format)
+        content = self._rendered_feeds.get(key)
+        if content is None:
+            content = formats.render(parsed_feed, parsed_feed.match(ctf_names, self._match_mode), output_format)
+            self._rendered_feeds.put(key, content)
+        return content
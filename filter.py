@@ -1,19 +1,351 @@
 from defusedxml import ElementTree
-from typing import List
-import re
+from collections import OrderedDict, namedtuple
+from enum import Enum
+from typing import Collection, Dict, Hashable, Iterable, List, Mapping
+import hashlib
+import os
+import sys
+import threading
+import unicodedata
+
+# Environment variable selecting the mode for matching CTF names to titles (see MatchMode)
+ENV_MATCH_MODE = "FILTER_MATCH_MODE"
 
 class FilterException(Exception):
     """Represents an exception thrown by the filtering module."""
     pass
 
-def filter_writeups(feed: str, ctf_list: List[str]) -> str:
+class MatchMode(Enum):
+    """Modes for comparing CTF names to item titles."""
+
+    # Case insensitive comparison (casefolding)
+    CASEFOLD    = "casefold"
+
+    # Case insensitive comparison which also ignores differences in Unicode normalization
+    # and compatibility characters (e.g. full-width letters), using NFKC casefolding
+    UNICODE     = "unicode"
+
+    def normalize(self, text: str) -> str:
+        """Returns the normalized form of the given text, according to the mode."""
+        if self == MatchMode.UNICODE:
+            return unicodedata.normalize("NFKC", unicodedata.normalize("NFKC", text).casefold())
+        return text.casefold()
+
+    @classmethod
+    def from_environment(cls) -> "MatchMode":
+        """Returns the mode selected in the environment (CASEFOLD by default)."""
+        return cls(os.environ.get(ENV_MATCH_MODE, cls.CASEFOLD.value))
+
+def validate_ctf_list(ctf_list: Collection[str]) -> None:
+    """Validates a list of CTF names used as a filter, see filter_writeups().
+
+    Raises:
+        FilterException: The CTF list is invalid.
+    """
+    if '' in ctf_list and len(ctf_list) > 1:
+        raise FilterException("An empty string can't act as a filter together with other filters")
+
+def get_feed_version(feed: str) -> str:
+    """Returns a digest of the given feed, identifying its version."""
+    return hashlib.sha256(feed.encode()).hexdigest()
+
+# The fields of a single writeup in the feed
+FeedItem = namedtuple("FeedItem", "title link description guid original_url")
+
+# The fields of the feed channel which are exposed
+CHANNEL_FIELDS = ("title", "link", "description", "language", "lastBuildDate")
+
+# Tag of a temporary element marking the location of the items within the channel
+_ITEMS_PLACEHOLDER = "ctftime-writeups-filter-items"
+
+# Maximal total size (in bytes) of the matches of distinct CTF names cached per feed version.
+# Further names are searched for on every match. Caches of parsed feeds account for the whole bound.
+MAX_CACHED_NAME_MATCHES_BYTES = 1 << 20
+
+# Approximate memory overhead (in bytes) of a cached name match, in addition to the name and bitmap
+_NAME_MATCH_OVERHEAD = 100
+
+# Amount of published item identifiers remembered, which should well exceed the amount of items in the feed
+PUBLISHED_ITEMS_SIZE = 4096
+
+def _bitmap_indices(bitmap: int) -> List[int]:
+    """Returns the sorted indices of the bits set in the given bitmap."""
+    res = []
+    while bitmap:
+        lowest_bit = bitmap & -bitmap
+        res.append(lowest_bit.bit_length() - 1)
+        bitmap ^= lowest_bit
+    return res
+
+class ParsedFeed(object):
+    """A parsed CTFTime writeups RSS feed, which can be filtered multiple times.
+
+    Parsing the feed and serializing its items is done once, when the object is created.
+    Afterwards, the feed can be filtered for any number of CTF lists, each time paying only
+    for the matching and for concatenating the pre-serialized matching items.
+    The items matching each distinct CTF name are cached as a bitmap of item indices, so matching
+    a list only searches the titles for names which no previous list contained.
+
+    See filter_writeups() for the expected structure of the feed.
+    """
+
+    def __init__(self, feed: str):
+        """Parse a feed.
+
+        Args:
+            feed:
+                A CTFTime writeups RSS feed.
+
+        Raises:
+            FilterException: An error occurred during the processing of the feed.
+        """
+        try:
+            et = ElementTree.fromstring(feed, forbid_dtd = True, forbid_entities = True, forbid_external = True)
+            channel = et.find("./channel")
+            if channel is None:
+                raise FilterException("Can't find channel in provided XML")
+
+            items = channel.findall("./item")
+            titles = []
+            feed_items = []
+            for item in items:
+                title = item.find("title").text
+                if title is None:
+                    raise FilterException("Can't find item title in provided XML")
+                titles.append(title)
+                feed_items.append(FeedItem(title, *(item.findtext(field) for field in FeedItem._fields[1:])))
+
+            self._channel = {field: channel.findtext(field) for field in CHANNEL_FIELDS}
+
+            # Serialize the feed once without its items, leaving a placeholder at the location of the first item
+            placeholder_index = list(channel).index(items[0]) if len(items) > 0 else len(channel)
+            for item in items:
+                channel.remove(item)
+            channel.insert(placeholder_index, channel.makeelement(_ITEMS_PLACEHOLDER, {}))
+            skeleton = ElementTree.tostring(et, encoding = 'unicode', method = 'xml', xml_declaration = True)
+            self._head, self._tail = skeleton.split(f"<{_ITEMS_PLACEHOLDER} />")
+
+            self._version = get_feed_version(feed)
+            self._titles = titles
+            self._normalized_titles = {}
+            # Maps each match mode to a dictionary from normalized CTF names to the bitmaps of matching items
+            self._name_matches = {}
+            self._name_matches_bytes = 0
+            self._name_matches_lock = threading.Lock()
+            self._items = feed_items
+            self._serialized_items = [ElementTree.tostring(item, encoding = 'unicode', method = 'xml')
+                                      for item in items]
+        except FilterException:
+            raise
+        except Exception as e:
+            raise FilterException("Failed to filter XML") from e
+
+    def __getstate__(self) -> dict:
+        # The lock can't be pickled, and the cached matches are rebuilt on demand
+        state = dict(self.__dict__)
+        del state["_name_matches_lock"]
+        state["_name_matches"] = {}
+        state["_name_matches_bytes"] = 0
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._name_matches_lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        """A digest of the feed contents, identifying this version of the feed."""
+        return self._version
+
+    @property
+    def channel(self) -> Dict[str, str]:
+        """The feed channel fields (see CHANNEL_FIELDS). Missing fields are None."""
+        return self._channel
+
+    @property
+    def items(self) -> List[FeedItem]:
+        """The items in the feed, by order of appearance. Missing fields are None."""
+        return self._items
+
+    @property
+    def titles(self) -> List[str]:
+        """The titles of the items in the feed, by order of appearance."""
+        return self._titles
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+    def normalized_titles(self, mode: MatchMode) -> List[str]:
+        """Returns the titles of the items, normalized according to the given match mode.
+
+        The normalized titles are computed on first use, and shared by all further matches
+        against this version of the feed.
+        """
+        res = self._normalized_titles.get(mode)
+        if res is None:
+            res = [mode.normalize(title) for title in self._titles]
+            self._normalized_titles[mode] = res
+        return res
+
+    def match(self, ctf_list: Collection[str], mode: MatchMode = MatchMode.CASEFOLD) -> List[int]:
+        """Returns the indices of the items matching the given CTF list.
+
+        Args:
+            ctf_list:
+                A list of CTF names, see filter_writeups().
+            mode:
+                The mode used for comparing CTF names to titles.
+
+        Returns:
+            A sorted list of indices of items whose title contains one of the CTF names.
+
+        Raises:
+            FilterException: The CTF list is invalid.
+        """
+        return self.match_many({None: ctf_list}, mode)[None]
+
+    def match_many(self, ctf_lists: Mapping[Hashable, Collection[str]], 
+                   mode: MatchMode = MatchMode.CASEFOLD) -> Dict[Hashable, List[int]]:
+        """Returns the indices of the items matching each of the given CTF lists.
+
+        Each distinct CTF name is searched for in the item titles only once per version of the feed
+        (see MAX_CACHED_NAME_MATCHES_BYTES), no matter how many lists contain it, in this call or in
+        previous ones. Afterwards, matching a list only combines the cached matches of its names.
+        Names are compared to the titles after normalizing both according to the match mode.
+
+        Args:
+            ctf_lists:
+                A mapping from an arbitrary key (e.g. a user ID) to a list of CTF names,
+                see filter_writeups().
+            mode:
+                The mode used for comparing CTF names to titles.
+
+        Returns:
+            A mapping from each of the given keys to a sorted list of indices of the
+            matching items.
+
+        Raises:
+            FilterException: One of the CTF lists is invalid.
+        """
+        for ctf_list in ctf_lists.values():
+            validate_ctf_list(ctf_list)
+
+        res = {}
+        for key, ctf_list in ctf_lists.items():
+            bitmap = 0
+            for name in ctf_list:
+                bitmap |= self._name_matches_bitmap(name, mode)
+            res[key] = _bitmap_indices(bitmap)
+        return res
+
+    def explain(self, ctf_list: Collection[str], mode: MatchMode = MatchMode.CASEFOLD) -> Dict[int, List[str]]:
+        """Returns which of the given CTF names matched each item.
+
+        Args:
+            ctf_list:
+                A list of CTF names, see filter_writeups().
+            mode:
+                The mode used for comparing CTF names to titles.
+
+        Returns:
+            A mapping from the index of each matching item (in ascending order) to the
+            sorted CTF names of the list which its title contains.
+
+        Raises:
+            FilterException: The CTF list is invalid.
+        """
+        validate_ctf_list(ctf_list)
+
+        res = {}
+        for name in sorted(ctf_list):
+            for i in _bitmap_indices(self._name_matches_bitmap(name, mode)):
+                res.setdefault(i, []).append(name)
+        return dict(sorted(res.items()))
+
+    def _name_matches_bitmap(self, name: str, mode: MatchMode) -> int:
+        """Returns the bitmap of indices of the items whose title contains the given name, according to the match mode."""
+        if name == "":
+            return 0
+        normalized_name = mode.normalize(name)
+        # Lookups don't take the lock: cached matches are never modified, only added
+        bitmap = self._name_matches.get(mode, {}).get(normalized_name)
+        if bitmap is None:
+            bitmap = 0
+            for i, title in enumerate(self.normalized_titles(mode)):
+                if normalized_name in title:
+                    bitmap |= 1 << i
+            size = sys.getsizeof(normalized_name) + sys.getsizeof(bitmap) + _NAME_MATCH_OVERHEAD
+            with self._name_matches_lock:
+                name_matches = self._name_matches.setdefault(mode, {})
+                if (normalized_name not in name_matches
+                    and self._name_matches_bytes + size <= MAX_CACHED_NAME_MATCHES_BYTES):
+                    name_matches[normalized_name] = bitmap
+                    self._name_matches_bytes += size
+        return bitmap
+
+    def to_xml(self, indices: Iterable[int]) -> str:
+        """Serializes the feed, keeping only the items with the given indices.
+
+        Args:
+            indices:
+                Indices of the items to keep, in the order they should appear.
+
+        Returns:
+            A CTFTime writeups RSS feed XML containing only the requested items.
+        """
+        return self._head + "".join(self._serialized_items[i] for i in indices) + self._tail
+
+    def filter(self, ctf_list: Collection[str], mode: MatchMode = MatchMode.CASEFOLD) -> str:
+        """Filters the feed, keeping only entries from the given CTF list.
+
+        See filter_writeups() for details.
+        """
+        return self.to_xml(self.match(ctf_list, mode))
+
+class PublishedItems(object):
+    """A bounded record of the items already published (e.g. to streams or webhooks).
+
+    Items are identified by their GUID, or by their link if the GUID is missing. Unlike comparing
+    each snapshot of the feed to the previous one, items aren't published again when snapshots
+    are observed out of order (e.g. v2, v1, v2). The least recently seen identifiers are
+    forgotten first. Not thread-safe.
+    """
+
+    def __init__(self, max_size: int = PUBLISHED_ITEMS_SIZE):
+        """Initialize the record.
+
+        Args:
+            max_size:
+                The maximal amount of item identifiers remembered.
+        """
+        self._max_size = max_size
+        self._item_ids = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._item_ids)
+
+    def new_item_indices(self, parsed_feed: ParsedFeed) -> List[int]:
+        """Returns the indices of the items of the feed which weren't recorded as published."""
+        return [i for i, item in enumerate(parsed_feed.items) if (item.guid or item.link) not in self._item_ids]
+
+    def record(self, parsed_feed: ParsedFeed) -> None:
+        """Records all the items of the feed as published."""
+        for item in parsed_feed.items:
+            item_id = item.guid or item.link
+            self._item_ids[item_id] = None
+            self._item_ids.move_to_end(item_id)
+        while len(self._item_ids) > self._max_size:
+            self._item_ids.popitem(last = False)
+
+def filter_writeups(feed: str, ctf_list: List[str], mode: MatchMode = MatchMode.CASEFOLD) -> str:
     """Filters the given writeups feed, keeping only entries from the given CTF list.
 
-    Receives a given list of CTF names, and filters the given CTFTime writeups RSS feed 
+    Receives a given list of CTF names, and filters the given CTFTime writeups RSS feed
     by going over all writeup items and removing items which don't contain one of the provided
-    CTF names in the title. 
+    CTF names in the title.
     An item will be kept if one of the CTF names in ctf_list can be found anywhere withing the item's
-    title (case insensitive).
+    title (case insensitive). In MatchMode.UNICODE mode, differences in Unicode normalization and
+    compatibility characters (e.g. full-width letters) are ignored as well.
 
     The feed is expected to be structured in a similar manner to the following template:
     <?xml version="1.0" encoding="utf-8"?>
@@ -38,13 +370,15 @@ def filter_writeups(feed: str, ctf_list: List[str]) -> str:
     In practice, only the "/channel/item/title" node is used.
 
     Args:
-        feed: 
-            A CTFTime writeups RSS feed. 
-        ctf_list: 
+        feed:
+            A CTFTime writeups RSS feed.
+        ctf_list:
             A list of CTF names whose corresponding items should be kept in the feed.
             A list containing an empty string will filter out all items.
             It is forbidden to include an empty string together with non-empty strings
             in the same list.
+        mode:
+            The mode used for comparing CTF names to titles.
 
     Returns:
         A CTFTime writeups RSS feed XML where non-matching items were removed.
@@ -52,31 +386,5 @@ def filter_writeups(feed: str, ctf_list: List[str]) -> str:
     Raises:
         FilterException: An error occurred during the processing of the feed.
     """
-
-    try:
-        et = ElementTree.fromstring(feed, forbid_dtd = True, forbid_entities = True, forbid_external = True)
-        channel = et.find("./channel")
-        if channel is None:
-            raise FilterException("Can't find channel in provided XML")
-
-        if '' in ctf_list and len(ctf_list) > 1:
-            raise ValueError("An empty string can't act as a filter together with other filters")
-
-        pattern = "|".join(re.escape(name) for name in ctf_list)
-        if pattern == "":
-            pattern = "$^" # Won't match anything
-        ctfnames_regex = re.compile(pattern, re.IGNORECASE)
-
-        for item in channel.findall("./item"):
-            title = item.find("title").text
-            if title is None:
-                raise FilterException("Can't find item title in provided XML")
-            if not ctfnames_regex.search(title):
-                channel.remove(item)
-
-        return ElementTree.tostring(et, encoding = 'unicode', method = 'xml', xml_declaration = True)
-    except FilterException:
-        raise
-    except Exception as e:
-        raise FilterException("Failed to filter XML") from e
+    return ParsedFeed(feed).filter(ctf_list, mode)
 
@@ -0,0 +1,131 @@
+"""Optional offloading of feed parsing to a pool of worker processes.
+
+Parsing a version of the feed (the XML parse, serializing each item, and normalizing the titles)
+is pure Python, and holds the GIL for its whole duration: for large feeds, every request thread
+of the process stalls meanwhile. Once parsed, filtering is cheap, since the matches of each CTF
+name are cached per version (see filter.ParsedFeed). A FilterPool parses large feed versions in
+worker processes instead:
+
+  - Each version is parsed by a single worker, and the parsed feed is sent back pickled.
+    Unpickling it is much cheaper than parsing the feed.
+  - Threads requesting a version which is already being parsed wait for the same result.
+  - Feeds smaller than a size threshold are parsed inline, where the dispatching overhead
+    would outweigh the gain.
+
+On a free-threaded Python build (no GIL), parsing doesn't stall the other request threads, so
+the pool isn't used (see FilterPool.from_environment()).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import multiprocessing
+import os
+import sys
+import threading
+
+import filter
+
+# Environment variable holding the amount of worker processes (0 or missing: parse inline)
+ENV_POOL_WORKERS = "FILTER_POOL_WORKERS"
+
+# Environment variable holding the minimal feed size (in characters) for offloading the parsing
+ENV_POOL_MIN_FEED_SIZE = "FILTER_POOL_MIN_FEED_SIZE"
+
+# Default minimal feed size (in characters) for offloading the parsing
+DEFAULT_MIN_FEED_SIZE = 256 * 1024
+
+def is_gil_enabled() -> bool:
+    """Returns whether the GIL is enabled (always true before free-threaded builds existed)."""
+    return getattr(sys, "_is_gil_enabled", lambda: True)()
+
+def parse_feed(feed: str, mode: filter.MatchMode) -> filter.ParsedFeed:
+    """Parses a feed, normalizing its titles according to the given match mode.
+
+    Raises:
+        FilterException: An error occurred during the processing of the feed.
+    """
+    parsed_feed = filter.ParsedFeed(feed)
+    # Normalize the titles once per feed version, rather than on the first match
+    parsed_feed.normalized_titles(mode)
+    return parsed_feed
+
+class FilterPool(object):
+    """A pool of worker processes for parsing large feeds."""
+
+    def __init__(self, workers: int, min_feed_size: int = DEFAULT_MIN_FEED_SIZE):
+        """Initialize the pool. Worker processes are started on first use.
+
+        Args:
+            workers:
+                The amount of worker processes.
+            min_feed_size:
+                The minimal size (in characters) of a feed for its parsing to be offloaded.
+        """
+        self._workers = workers
+        self._min_feed_size = min_feed_size
+        self._executor = None
+        # The parses in progress, by (version, match mode)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls) -> Optional["FilterPool"]:
+        """Returns a pool configured from the environment, or None if parsing should stay inline."""
+        workers = int(os.environ.get(ENV_POOL_WORKERS, "0"))
+        if workers <= 0 or not is_gil_enabled():
+            return None
+        return cls(workers, int(os.environ.get(ENV_POOL_MIN_FEED_SIZE, str(DEFAULT_MIN_FEED_SIZE))))
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Called with the lock held
+        if self._executor is None:
+            # Forking a multithreaded server process isn't safe, so workers are spawned
+            self._executor = ProcessPoolExecutor(max_workers = self._workers,
+                                                 mp_context = multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def parse(self, version: str, feed: str, mode: filter.MatchMode = filter.MatchMode.CASEFOLD) -> filter.ParsedFeed:
+        """Parses a feed, in a worker process if the feed is large enough, see parse_feed().
+
+        Args:
+            version:
+                The version of the feed (see filter.get_feed_version()).
+            feed:
+                A CTFTime writeups RSS feed.
+            mode:
+                The match mode to normalize the titles for.
+
+        Returns:
+            The parsed feed.
+
+        Raises:
+            FilterException: An error occurred during the processing of the feed.
+        """
+        if len(feed) < self._min_feed_size:
+            return parse_feed(feed, mode)
+
+        key = (version, mode)
+        with self._lock:
+            future = self._pending.get(key)
+            submitted = future is None
+            if submitted:
+                future = self._get_executor().submit(parse_feed, feed, mode)
+                self._pending[key] = future
+        if submitted:
+            future.add_done_callback(lambda _: self._forget(key))
+        try:
+            return future.result()
+        except filter.FilterException:
+            raise
+        except Exception as e:
+            raise filter.FilterException("Failed to parse feed in worker process") from e
+
+    def _forget(self, key) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def close(self) -> None:
+        """Stops the worker processes."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
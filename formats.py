@@ -0,0 +1,143 @@
+"""Output formats for the filtered writeups feed.
+
+Besides the original RSS XML, the filtered feed can be rendered as a JSON Feed
+(https://www.jsonfeed.org/version/1.1/) or as a compact NDJSON stream holding a single
+JSON object per line. Both are rendered directly from the parsed items, without
+building or serializing an XML tree.
+"""
+from enum import Enum
+from typing import Iterable, Optional
+from werkzeug.datastructures import MIMEAccept
+from filter import ParsedFeed
+import json
+
+JSON_FEED_VERSION = "https://jsonfeed.org/version/1.1"
+
+# Fields included in the compact NDJSON format
+NDJSON_FIELDS = ("title", "link", "guid")
+
+class OutputFormat(Enum):
+    """Supported output formats, by the value of their "format" query parameter."""
+    RSS         = "rss"
+    JSON_FEED   = "json"
+    NDJSON      = "ndjson"
+
+    @property
+    def content_type(self) -> str:
+        """The content type of the format."""
+        return _CONTENT_TYPES[self]
+
+_CONTENT_TYPES = {
+    OutputFormat.RSS:       "application/rss+xml; charset=utf-8",
+    OutputFormat.JSON_FEED: "application/feed+json; charset=utf-8",
+    OutputFormat.NDJSON:    "application/x-ndjson; charset=utf-8",
+}
+
+# Mime types accepted for each format, by order of preference.
+# RSS is first, so that clients accepting anything (e.g. "*/*") receive RSS.
+_ACCEPTED_MIME_TYPES = {
+    "application/rss+xml":      OutputFormat.RSS,
+    "application/xml":          OutputFormat.RSS,
+    "text/xml":                 OutputFormat.RSS,
+    "application/feed+json":    OutputFormat.JSON_FEED,
+    "application/json":         OutputFormat.JSON_FEED,
+    "application/x-ndjson":     OutputFormat.NDJSON,
+}
+
+def negotiate_format(format_param: Optional[str], accept: MIMEAccept) -> OutputFormat:
+    """Decides which output format should be used for a request.
+
+    Args:
+        format_param:
+            The value of the "format" query parameter, if provided. Takes precedence over
+            the Accept header.
+        accept:
+            The parsed Accept header of the request.
+
+    Returns:
+        The output format to use. Defaults to RSS.
+
+    Raises:
+        ValueError: The format parameter is unknown.
+    """
+    if format_param is not None:
+        return OutputFormat(format_param)
+
+    best_match = accept.best_match(_ACCEPTED_MIME_TYPES.keys())
+    return _ACCEPTED_MIME_TYPES.get(best_match, OutputFormat.RSS)
+
+def render_json_feed(parsed_feed: ParsedFeed, indices: Iterable[int]) -> str:
+    """Renders the given items of a feed as a JSON Feed.
+
+    Args:
+        parsed_feed:
+            The parsed feed.
+        indices:
+            Indices of the items to include, in the order they should appear.
+
+    Returns:
+        A JSON Feed document.
+    """
+    channel = parsed_feed.channel
+    res = {
+        "version": JSON_FEED_VERSION,
+        "title": channel["title"],
+        "home_page_url": channel["link"],
+        "description": channel["description"],
+        "language": channel["language"],
+        "items": [],
+    }
+
+    for i in indices:
+        item = parsed_feed.items[i]
+        entry = {
+            "id": item.guid or item.link,
+            "url": item.link,
+            "external_url": item.original_url,
+            "title": item.title,
+            "content_text": item.description,
+        }
+        res["items"].append({key: value for key, value in entry.items() if value is not None})
+
+    return json.dumps({key: value for key, value in res.items() if value is not None},
+                      ensure_ascii = False, separators = (",", ":"))
+
+def render_ndjson(parsed_feed: ParsedFeed, indices: Iterable[int]) -> str:
+    """Renders the given items of a feed as NDJSON, a single compact JSON object per item.
+
+    Args:
+        parsed_feed:
+            The parsed feed.
+        indices:
+            Indices of the items to include, in the order they should appear.
+
+    Returns:
+        The items, one JSON object (holding the NDJSON_FIELDS) per line.
+    """
+    lines = []
+    for i in indices:
+        item = parsed_feed.items[i]
+        lines.append(json.dumps({field: getattr(item, field) for field in NDJSON_FIELDS},
+                                ensure_ascii = False, separators = (",", ":")))
+        lines.append("\n")
+    return "".join(lines)
+
+def render(parsed_feed: ParsedFeed, indices: Iterable[int], output_format: OutputFormat) -> str:
+    """Renders the given items of a feed in the requested format.
+
+    Args:
+        parsed_feed:
+            The parsed feed.
+        indices:
+            Indices of the items to include, in the order they should appear.
+        output_format:
+            The requested format.
+
+    Returns:
+        The rendered feed.
+    """
+    if output_format == OutputFormat.JSON_FEED:
+        return render_json_feed(parsed_feed, indices)
+    elif output_format == OutputFormat.NDJSON:
+        return render_ndjson(parsed_feed, indices)
+    return parsed_feed.to_xml(indices)
@@ -0,0 +1,66 @@
+"""HTTP caching headers for the filtered writeups feed.
+
+The filtered feed only changes when either the upstream feed or the user's filter changes.
+Therefore, responses are marked as cacheable by browsers, feed readers and any shared cache
+in front of the application (reverse proxy / CDN), and carry an ETag validator which allows
+cheap revalidation via conditional requests. The ETag covers both inputs of the filtered feed.
+No Last-Modified validator is sent: the upstream feed's modification date doesn't change with
+the user's filter, so a client revalidating with If-Modified-Since only would keep a stale filter.
+"""
+from typing import Hashable, Iterable
+import hashlib
+
+# Freshness lifetime (in seconds) for private caches (browsers, feed readers)
+FEED_MAX_AGE = 300
+
+# Freshness lifetime (in seconds) for shared caches (reverse proxies, CDNs)
+FEED_SHARED_MAX_AGE = 600
+
+# Period (in seconds) after expiration during which caches may serve a stale response
+# while revalidating it in the background
+FEED_STALE_WHILE_REVALIDATE = 3600
+
+# Request headers the feed response depends on (via content negotiation)
+FEED_VARY = ("Accept",)
+
+def get_feed_etag(feed_version: str, ctf_names: Iterable[str], variant: Hashable) -> str:
+    """Returns a strong entity tag for a filtered feed.
+
+    Args:
+        feed_version:
+            The version of the upstream feed (see filter.get_feed_version()).
+        ctf_names:
+            The (normalized) CTF names used for filtering.
+        variant:
+            Any other value the content depends on, e.g. the output format.
+
+    Returns:
+        An entity tag, without quotes.
+    """
+    digest = hashlib.sha256()
+    digest.update(feed_version.encode())
+    for name in ctf_names:
+        digest.update(b"\x00" + name.encode())
+    digest.update(b"\x01" + str(variant).encode())
+    return digest.hexdigest()[:32]
+
+def add_cache_headers(response, etag: str):
+    """Adds the caching headers for a filtered feed to the given response.
+
+    Args:
+        response:
+            A Flask / Werkzeug response.
+        etag:
+            The entity tag of the response, see get_feed_etag().
+
+    Returns:
+        The given response.
+    """
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = FEED_MAX_AGE
+    response.cache_control.s_maxage = FEED_SHARED_MAX_AGE
+    response.cache_control.stale_while_revalidate = FEED_STALE_WHILE_REVALIDATE
+    for header in FEED_VARY:
+        response.vary.add(header)
+    return response
@@ -1,18 +1,40 @@
-from flask import Flask, Response, render_template, url_for, send_from_directory
+from flask import Flask, Response, render_template, url_for, send_from_directory, send_file, request, jsonify, abort
 from enum import Enum
 from flask.logging import create_logger
+from werkzeug.middleware.proxy_fix import ProxyFix
 from user import User, MAX_CTF_ENTRIES, MAX_ENTRY_NAME_LEN
-from database import ENTRY_SEPARATOR, PATH_TO_CTF_NAMES, UID_PLACEHOLDER, PATH_TO_USER_DATA, KEY_USER_CTF_NAMES
+from database import ENTRY_SEPARATOR, PATH_TO_CTF_NAMES, UID_PLACEHOLDER, PATH_TO_USER_DATA, KEY_USER_CTF_NAMES, \
+                     KEY_USER_WEBHOOK_URL, KEY_USER_WEBHOOK_SECRET, MAX_WEBHOOK_URL_LENGTH, WEBHOOK_SECRET_LENGTH, \
+                     get_read_metrics
 from collections import namedtuple
-from typing import Dict, List
+from typing import Dict, List, Optional
+from ctf_names import CtfNameSet
+from feed_cache import FeedCache
+import assets
+import atexit
+import caches
+import feed
 import filter
-import requests
+import filter_pool
+import formats
+import http_cache
+import profiling
+import ratelimit
+import streams
+import hashlib
+import hmac
+import math
+import mimetypes
 import os
 import utils
 
 class HttpStatus(Enum):
     """HTTP Status Codes."""
+    HTTP_400_BAD_REQUEST = 400
+    HTTP_404_NOT_FOUND = 404
+    HTTP_429_TOO_MANY_REQUESTS = 429
     HTTP_500_INTERNAL_SERVER_ERROR = 500
+    HTTP_503_SERVICE_UNAVAILABLE = 503
 
 class PageIds(utils.FlattenableEnum, Enum):
     """Enumeration of page IDs.
@@ -33,6 +55,39 @@ class PageIds(utils.FlattenableEnum, Enum):
 COOKIE_MENU_TYPE = "menu_type" # Cookie name
 COOKIE_MENU_TYPE_LOGGED_IN = "logged_in" # Value to represent that "logged in" menu should be shown
 
+# Maximum amount of users whose feeds can be requested in a single batch request
+MAX_BATCH_USERS = 100
+
+# Default rate limits for the writeups feed, as (requests per second, burst size).
+# Requests above the limit are answered with the last response served for the same feed, if available.
+# Batch requests are charged to the client limit by the amount of requested users.
+RATE_LIMIT_PER_UID = (1 / 10, 5)
+RATE_LIMIT_PER_CLIENT = (1, 30)
+
+# Environment variables overriding the rate limits, as "<requests per second>,<burst size>" or "off"
+# (e.g. disabling the client limit when aggregators poll many feeds from a single IP), see ratelimit.py
+ENV_RATE_LIMIT_PER_UID = "RATE_LIMIT_PER_UID"
+ENV_RATE_LIMIT_PER_CLIENT = "RATE_LIMIT_PER_CLIENT"
+
+# Environment variable holding the amount of reverse proxies in front of the application,
+# which are trusted to provide the client IP via X-Forwarded-For
+ENV_TRUSTED_PROXIES = "TRUSTED_PROXIES"
+
+# Environment variable holding the secret token granting access to the operational statistics.
+# The statistics aren't served unless it is set.
+ENV_STATS_TOKEN = "STATS_TOKEN"
+
+# Request header carrying the statistics token
+STATS_HEADER = "X-Stats-Token"
+
+# Folder to which the static assets are built, relative to the application root (see assets.py)
+ASSETS_BUILD_FOLDER = os.path.join("build", "assets")
+
+# Caching lifetime (in seconds) of built assets, whose URLs change whenever their contents change
+ASSETS_MAX_AGE = 365 * 24 * 60 * 60
+
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+
 # A menu entry for the navigation menu
 MenuItem = namedtuple("MenuItem", "href id caption")
 
@@ -41,48 +96,151 @@ def create_app():
 
     logger = create_logger(app)
 
+    trusted_proxies = int(os.environ.get(ENV_TRUSTED_PROXIES, "1"))
+    if trusted_proxies > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for = trusted_proxies)
+
+    # Opt-in sampled profiling of the writeups feed (see profiling.py)
+    profiler = profiling.RequestProfiler.from_environment()
+    if profiler is not None:
+        # Requests overlapping other requests aren't profiled, see profiling.py
+        app.before_request(profiler.request_started)
+        app.teardown_request(lambda _: profiler.request_finished())
+
+    # Opt-in offloading of the parsing of large feeds to worker processes (see filter_pool.py)
+    pool = filter_pool.FilterPool.from_environment()
+    if pool is not None:
+        atexit.register(pool.close)
+
+    # All the caches share a single memory budget (see caches.py)
+    memory_budget = caches.MemoryBudget.from_environment()
+
+    feed_cache = FeedCache(filter.MatchMode.from_environment(), pool, memory_budget)
+    # The last responses, for answering rate limited requests
+    last_responses = memory_budget.create_cache("last_responses")
+
+    # Opt-in capture of the upstream feed snapshots (see feed.FeedRecorder)
+    feed_recorder = feed.FeedRecorder.from_environment()
+
+    uid_limiter = ratelimit.RateLimiter.from_environment(ENV_RATE_LIMIT_PER_UID, RATE_LIMIT_PER_UID)
+    client_limiter = ratelimit.RateLimiter.from_environment(ENV_RATE_LIMIT_PER_CLIENT, RATE_LIMIT_PER_CLIENT)
+
+    def acquire(limiter: Optional[ratelimit.RateLimiter], key: str, cost: float = 1) -> float:
+        """Charges a request to the given limiter (if enabled), see RateLimiter.acquire()."""
+        return limiter.acquire(key, cost) if limiter is not None else 0
+
+    def fetch_upstream() -> feed.UpstreamFeed:
+        """Fetches the upstream feed, capturing it if requested."""
+        upstream = feed.fetch_feed()
+        if feed_recorder is not None:
+            try:
+                feed_recorder.record(upstream)
+            except Exception as e:
+                logger.error(e)
+        return upstream
+
+    # Live streams of new writeups share a single publisher, which is also fed by the snapshots
+    # fetched for feed requests (see streams.py)
+    stream_publisher = streams.StreamPublisher(lambda: feed_cache.get_parsed_feed(fetch_upstream().text),
+                                               feed_cache.match_mode,
+                                               max_streams = int(os.environ.get(streams.ENV_MAX_STREAMS,
+                                                                                str(streams.MAX_STREAMS))))
+
     @app.route('/favicon.ico')
     def favicon():
         return send_from_directory(os.path.join(app.root_path, 'static'),
                                 'images/favicon/favicon.ico')
 
+    # The static assets are built once, when the application is created
+    static_assets = assets.build_assets(app.static_folder, os.path.join(app.root_path, ASSETS_BUILD_FOLDER))
+
+    @app.route('/assets/<string:content_hash>/<path:filename>')
+    def built_asset(content_hash, filename):
+        """Serves a built static asset, precompressed according to the client's Accept-Encoding."""
+        asset = static_assets.get(filename)
+        if asset is None or asset.hash != content_hash:
+            abort(HttpStatus.HTTP_404_NOT_FOUND.value)
+
+        path, encoding = assets.select_encoding(asset, request.accept_encodings)
+        res = send_file(path, mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                        etag = f"{asset.hash}-{encoding or 'identity'}", max_age = ASSETS_MAX_AGE, 
+                        conditional = True)
+        if encoding is not None:
+            res.content_encoding = encoding
+        res.cache_control.public = True
+        res.cache_control.immutable = True
+        res.vary.add("Accept-Encoding")
+        return res
+
     @app.template_global()
     def url_for_cache(endpoint, **values):
         """A wrapper for the built-in url_for function, adding cache control.
 
-        A wrapper for the built-in url_for function, which adds a "cache" parameter to the 
-        resource path containing the last modification date of the resource.
-        This is used to invalidate browser cache once the resource has changed.
+        A wrapper for the built-in url_for function, which returns the URL of the built
+        static asset (see assets.py) for static resources. The URL contains a hash of the
+        resource contents, so the browser cache is invalidated once the resource has changed,
+        and the resource can otherwise be cached indefinitely.
         """
-        try:
-            if ("filename" in values):
-                mod_date = str(os.path.getmtime(os.path.join(endpoint, values["filename"])))
-                values["cache"] = mod_date
-        except Exception:
-            pass
+        if endpoint == "static" and values.get("filename") in static_assets:
+            filename = values.pop("filename")
+            return url_for("built_asset", content_hash = static_assets[filename].hash, filename = filename, **values)
         return url_for(endpoint, **values)
 
     @app.route("/writeups/<string:uid>")
     def writeups(uid):
+        if profiler is not None and profiler.should_profile(request.headers):
+            with profiler.profile("writeups"):
+                return get_writeups_response(uid)
+        return get_writeups_response(uid)
+
+    def get_writeups_response(uid: str) -> Response:
+        """Returns the filtered writeups feed response for the given user ID.
+
+        The output format is selected via the "format" query parameter or the Accept header,
+        see formats.negotiate_format().
+        If the "explain" query parameter is set to 1, a JSON object describing which of the user's
+        CTF names matched each item is returned instead of the feed, see get_explain_response().
+        """
+        explain = request.args.get("explain") == "1"
         try:
-            user = User(uid)
-
-            headers = {
-                'User-Agent': 'CTFTime Writeups Filter 1.0',
-            }
+            output_format = formats.negotiate_format(request.args.get("format"), request.accept_mimetypes)
+        except ValueError:
+            return Response(status = HttpStatus.HTTP_400_BAD_REQUEST.value)
+
+        retry_after = acquire(client_limiter, request.remote_addr) or acquire(uid_limiter, uid)
+        if retry_after > 0:
+            last_response = last_responses.get((uid, output_format)) if not explain else None
+            if last_response is not None:
+                return Response(**last_response).make_conditional(request)
+            return Response(
+                status = HttpStatus.HTTP_429_TOO_MANY_REQUESTS.value,
+                headers = {"Retry-After": str(math.ceil(retry_after))}
+            )
 
-            r = requests.get("https://ctftime.org/writeups/rss/", headers = headers)
+        try:
+            # Reading the list accesses the database, so it's read once and shared by the content and its ETag
+            ctf_list = User(uid).ctf_list
 
-            if (not r.headers['content-type'].startswith("application/rss+xml")):
-                raise Exception("Invalid content type received from CTFTime: {}".format(r.headers['content-type']))
+            upstream = fetch_upstream()
 
-            content = filter.filter_writeups(r.text, user.ctf_list)
+            parsed_feed = feed_cache.get_parsed_feed(upstream.text)
+            stream_publisher.publish(parsed_feed)
+            if explain:
+                return get_explain_response(parsed_feed, ctf_list)
+            content = feed_cache.render(parsed_feed, ctf_list, output_format)
 
             res = Response(
                 response = content,
-                status = r.status_code,
-                content_type = r.headers['content-type'],
+                status = upstream.status_code,
+                content_type = upstream.content_type if output_format == formats.OutputFormat.RSS else output_format.content_type,
             )
+            http_cache.add_cache_headers(res, http_cache.get_feed_etag(parsed_feed.version, ctf_list, output_format.value))
+
+            last_responses.put((uid, output_format), dict(response = content, 
+                                                          status = res.status_code, 
+                                                          headers = list(res.headers.items())))
+
+            res.make_conditional(request)
         except Exception as e:
             logger.error(e)
             res = Response(
@@ -91,6 +249,140 @@ def create_app():
         
         return res
 
+    def get_explain_response(parsed_feed: filter.ParsedFeed, ctf_list: CtfNameSet) -> Response:
+        """Returns a JSON object describing which of the given CTF names matched each item of the feed.
+
+        The object is of the form:
+            {"version": <feed version>, "match_mode": <mode>, "ctf_names": [<name>, ...],
+             "items": [{"index": <index>, "title": <title>, "link": <link>, "matched_names": [<name>, ...]}, ...]}
+        Where "items" only contains the matching items, and names are normalized (see ctf_names.CtfNameSet).
+        """
+        items = [dict(index = i, title = parsed_feed.items[i].title, link = parsed_feed.items[i].link, matched_names = names)
+                 for i, names in parsed_feed.explain(ctf_list, feed_cache.match_mode).items()]
+        res = jsonify(version = parsed_feed.version, match_mode = feed_cache.match_mode.value,
+                      ctf_names = sorted(ctf_list), items = items)
+        res.headers["Cache-Control"] = "no-store"
+        return res
+
+    @app.route("/writeups/<string:uid>/stream")
+    def writeups_stream(uid):
+        """Streams the new writeups matching the user's CTF names as Server-Sent Events."""
+        retry_after = acquire(client_limiter, request.remote_addr)
+        if retry_after > 0:
+            return Response(
+                status = HttpStatus.HTTP_429_TOO_MANY_REQUESTS.value,
+                headers = {"Retry-After": str(math.ceil(retry_after))}
+            )
+
+        try:
+            ctf_list = User(uid).ctf_list
+        except ValueError:
+            return Response(status = HttpStatus.HTTP_400_BAD_REQUEST.value)
+        except Exception as e:
+            logger.error(e)
+            return Response(status = HttpStatus.HTTP_500_INTERNAL_SERVER_ERROR.value)
+
+        subscription = stream_publisher.subscribe(ctf_list)
+        if subscription is None:
+            return Response(
+                status = HttpStatus.HTTP_503_SERVICE_UNAVAILABLE.value,
+                headers = {"Retry-After": str(streams.STREAM_RETRY_MS // 1000)}
+            )
+
+        return Response(
+            subscription.events(),
+            content_type = "text/event-stream; charset=utf-8",
+            headers = {
+                "Cache-Control": "no-cache",
+                # Disable response buffering by reverse proxies (nginx)
+                "X-Accel-Buffering": "no",
+            }
+        )
+
+    stats_token = os.environ.get(ENV_STATS_TOKEN) or None
+
+    @app.route("/stats")
+    def stats():
+        """Returns the operational statistics (the hit rates of the caches, and the database reads) as JSON.
+
+        Only served to requests carrying the statistics token (see ENV_STATS_TOKEN).
+        """
+        token = request.headers.get(STATS_HEADER, "")
+        if stats_token is None or not hmac.compare_digest(token.encode(), stats_token.encode()):
+            abort(HttpStatus.HTTP_404_NOT_FOUND.value)
+        res = jsonify(caches = memory_budget.stats(), database_reads = get_read_metrics())
+        res.headers["Cache-Control"] = "no-store"
+        return res
+
+    @app.route("/writeups/batch", methods = ["POST"])
+    def writeups_batch():
+        """Returns the filtered writeups feeds for multiple users.
+
+        Expects a JSON body of the form {"uids": [<uid>, ...]}.
+        The lists of the requested users are read concurrently, and the upstream feed
+        is fetched and parsed once for all of them.
+
+        Returns a JSON object of the form:
+            {"feeds": {<uid>: {"status": <status>, "content_type": <type>, "feed": <xml>}, ...}}
+        Where "content_type" and "feed" are only present for successful entries. Unknown users have
+        the status 404, and users whose list is temporarily unavailable have the status 503.
+        The request is charged to the client rate limit by the amount of requested users.
+        """
+        body = request.get_json(silent = True)
+        uids = body.get("uids") if isinstance(body, dict) else None
+        if (not isinstance(uids, list) or len(uids) > MAX_BATCH_USERS 
+            or not all(isinstance(uid, str) for uid in uids)):
+            return Response(status = HttpStatus.HTTP_400_BAD_REQUEST.value)
+
+        retry_after = acquire(client_limiter, request.remote_addr, max(1, len(set(uids))))
+        if retry_after > 0:
+            return Response(
+                status = HttpStatus.HTTP_429_TOO_MANY_REQUESTS.value,
+                headers = {"Retry-After": str(math.ceil(retry_after))}
+            )
+
+        try:
+            results = {}
+            users = []
+            for uid in dict.fromkeys(uids):
+                if User.is_valid_user_id(uid):
+                    users.append(User(uid))
+                else:
+                    results[uid] = dict(status = HttpStatus.HTTP_400_BAD_REQUEST.value)
+
+            ctf_lists = {}
+            user_lists, unavailable = User.get_ctf_lists(users)
+            for uid in unavailable:
+                # The database is unavailable, and the user's list isn't in the snapshot: the request can be retried
+                results[uid] = dict(status = HttpStatus.HTTP_503_SERVICE_UNAVAILABLE.value)
+            for uid, ctf_list in user_lists.items():
+                try:
+                    User.validate_ctf_list(uid, ctf_list)
+                    filter.validate_ctf_list(ctf_list)
+                    ctf_lists[uid] = ctf_list
+                except Exception as e:
+                    logger.error(e)
+                    results[uid] = dict(status = HttpStatus.HTTP_500_INTERNAL_SERVER_ERROR.value)
+
+            for user in users:
+                if user.user_id not in ctf_lists and user.user_id not in results:
+                    results[user.user_id] = dict(status = HttpStatus.HTTP_404_NOT_FOUND.value)
+
+            if len(ctf_lists) > 0:
+                upstream = fetch_upstream()
+                parsed_feed = feed_cache.get_parsed_feed(upstream.text)
+                for uid, indices in parsed_feed.match_many(ctf_lists, feed_cache.match_mode).items():
+                    results[uid] = dict(status = upstream.status_code, 
+                                        content_type = upstream.content_type,
+                                        feed = parsed_feed.to_xml(indices))
+
+            return jsonify(feeds = results)
+        except Exception as e:
+            logger.error(e)
+            return Response(
+                status = HttpStatus.HTTP_500_INTERNAL_SERVER_ERROR.value
+            )
+
     @app.context_processor
     def template_globals() -> dict:
         """Returns a dictionary of constants which should be available accross all templates."""
@@ -104,9 +396,23 @@ def create_app():
             UID_PLACEHOLDER = UID_PLACEHOLDER,
             PATH_TO_USER_DATA = PATH_TO_USER_DATA,
             KEY_USER_CTF_NAMES = KEY_USER_CTF_NAMES,
+            KEY_USER_WEBHOOK_URL = KEY_USER_WEBHOOK_URL,
+            KEY_USER_WEBHOOK_SECRET = KEY_USER_WEBHOOK_SECRET,
             PageIds = PageIds
         )
 
+    def flatten_constants(constants: dict) -> Dict[str, str]:
+        """Flattens a dictionary of constants, see template_globals()."""
+        res = dict()
+        for key, value in constants.items():
+            if hasattr(value, "as_flat_dict"):
+                res.update(value.as_flat_dict())
+            else:
+                res[key] = value
+        return res
+
+    # The global constants never change, so they are flattened once
+    flat_global_constants = flatten_constants(template_globals())
 
     @app.template_global()
     def get_flat_constants(local_constants: Dict[str, str]) -> Dict[str, str]:
@@ -126,17 +432,23 @@ def create_app():
             A dictionary of constants to be used on the page, as strings, consisting of the global
             and local constants.
         """
-        res = dict()
+        res = dict(flat_global_constants)
+        res.update(flatten_constants(dict(local_constants)))
+        return res
 
-        globals = template_globals()
-        globals.update(local_constants)
-        for key, value in globals.items():
-            if hasattr(value, "as_flat_dict"):
-                res.update(value.as_flat_dict())
-            else:
-                res[key] = value
+    # The navigation menus, by whether the user is logged in
+    menus = {
+        False: [MenuItem('/',                   PageIds.INDEX.value,    'Home'),
+                MenuItem('/login',              PageIds.LOGIN.value,    'Sign In')],
+        True:  [MenuItem('/',                   PageIds.INDEX.value,    'Home'),
+                MenuItem('/filter',             PageIds.FILTER.value,   'Filter'),
+                MenuItem('/settings',           PageIds.SETTINGS.value, 'Settings'),
+                MenuItem('javascript:void(0)',  'logout',               'Sign Out')],
+    }
 
-        return res
+    def is_logged_in_menu(cookies: dict) -> bool:
+        """Returns True iff the "logged in" navigation menu should be displayed."""
+        return cookies.get(COOKIE_MENU_TYPE) == COOKIE_MENU_TYPE_LOGGED_IN
 
     @app.template_global()
     def get_menu(cookies: dict) -> List[MenuItem]:
@@ -150,44 +462,62 @@ def create_app():
             A list of MenuItems representing the navigation menu, based on whether 
             the menu should includes entries for logged in or logged out users.
         """
-        res      = [MenuItem('/',                   PageIds.INDEX.value,    'Home')]
+        return menus[is_logged_in_menu(cookies)]
 
-        if cookies.get(COOKIE_MENU_TYPE) == COOKIE_MENU_TYPE_LOGGED_IN:
-            res += [MenuItem('/filter',             PageIds.FILTER.value,   'Filter'),
-                    MenuItem('/settings',           PageIds.SETTINGS.value, 'Settings'),
-                    MenuItem('javascript:void(0)',  'logout',               'Sign Out')]
-        else:
-            res += [MenuItem('/login',              PageIds.LOGIN.value,    'Sign In')]
+    # Rendered pages, keyed by page and menu type (see render_page())
+    rendered_pages = {}
 
-        return res
+    def render_page(page: PageIds, **context) -> Response:
+        """Renders the template of the given page, memoizing the result.
+
+        The output of the page templates only depends on the page and on the navigation menu
+        type, so each combination is rendered once and then served from memory, with a strong
+        ETag which allows browsers to revalidate it cheaply.
+        Pages are always rendered in debug mode, to reflect changes to the templates.
+
+        Args:
+            page:
+                The page to render.
+            context:
+                Additional variables for the template.
+        """
+        key = (page, is_logged_in_menu(request.cookies))
+        rendered = rendered_pages.get(key)
+        if rendered is None or app.debug:
+            body = render_template(f'{page.value}.html', page_id = page.value, **context).encode()
+            rendered = (body, hashlib.sha256(body).hexdigest()[:32])
+            rendered_pages[key] = rendered
+
+        body, etag = rendered
+        res = Response(body, content_type = "text/html; charset=utf-8")
+        res.set_etag(etag)
+        res.vary.add("Cookie")
+        return res.make_conditional(request)
 
     @app.route('/')
     def index_page():
-        page = PageIds.INDEX.value
-        return render_template(f'{page}.html', page_id = page)
+        return render_page(PageIds.INDEX)
 
     @app.route('/login')
     def login_page():
-        page = PageIds.LOGIN.value
-        return render_template(f'{page}.html', title = "Sign-up / Sign-in", page_id = page)
+        return render_page(PageIds.LOGIN, title = "Sign-up / Sign-in")
 
     @app.route('/tos')
     def tos_page():
-        page = PageIds.TOS.value
-        return render_template(f'{page}.html', title = "Terms & Conditions", page_id = page)
+        return render_page(PageIds.TOS, title = "Terms & Conditions")
 
     @app.route('/settings')
     def settings_page():
-        page = PageIds.SETTINGS.value
-        return render_template(f'{page}.html', title = "Settings", page_id = page)
+        return render_page(PageIds.SETTINGS, title = "Settings")
 
     @app.route('/filter')
     def filter_page():
-        page = PageIds.FILTER.value
         local_constants = dict( MAX_CTF_ENTRIES = MAX_CTF_ENTRIES, 
                                 ENTRY_SEPARATOR = ENTRY_SEPARATOR,
-                                MAX_ENTRY_NAME_LEN = MAX_ENTRY_NAME_LEN)
-        return render_template(f'{page}.html', title = "Filter", page_id = page, local_constants = local_constants)
+                                MAX_ENTRY_NAME_LEN = MAX_ENTRY_NAME_LEN,
+                                MAX_WEBHOOK_URL_LENGTH = MAX_WEBHOOK_URL_LENGTH,
+                                WEBHOOK_SECRET_LENGTH = WEBHOOK_SECRET_LENGTH)
+        return render_page(PageIds.FILTER, title = "Filter", local_constants = local_constants)
 
     return app
 
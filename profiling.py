@@ -0,0 +1,288 @@
+"""Opt-in, sampled profiling of request handlers.
+
+This module allows profiling a fraction of the requests served by the application,
+in order to find hot spots under real traffic. Each profiled request is dumped as a
+pstats file to a local directory, and the dumps can later be merged into a single
+pstats file and a flamegraph-ready "collapsed stacks" file, e.g.:
+
+    python profiling.py /tmp/profiles /tmp/writeups
+
+The collapsed stacks file can be fed directly to flamegraph.pl or speedscope.
+
+Profiling is disabled unless PROFILING_OUTPUT_DIR is set. Once enabled, requests are
+profiled either randomly (according to PROFILING_SAMPLE_RATE) or on demand, if they carry
+a PROFILING_HEADER header which matches the PROFILING_TOKEN secret.
+
+Since Python 3.12, cProfile records the code executed by all the threads of the process, so
+a request served concurrently with others (by other threads or greenlets) would be mixed with
+them. Therefore, the application reports the requests it serves to the profiler, and a request
+is only profiled if no other request is served from its start to its end: requests which
+start while others are in flight aren't profiled, and profiles which another request overlapped
+are discarded. On a busy multi-threaded server, profiling is therefore mostly done on demand,
+during quiet periods (or on a worker which serves a single request at a time).
+"""
+import argparse
+import cProfile
+import glob
+import hmac
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+# Environment variables used to configure the profiler
+ENV_OUTPUT_DIR  = "PROFILING_OUTPUT_DIR"
+ENV_SAMPLE_RATE = "PROFILING_SAMPLE_RATE"
+ENV_TOKEN       = "PROFILING_TOKEN"
+
+# Request header used to request profiling of a specific request
+PROFILING_HEADER = "X-Profiling-Token"
+
+PSTATS_SUFFIX = ".pstats"
+
+# Recursion limit when expanding the call graph into stacks
+_MAX_STACK_DEPTH = 64
+
+# Stacks which took less than this (in seconds) are pruned when expanding the call graph
+_MIN_STACK_TIME = 1e-6
+
+logger = logging.getLogger(__name__)
+
+class ProfilingException(Exception):
+    """Represents an exception thrown by the profiling module."""
+    pass
+
+class RequestProfiler(object):
+    """Profiles a sample of requests and dumps the results to a directory."""
+
+    def __init__(self, output_dir: str, sample_rate: float = 0.0, token: Optional[str] = None):
+        """Initialize a request profiler.
+
+        Args:
+            output_dir:
+                Directory to which the pstats dumps are written. Created if missing.
+            sample_rate:
+                Fraction (0.0 - 1.0) of requests which should be randomly profiled.
+            token:
+                A secret which, if provided in the PROFILING_HEADER header of a request,
+                forces the request to be profiled. If None, the header is ignored.
+        """
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError(f"Invalid sample rate: {sample_rate}")
+
+        self._output_dir = output_dir
+        self._sample_rate = sample_rate
+        self._token = token
+
+        # Only a single profiler may be active in the process at any given time
+        self._lock = threading.Lock()
+
+        # The amount of requests in flight, and whether another request overlapped the profiled one
+        self._requests_lock = threading.Lock()
+        self._active_requests = 0
+        self._profiling = False
+        self._overlapped = False
+
+        os.makedirs(output_dir, exist_ok = True)
+
+    @property
+    def output_dir(self) -> str:
+        """The directory to which the pstats dumps are written."""
+        return self._output_dir
+
+    @classmethod
+    def from_environment(cls) -> Optional["RequestProfiler"]:
+        """Creates a profiler based on the environment variables.
+
+        Returns:
+            A RequestProfiler instance, or None if profiling isn't enabled.
+
+        Raises:
+            ProfilingException: The profiling configuration is invalid.
+        """
+        output_dir = os.environ.get(ENV_OUTPUT_DIR)
+        if not output_dir:
+            return None
+
+        try:
+            sample_rate = float(os.environ.get(ENV_SAMPLE_RATE, "0"))
+            return cls(output_dir, sample_rate, os.environ.get(ENV_TOKEN) or None)
+        except (ValueError, OSError) as e:
+            raise ProfilingException("Invalid profiling configuration") from e
+
+    def should_profile(self, headers: Mapping[str, str]) -> bool:
+        """Decides whether the current request should be profiled.
+
+        Args:
+            headers:
+                The request headers.
+
+        Returns:
+            True if the request carries a valid profiling token or was randomly sampled.
+        """
+        provided_token = headers.get(PROFILING_HEADER)
+        if self._token is not None and provided_token is not None:
+            return hmac.compare_digest(provided_token.encode(), self._token.encode())
+
+        return random.random() < self._sample_rate
+
+    def request_started(self) -> None:
+        """Reports that the application started serving a request."""
+        with self._requests_lock:
+            self._active_requests += 1
+            if self._profiling:
+                self._overlapped = True
+
+    def request_finished(self) -> None:
+        """Reports that the application finished serving a request."""
+        with self._requests_lock:
+            self._active_requests -= 1
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        """Profiles the code executed within the context and dumps the result.
+
+        If another request is currently being profiled or served (see request_started()),
+        the code is executed without profiling. If another request starts before the context
+        exits, the profile is discarded.
+
+        Args:
+            name:
+                A name identifying the profiled code, used as a prefix for the dump file.
+        """
+        if not self._lock.acquire(blocking = False):
+            yield
+            return
+
+        try:
+            with self._requests_lock:
+                # The profiled request itself is in flight
+                concurrent = self._active_requests > 1
+                if not concurrent:
+                    self._profiling = True
+                    self._overlapped = False
+            if concurrent:
+                yield
+                return
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                with self._requests_lock:
+                    self._profiling = False
+                    overlapped = self._overlapped
+                if overlapped:
+                    logger.warning(f"Discarded the profile of {name}, which other requests overlapped")
+                else:
+                    filename = f"{name}-{time.time_ns()}-{os.getpid()}{PSTATS_SUFFIX}"
+                    profiler.dump_stats(os.path.join(self._output_dir, filename))
+        finally:
+            self._lock.release()
+
+def _format_function(func: Tuple[str, int, str]) -> str:
+    """Formats a pstats function key as a single stack frame."""
+    filename, line, name = func
+    if filename == "~":
+        # Built-in function
+        return name
+    return f"{os.path.basename(filename)}:{name}:{line}"
+
+def collapse_stacks(stats: pstats.Stats) -> Dict[str, float]:
+    """Converts profiling statistics to collapsed stacks.
+
+    cProfile only records caller/callee pairs, not complete stacks. Therefore, stacks are
+    reconstructed by walking the call graph from its roots, splitting the time of each function
+    between its callers in proportion to the time each caller spent in it.
+    This is the same approximation used by common pstats-to-flamegraph converters.
+
+    Args:
+        stats:
+            The (possibly merged) profiling statistics.
+
+    Returns:
+        A dictionary mapping each stack (frames separated by ";") to its self-time in seconds.
+    """
+    callees: Dict[tuple, List[Tuple[tuple, float]]] = {}
+    roots = []
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, (_, _, _, caller_cumtime) in callers.items():
+            callees.setdefault(caller, []).append((func, caller_cumtime))
+
+    res: Dict[str, float] = {}
+
+    def walk(func: tuple, stack: List[str], path: set, share: float):
+        tottime = stats.stats[func][2]
+        frames = stack + [_format_function(func)]
+        key = ";".join(frames)
+        res[key] = res.get(key, 0.0) + tottime * share
+
+        if len(frames) >= _MAX_STACK_DEPTH:
+            return
+        for callee, edge_time in callees.get(func, []):
+            if callee in path:
+                continue
+            callee_cumtime = stats.stats[callee][3]
+            if callee_cumtime == 0 or edge_time * share < _MIN_STACK_TIME:
+                continue
+            walk(callee, frames, path | {callee}, share * edge_time / callee_cumtime)
+
+    for root in roots:
+        walk(root, [], {root}, 1.0)
+
+    return {stack: seconds for stack, seconds in res.items() if seconds > 0}
+
+def merge_profiles(input_dir: str, output_prefix: str) -> int:
+    """Merges all pstats dumps in a directory.
+
+    Writes two files:
+        <output_prefix>.pstats: The merged statistics, usable with pstats / snakeviz.
+        <output_prefix>.collapsed: Flamegraph-ready collapsed stacks (weights in microseconds).
+
+    Args:
+        input_dir:
+            The directory containing the pstats dumps.
+        output_prefix:
+            The path prefix for the output files.
+
+    Returns:
+        The number of merged dumps.
+
+    Raises:
+        ProfilingException: No dumps were found in the input directory.
+    """
+    paths = sorted(glob.glob(os.path.join(input_dir, f"*{PSTATS_SUFFIX}")))
+    if len(paths) == 0:
+        raise ProfilingException(f"No profiles found in {input_dir}")
+
+    stats = pstats.Stats(paths[0])
+    for path in paths[1:]:
+        stats.add(path)
+
+    stats.dump_stats(output_prefix + PSTATS_SUFFIX)
+
+    with open(output_prefix + ".collapsed", "w") as f:
+        for stack, seconds in sorted(collapse_stacks(stats).items()):
+            weight = round(seconds * 1_000_000)
+            if weight > 0:
+                f.write(f"{stack} {weight}\n")
+
+    return len(paths)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Merge request profiles into a flamegraph-ready file.")
+    parser.add_argument("input_dir", help = "Directory containing the pstats dumps")
+    parser.add_argument("output_prefix", help = "Path prefix for the merged output files")
+    args = parser.parse_args()
+
+    count = merge_profiles(args.input_dir, args.output_prefix)
+    print(f"Merged {count} profiles into {args.output_prefix}{PSTATS_SUFFIX} and {args.output_prefix}.collapsed")
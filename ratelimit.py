@@ -0,0 +1,144 @@
+"""In-process rate limiting using token buckets.
+
+Each key (e.g. a user ID or a client IP) is assigned a bucket holding up to "burst" tokens,
+refilled at a constant rate. Each request consumes a single token (or a given cost, for requests
+doing the work of several), and is rejected if the bucket doesn't hold enough tokens. A request
+costing more than the burst size is allowed once the bucket is full, leaving the bucket in debt,
+so that it costs the same as the equivalent amount of single requests.
+
+Buckets are kept in LRU order, and only for keys which were active recently: a bucket which
+has been idle long enough to refill completely is indistinguishable from a new one, and is
+therefore evicted. The total amount of buckets is capped as well, so memory is O(1) per
+active key.
+
+Note that the limiter state is per-process: when serving with multiple worker processes,
+each worker enforces the limits independently.
+"""
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+# Value of a rate limit environment variable which disables the limit
+RATE_LIMIT_DISABLED = "off"
+
+class _TokenBucket(object):
+    """The state of a single token bucket."""
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+class RateLimiter(object):
+    """A thread-safe token bucket rate limiter, keyed by an arbitrary hashable key."""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100000,
+                 clock: Callable[[], float] = time.monotonic):
+        """Initialize a rate limiter.
+
+        Args:
+            rate:
+                Amount of tokens added to each bucket per second.
+            burst:
+                Maximum amount of tokens in a bucket, i.e. the amount of requests allowed in a burst.
+            max_keys:
+                Maximum amount of buckets to track. When exceeded, the least recently used
+                bucket is evicted.
+            clock:
+                A monotonic clock, returning the time in seconds.
+        """
+        if rate <= 0 or burst < 1 or max_keys < 1:
+            raise ValueError("Invalid rate limiter configuration")
+
+        self._rate = rate
+        self._burst = burst
+        self._max_keys = max_keys
+        self._clock = clock
+
+        # Time it takes an empty bucket to refill completely
+        self._refill_time = burst / rate
+
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls, env_var: str, default: Tuple[float, int]) -> Optional["RateLimiter"]:
+        """Returns a rate limiter configured by the given environment variable.
+
+        The variable holds the limit as "<requests per second>,<burst size>", or RATE_LIMIT_DISABLED.
+
+        Args:
+            env_var:
+                The name of the environment variable.
+            default:
+                The limit as (requests per second, burst size), if the variable isn't set.
+
+        Returns:
+            The rate limiter, or None if the limit is disabled.
+
+        Raises:
+            ValueError: The variable holds an invalid limit.
+        """
+        value = os.environ.get(env_var)
+        if value is None:
+            return cls(*default)
+        if value.strip().lower() == RATE_LIMIT_DISABLED:
+            return None
+        rate, burst = value.split(",")
+        return cls(float(rate), int(burst))
+
+    def __len__(self) -> int:
+        """The amount of buckets currently tracked."""
+        return len(self._buckets)
+
+    def acquire(self, key: Hashable, cost: float = 1) -> float:
+        """Attempts to consume tokens for the given key.
+
+        Args:
+            key:
+                The key to rate limit by.
+            cost:
+                The amount of tokens the request consumes. A cost above the burst size requires
+                a full bucket, and leaves the bucket in debt.
+
+        Returns:
+            0 if the request is allowed. Otherwise, the amount of seconds until a token will
+            be available.
+        """
+        now = self._clock()
+        with self._lock:
+            self._evict_idle(now)
+
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = _TokenBucket(self._burst, now)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self._max_keys:
+                    self._buckets.popitem(last = False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket.tokens = min(self._burst, bucket.tokens + (now - bucket.updated) * self._rate)
+                bucket.updated = now
+
+            required = min(cost, self._burst)
+            if bucket.tokens >= required:
+                bucket.tokens -= cost
+                return 0
+
+            return (required - bucket.tokens) / self._rate
+
+    def _evict_idle(self, now: float) -> None:
+        """Evicts the buckets which have been idle long enough to refill completely.
+
+        Buckets are ordered by last use, so only the oldest buckets need to be inspected.
+        Must be called with the lock held.
+        """
+        while len(self._buckets) > 0:
+            bucket = next(iter(self._buckets.values()))
+            # Buckets in debt take longer to refill
+            if now - bucket.updated < self._refill_time + max(0, -bucket.tokens) / self._rate:
+                break
+            self._buckets.popitem(last = False)
@@ -0,0 +1,172 @@
+"""Replays captured upstream feed snapshots through the filtering and caching layers.
+
+The application captures every fetched snapshot of the upstream feed when FEED_CAPTURE_DIR
+is set (see feed.FeedRecorder). This tool feeds a captured sequence into the same filtering
+and caching layers used by the application, simulating a population of users polling the
+feed on every captured fetch, and reports per-snapshot statistics.
+
+Usage:
+    python replay.py <capture_dir> [--users N | --users-file users.json] [--speed N] [--baseline]
+
+The users file (optional) is either an export of the user data (the "/data" node of the database,
+mapping user IDs to their data, see database.py), or a JSON object mapping user IDs to lists of
+CTF names. Otherwise, users are synthesized from words in the captured titles.
+"""
+from ctf_names import CtfNameSet
+from feed_cache import FeedCache
+from typing import Dict, List
+import argparse
+import feed
+import filter
+import formats
+import json
+import random
+import time
+
+# Key and separator of the CTF names in the user data (see database.py, which isn't imported here
+# since it connects to the database when imported)
+KEY_USER_CTF_NAMES = "ctf_names"
+ENTRY_SEPARATOR = "␞"
+
+def _synthesize_users(titles: List[str], num_users: int, names_per_user: int, seed: int = 0) -> Dict[str, CtfNameSet]:
+    """Creates users following CTF names taken from the given titles (the first word(s) of random titles)."""
+    rng = random.Random(seed)
+    candidates = sorted({" ".join(title.split()[:rng.choice((1, 2))]) for title in titles if title.strip()})
+    if len(candidates) == 0:
+        return {}
+    res = {}
+    for i in range(num_users):
+        names = rng.sample(candidates, min(names_per_user, len(candidates)))
+        res[f"user{i}"] = CtfNameSet.from_names(names)
+    return res
+
+def _load_users(path: str) -> Dict[str, CtfNameSet]:
+    """Loads users from an export of the user data, or from a JSON object mapping user IDs to lists of CTF names.
+
+    Users of the export without CTF names are skipped, as the application doesn't serve their feed.
+
+    Raises:
+        ValueError: The file maps a user ID to neither user data nor a list of CTF names.
+    """
+    with open(path, encoding = "utf-8") as f:
+        data = json.load(f)
+    res = {}
+    for uid, value in data.items():
+        if isinstance(value, dict):
+            ctf_names = value.get(KEY_USER_CTF_NAMES)
+            if ctf_names is None:
+                continue
+            names = ctf_names.split(ENTRY_SEPARATOR)
+        elif isinstance(value, list) and all(isinstance(name, str) for name in value):
+            names = value
+        else:
+            raise ValueError(f"Invalid CTF names for user {uid} in {path}: expected user data or a list of names")
+        res[uid] = CtfNameSet.from_names(names)
+    return res
+
+def replay(capture_dir: str, users: Dict[str, CtfNameSet], output_format: formats.OutputFormat,
+           match_mode: filter.MatchMode, speed: float, baseline: bool) -> None:
+    """Replays the captured fetches, printing a line per fetch and a summary.
+
+    Args:
+        capture_dir:
+            The capture directory.
+        users:
+            The simulated users, polling on every captured fetch.
+        output_format:
+            The output format requested by the users.
+        match_mode:
+            The mode used for matching CTF names to titles.
+        speed:
+            Speedup relative to the captured timing (e.g. 60 replays an hour in a minute).
+            0 replays as fast as possible.
+        baseline:
+            Whether to also measure the uncached filter_writeups() path for comparison.
+    """
+    feed_cache = FeedCache(match_mode)
+    previous_guids = None
+    previous_time = None
+    total_seconds = 0.0
+    total_baseline_seconds = 0.0
+
+    header = f"{'#':>5} {'Time':<20}{'Snapshot':<10}{'Items':>7}{'Added':>7}{'Parse hit':>10}{'Render hits':>13}{'Process (ms)':>14}"
+    if baseline:
+        header += f"{'Baseline (ms)':>15}"
+    print(header)
+
+    for i, captured in enumerate(feed.load_captured_feeds(capture_dir)):
+        if speed > 0 and previous_time is not None:
+            time.sleep(max(0.0, captured.time - previous_time) / speed)
+        previous_time = captured.time
+
+        stats_before = feed_cache.stats
+        start = time.perf_counter()
+        parsed_feed = feed_cache.get_parsed_feed(captured.upstream.text)
+        for ctf_names in users.values():
+            feed_cache.render(parsed_feed, ctf_names, output_format)
+        seconds = time.perf_counter() - start
+        total_seconds += seconds
+        stats_after = feed_cache.stats
+
+        guids = [item.guid or item.link for item in parsed_feed.items]
+        added = len(guids) if previous_guids is None else len(set(guids) - previous_guids)
+        previous_guids = set(guids)
+
+        parse_hit = stats_after["parsed_hits"] > stats_before["parsed_hits"]
+        render_hits = stats_after["rendered_hits"] - stats_before["rendered_hits"]
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(captured.time))
+        line = (f"{i:>5} {timestamp:<20}{captured.digest[:8]:<10}{len(guids):>7}{added:>7}"
+                f"{'yes' if parse_hit else 'no':>10}{f'{render_hits}/{len(users)}':>13}{seconds * 1000:>14.2f}")
+
+        if baseline:
+            start = time.perf_counter()
+            for ctf_names in users.values():
+                filter.filter_writeups(captured.upstream.text, ctf_names, match_mode)
+            baseline_seconds = time.perf_counter() - start
+            total_baseline_seconds += baseline_seconds
+            line += f"{baseline_seconds * 1000:>15.2f}"
+
+        print(line)
+
+    stats = feed_cache.stats
+    renders = stats["rendered_hits"] + stats["rendered_misses"]
+    parses = stats["parsed_hits"] + stats["parsed_misses"]
+    print()
+    print(f"Users: {len(users)} ({len(set(users.values()))} distinct filters)")
+    if parses > 0:
+        print(f"Parsed feed cache hit rate: {stats['parsed_hits'] / parses:.1%} ({stats['parsed_hits']}/{parses})")
+    if renders > 0:
+        print(f"Rendered feed cache hit rate: {stats['rendered_hits'] / renders:.1%} ({stats['rendered_hits']}/{renders})")
+    print(f"Total processing time: {total_seconds * 1000:.2f} ms")
+    if baseline:
+        print(f"Total baseline time: {total_baseline_seconds * 1000:.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Replay captured upstream feed snapshots.")
+    parser.add_argument("capture_dir", help = "Directory captured via FEED_CAPTURE_DIR")
+    parser.add_argument("--users", type = int, default = 100, help = "Amount of synthesized users")
+    parser.add_argument("--names-per-user", type = int, default = 5, help = "Amount of CTF names per synthesized user")
+    parser.add_argument("--users-file", help = "Export of the user data, or JSON file mapping user IDs to lists of CTF names")
+    parser.add_argument("--format", choices = [f.value for f in formats.OutputFormat], default = formats.OutputFormat.RSS.value,
+                        help = "Output format requested by the users")
+    parser.add_argument("--match-mode", choices = [m.value for m in filter.MatchMode], default = filter.MatchMode.CASEFOLD.value,
+                        help = "Mode for matching CTF names to titles")
+    parser.add_argument("--speed", type = float, default = 0, help = "Speedup relative to the captured timing (0: as fast as possible)")
+    parser.add_argument("--baseline", action = "store_true", help = "Also measure the uncached filter_writeups() path")
+    args = parser.parse_args()
+
+    if args.users_file:
+        try:
+            users = _load_users(args.users_file)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        first = next(iter(feed.load_captured_feeds(args.capture_dir)), None)
+        titles = filter.ParsedFeed(first.upstream.text).titles if first is not None else []
+        users = _synthesize_users(titles, args.users, args.names_per_user)
+
+    replay(args.capture_dir, users, formats.OutputFormat(args.format), filter.MatchMode(args.match_mode),
+           args.speed, args.baseline)
+
+if __name__ == "__main__":
+    main()
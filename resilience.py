@@ -0,0 +1,366 @@
+"""Graceful degradation of database reads.
+
+Reads from the database might be slow or fail (e.g. when a Firebase region is degraded). Instead of
+stalling every request thread, reads go through a ResilientReader, which:
+  - bounds the total duration of a read,
+  - hedges slow reads: if an attempt doesn't complete within the hedge delay, another attempt is
+    issued, and the first successful result is used,
+  - retries failed attempts, within the same total duration,
+  - serves user lists from a UserListSnapshot when the read still fails. The snapshot holds the
+    user lists read most recently (up to SNAPSHOT_MAX_ENTRIES), and is periodically persisted to
+    disk so that it survives restarts. Processes sharing the snapshot file (e.g. the workers of the
+    server) merge their changes into it, under a file lock.
+
+Attempts run on a bounded thread pool, so a stalled backend can't exhaust the server threads.
+Once a read completes or times out, its queued attempts are cancelled, while attempts which already
+started keep a pool thread until the underlying HTTP timeout expires.
+"""
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Optional, TypeVar
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+# Environment variable holding the path of the persisted user lists snapshot
+ENV_SNAPSHOT_PATH = "USER_LISTS_SNAPSHOT_PATH"
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "build", "user_lists.json")
+
+# Maximal amount of user lists in the snapshot. The least recently read lists are evicted first.
+SNAPSHOT_MAX_ENTRIES = 20000
+
+# Maximal total duration (in seconds) of a read, including hedged and retried attempts
+READ_TIMEOUT = 2.0
+
+# Delay (in seconds) after which a slow attempt is hedged by another attempt
+HEDGE_DELAY = 0.3
+
+# Maximal amount of attempts per read
+MAX_ATTEMPTS = 3
+
+# Amount of threads executing read attempts
+READ_WORKERS = 16
+
+# Amount of threads reading the lists of the users of a batch concurrently
+BATCH_READ_WORKERS = 8
+
+# Maximal total duration (in seconds) of reading the lists of a batch of users.
+# The lists which weren't read by then are served from the snapshot.
+BATCH_READ_TIMEOUT = 4.0
+
+# Interval (in seconds) between persisting the user lists snapshot
+SNAPSHOT_PERSIST_INTERVAL = 300
+
+T = TypeVar("T")
+
+# The result of reading the lists of multiple users: the list of each existing user, by user ID,
+# and the set of user IDs whose list couldn't be read (and isn't in the snapshot)
+UserLists = namedtuple("UserLists", "lists unavailable")
+
+logger = logging.getLogger(__name__)
+
+class ResilienceException(Exception):
+    """Represents an exception thrown by the resilience module."""
+    pass
+
+class UserListSnapshot(object):
+    """A bounded local copy of user lists, keyed by user ID, periodically persisted to a JSON file."""
+
+    def __init__(self, path: Optional[str] = None, persist_interval: float = SNAPSHOT_PERSIST_INTERVAL,
+                 max_entries: int = SNAPSHOT_MAX_ENTRIES):
+        """Initialize the snapshot, loading the persisted copy if available.
+
+        Args:
+            path:
+                The path of the persisted snapshot. If None, the snapshot is kept in memory only.
+            persist_interval:
+                The interval (in seconds) between persisting the snapshot, once changed.
+            max_entries:
+                The maximal amount of user lists in the snapshot.
+        """
+        self._path = path
+        self._persist_interval = persist_interval
+        self._max_entries = max_entries
+        # Maps each user ID to its list, by order of use
+        self._lists = self._load()
+        # The user IDs whose list changed since the snapshot was last persisted, by order of change
+        self._changes = OrderedDict()
+        self._lock = threading.Lock()
+        self._persister = None
+        self._evict()
+
+    @classmethod
+    def from_environment(cls) -> "UserListSnapshot":
+        """Returns a snapshot persisted to the path set in the environment."""
+        return cls(os.environ.get(ENV_SNAPSHOT_PATH, DEFAULT_SNAPSHOT_PATH))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._lists)
+
+    def get(self, uid: str) -> Optional[str]:
+        """Returns the last known list of the given user, or None if unknown."""
+        with self._lock:
+            return self._lists.get(uid)
+
+    def update(self, uid: str, user_list: Optional[str]) -> None:
+        """Records the current list of the given user (None if the user doesn't exist)."""
+        with self._lock:
+            if self._lists.get(uid) == user_list:
+                if user_list is not None:
+                    self._lists.move_to_end(uid)
+                return
+            if user_list is None:
+                del self._lists[uid]
+            else:
+                self._lists[uid] = user_list
+                self._lists.move_to_end(uid)
+                self._evict()
+            self._changes[uid] = None
+            self._changes.move_to_end(uid)
+            if self._path is not None and self._persister is None:
+                self._persister = threading.Thread(target = self._persist_periodically, daemon = True)
+                self._persister.start()
+
+    def persist(self) -> None:
+        """Merges the changes since the snapshot was last persisted into its file, if any.
+
+        The file is locked while merging, and replaced atomically.
+        """
+        with self._lock:
+            if len(self._changes) == 0 or self._path is None:
+                return
+            changes = OrderedDict((uid, self._lists.get(uid)) for uid in self._changes)
+            self._changes.clear()
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok = True)
+            with open(f"{self._path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                lists = self._load()
+                for uid, user_list in changes.items():
+                    lists.pop(uid, None)
+                    if user_list is not None:
+                        lists[uid] = user_list
+                while len(lists) > self._max_entries:
+                    lists.popitem(last = False)
+                tmp_path = f"{self._path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(lists, f)
+                os.replace(tmp_path, self._path)
+        except OSError:
+            # Merge the changes on the next persist
+            with self._lock:
+                for uid in changes:
+                    self._changes.setdefault(uid, None)
+            raise
+
+    def _load(self) -> "OrderedDict[str, str]":
+        """Returns the persisted user lists, or no lists if the file is missing or corrupt."""
+        if self._path is None or not os.path.exists(self._path):
+            return OrderedDict()
+        try:
+            with open(self._path) as f:
+                return OrderedDict(json.load(f))
+        except (OSError, ValueError):
+            # A corrupt snapshot is replaced on the next persist
+            return OrderedDict()
+
+    def _evict(self) -> None:
+        while len(self._lists) > self._max_entries:
+            self._lists.popitem(last = False)
+
+    def _persist_periodically(self) -> None:
+        while True:
+            time.sleep(self._persist_interval)
+            try:
+                self.persist()
+            except OSError as e:
+                logger.warning(f"Failed to persist the user lists snapshot: {e}")
+
+class ResilientReader(object):
+    """Executes database reads with a bounded duration, hedging, retries and a snapshot fallback."""
+
+    def __init__(self, timeout: float = READ_TIMEOUT, hedge_delay: float = HEDGE_DELAY, max_attempts: int = MAX_ATTEMPTS,
+                 workers: int = READ_WORKERS, snapshot: Optional[UserListSnapshot] = None):
+        """Initialize the reader.
+
+        Args:
+            timeout:
+                The default maximal total duration (in seconds) of a read.
+            hedge_delay:
+                The delay (in seconds) after which a slow attempt is hedged by another attempt.
+            max_attempts:
+                The maximal amount of attempts per read.
+            workers:
+                The amount of threads executing attempts.
+            snapshot:
+                The snapshot user lists are served from when they can't be read.
+                If None, an in-memory snapshot is used.
+        """
+        self._timeout = timeout
+        self._hedge_delay = hedge_delay
+        self._max_attempts = max_attempts
+        self._executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "resilient-read")
+        self._batch_executor = ThreadPoolExecutor(max_workers = BATCH_READ_WORKERS, thread_name_prefix = "batch-read")
+        self._snapshot = snapshot if snapshot is not None else UserListSnapshot()
+        self._metrics_lock = threading.Lock()
+        self._metrics = dict(reads = 0, hedged_attempts = 0, retried_attempts = 0, timeouts = 0, failures = 0,
+                             fallbacks = 0, fallback_misses = 0)
+
+    @property
+    def metrics(self) -> Dict[str, int]:
+        """Counters of reads, hedged and retried attempts, timed out and failed reads, and of user lists served
+        from the snapshot (fallbacks) or unavailable in it (fallback misses)."""
+        with self._metrics_lock:
+            return dict(self._metrics, snapshot_size = len(self._snapshot))
+
+    @property
+    def snapshot(self) -> UserListSnapshot:
+        """The snapshot user lists are served from when they can't be read."""
+        return self._snapshot
+
+    def _count(self, metric: str) -> None:
+        with self._metrics_lock:
+            self._metrics[metric] += 1
+
+    def read(self, func: Callable[[], T], timeout: Optional[float] = None) -> T:
+        """Executes a read, hedging slow attempts and retrying failed ones.
+
+        Args:
+            func:
+                Executes a single attempt of the read.
+            timeout:
+                The maximal total duration (in seconds) of the read. Defaults to the reader's timeout.
+
+        Returns:
+            The result of the first successful attempt.
+
+        Raises:
+            ResilienceException: No attempt succeeded within the timeout.
+        """
+        self._count("reads")
+        deadline = time.monotonic() + (timeout if timeout is not None else self._timeout)
+        pending = {self._executor.submit(func)}
+        attempts = 1
+        last_error = None
+
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout = min(remaining, self._hedge_delay) if attempts < self._max_attempts else remaining,
+                                     return_when = FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        return future.result()
+                    except Exception as e:
+                        last_error = e
+
+                if attempts >= self._max_attempts:
+                    if len(pending) == 0:
+                        break
+                elif len(done) == 0 or len(pending) == 0:
+                    # Hedge a slow attempt, or retry once all attempts failed
+                    self._count("hedged_attempts" if len(done) == 0 else "retried_attempts")
+                    pending.add(self._executor.submit(func))
+                    attempts += 1
+        finally:
+            # Attempts which didn't start yet would only add load to a slow backend
+            for future in pending:
+                future.cancel()
+
+        if len(pending) > 0:
+            self._count("timeouts")
+            raise ResilienceException("Read timed out") from last_error
+        self._count("failures")
+        raise ResilienceException("Read failed") from last_error
+
+    def read_user_list(self, uid: str, func: Callable[[], Optional[str]], timeout: Optional[float] = None) -> Optional[str]:
+        """Reads the list of a user, falling back to the snapshot if the read fails.
+
+        Args:
+            uid:
+                The user ID.
+            func:
+                Reads the list of the user from the database (None if the user doesn't exist).
+            timeout:
+                The maximal total duration (in seconds) of the read. Defaults to the reader's timeout.
+
+        Returns:
+            The list of the user, or None if the user doesn't exist.
+
+        Raises:
+            ResilienceException: The read failed, and the user isn't in the snapshot.
+        """
+        try:
+            user_list = self.read(func, timeout)
+        except ResilienceException as e:
+            return self._fallback(uid, e)
+        self._snapshot.update(uid, user_list)
+        return user_list
+
+    def read_user_lists(self, uids: Iterable[str], func: Callable[[str], Optional[str]],
+                        timeout: float = BATCH_READ_TIMEOUT) -> UserLists:
+        """Reads the lists of multiple users concurrently, falling back to the snapshot for each failed read.
+
+        Only the lists of the given users are read, so the cost grows with the amount of users
+        rather than with the size of the database.
+
+        Args:
+            uids:
+                The user IDs.
+            func:
+                Reads the list of the given user from the database (None if the user doesn't exist).
+            timeout:
+                The maximal total duration (in seconds) of reading all the lists. The lists which
+                weren't read by then are served from the snapshot.
+
+        Returns:
+            The list of each existing user, and the user IDs whose read failed and which are
+            missing from the snapshot. Users which don't exist are omitted from both.
+        """
+        deadline = time.monotonic() + timeout
+        unavailable = object()
+
+        def fallback(uid: str) -> object:
+            try:
+                return self._fallback(uid, ResilienceException("Batch read timed out"))
+            except ResilienceException:
+                return unavailable
+
+        def read_user_list(uid: str) -> object:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return fallback(uid)
+            try:
+                return self.read_user_list(uid, lambda: func(uid), min(remaining, self._timeout))
+            except ResilienceException:
+                return unavailable
+
+        futures = {uid: self._batch_executor.submit(read_user_list, uid) for uid in dict.fromkeys(uids)}
+        wait(futures.values(), timeout = timeout)
+        res = UserLists({}, set())
+        for uid, future in futures.items():
+            # Reads which didn't complete by the deadline (e.g. still queued) fall back to the snapshot
+            if future.cancel() or not future.done():
+                user_list = fallback(uid)
+            else:
+                user_list = future.result()
+            if user_list is unavailable:
+                res.unavailable.add(uid)
+            elif user_list is not None:
+                res.lists[uid] = user_list
+        return res
+
+    def _fallback(self, uid: str, error: ResilienceException) -> str:
+        user_list = self._snapshot.get(uid)
+        if user_list is None:
+            self._count("fallback_misses")
+            raise ResilienceException(f"Failed to read the list of user {uid}, which isn't in the snapshot") from error
+        self._count("fallbacks")
+        logger.warning(f"Serving the list of user {uid} from the snapshot: {error.__cause__ or error}")
+        return user_list
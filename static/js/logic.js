@@ -104,6 +104,47 @@ WriteupFeedFilter.Database = {};
         await ref.child(constants.KEY_USER_CTF_NAMES).set(new_ctf_names);
     }
 
+    context.get_webhook_url = async function(uid)
+    {
+        const snapshot = await db.ref(path_to_user_data(uid)).child(constants.KEY_USER_WEBHOOK_URL).once('value');
+        return snapshot.val() || "";
+    }
+
+    const generate_webhook_secret = function()
+    {
+        const bytes = new Uint8Array(parseInt(constants.WEBHOOK_SECRET_LENGTH) / 2);
+        window.crypto.getRandomValues(bytes);
+        return Array.from(bytes, b => b.toString(16).padStart(2, "0")).join("");
+    }
+
+    context.get_webhook_secret = async function(uid)
+    {
+        const snapshot = await db.ref(path_to_user_data(uid)).child(constants.KEY_USER_WEBHOOK_SECRET).once('value');
+        return snapshot.val() || "";
+    }
+
+    // Returns the secret the deliveries to the webhook are signed with ("" if the webhook was removed)
+    context.set_webhook_url = async function(uid, webhook_url)
+    {
+        const user_ref = db.ref(path_to_user_data(uid));
+        if (webhook_url == "")
+        {
+            await user_ref.child(constants.KEY_USER_WEBHOOK_URL).remove();
+            await user_ref.child(constants.KEY_USER_WEBHOOK_SECRET).remove();
+            return "";
+        }
+
+        // Deliveries are only made to webhooks with a secret, so the secret is created first
+        let webhook_secret = await context.get_webhook_secret(uid);
+        if (webhook_secret == "")
+        {
+            webhook_secret = generate_webhook_secret();
+            await user_ref.child(constants.KEY_USER_WEBHOOK_SECRET).set(webhook_secret);
+        }
+        await user_ref.child(constants.KEY_USER_WEBHOOK_URL).set(webhook_url);
+        return webhook_secret;
+    }
+
     context.delete_user_data = async function(uid)
     {
         await db.ref(path_to_user_data(uid)).remove();
@@ -254,9 +295,18 @@ if ($("body").data("page-id") == WriteupFeedFilter.Constants["PageIds.FILTER"])
                 }
             });
 
+            const webhook_url = $("#webhook_url").val().trim();
+            if ( (webhook_url != "") && (!webhook_url.startsWith("https://")) )
+            {
+                WriteupFeedFilter.Modal.show_modal( "modal_error", "Error", 
+                    "The webhook URL must start with https://");
+                return;
+            }
+
             try
             {
                 await WriteupFeedFilter.Database.set_ctf_names(user.uid, ctf_names_arr);
+                $("#webhook_secret").val(await WriteupFeedFilter.Database.set_webhook_url(user.uid, webhook_url));
             }
             catch (err)
             {
@@ -281,6 +331,9 @@ if ($("body").data("page-id") == WriteupFeedFilter.Constants["PageIds.FILTER"])
             const ctf_names = await WriteupFeedFilter.Database.get_ctf_names(user.uid);
             $("#ajax_loader").hide();
 
+            $("#webhook_url").val(await WriteupFeedFilter.Database.get_webhook_url(user.uid));
+            $("#webhook_secret").val(await WriteupFeedFilter.Database.get_webhook_secret(user.uid));
+
             ctf_names.forEach(ctf_name => 
             {
                 const input_wrapper = create_input_wrapper();
@@ -0,0 +1,226 @@
+"""Live streams of newly published writeups, as Server-Sent Events.
+
+A single StreamPublisher per process is shared by all the connected streams. Whenever a new
+snapshot of the upstream feed is observed (either by a feed request, or by the publisher's own
+background polling while streams are connected), the publisher finds the items which weren't
+published yet, matches them once against the distinct CTF name sets of all connected streams,
+and queues the matching events to each stream. Serving a stream only consists of waiting on its queue.
+
+The published items are remembered (see filter.PublishedItems), so that snapshots observed out
+of order (e.g. by concurrent requests) don't publish the same items again.
+
+The web process runs gevent workers (see Procfile), so a connected stream only holds a greenlet
+while waiting, and many idle streams are cheap. The amount of streams per process is still bounded
+(see MAX_STREAMS), below the worker's connection limit so that feed requests keep being served.
+"""
+from ctf_names import CtfNameSet
+from filter import MatchMode, ParsedFeed, PublishedItems
+from typing import Callable, Iterator, List, Optional
+import logging
+import queue
+import threading
+import time
+
+import formats
+
+# Interval (in seconds) between polls of the upstream feed while streams are connected
+STREAM_POLL_INTERVAL = 60
+
+# Default maximal amount of concurrently connected streams per process
+MAX_STREAMS = 768
+
+# Environment variable overriding the maximal amount of concurrently connected streams per process
+ENV_MAX_STREAMS = "MAX_STREAMS"
+
+# Maximal amount of events waiting to be sent to a single stream. Slower streams are closed
+STREAM_QUEUE_SIZE = 256
+
+# Interval (in seconds) between keep-alive comments, which also detect disconnected clients
+STREAM_HEARTBEAT_INTERVAL = 15
+
+# Maximal duration (in seconds) of a stream. Afterwards, the stream is closed and the client reconnects,
+# which spreads long lived connections over the server processes
+STREAM_MAX_DURATION = 30 * 60
+
+# Delay (in milliseconds) before a client reconnects to a closed stream
+STREAM_RETRY_MS = 5000
+
+# The SSE event type of a new writeup
+EVENT_WRITEUP = "writeup"
+
+logger = logging.getLogger(__name__)
+
+def format_event(data: str, event: Optional[str] = None, event_id: Optional[str] = None) -> str:
+    """Formats a Server-Sent Event."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}\n")
+    if event is not None:
+        lines.append(f"event: {event}\n")
+    lines.extend(f"data: {line}\n" for line in data.split("\n"))
+    lines.append("\n")
+    return "".join(lines)
+
+class StreamSubscription(object):
+    """A connected stream, receiving the events of the new items matching its CTF names."""
+
+    def __init__(self, publisher: "StreamPublisher", ctf_names: CtfNameSet):
+        self._publisher = publisher
+        self._ctf_names = ctf_names
+        self._queue = queue.Queue(maxsize = STREAM_QUEUE_SIZE)
+        self._closed = False
+
+    @property
+    def ctf_names(self) -> CtfNameSet:
+        """The normalized set of CTF names followed by the stream."""
+        return self._ctf_names
+
+    def put(self, events: List[str]) -> bool:
+        """Queues events to the stream. Returns False (and closes the stream) if the stream can't keep up."""
+        try:
+            for event in events:
+                self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.close()
+            return False
+
+    def close(self) -> None:
+        """Closes the stream and unsubscribes it from the publisher."""
+        if not self._closed:
+            self._closed = True
+            self._publisher.unsubscribe(self)
+            # Wake up the waiting events() generator
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def events(self, heartbeat_interval: float = STREAM_HEARTBEAT_INTERVAL,
+               max_duration: float = STREAM_MAX_DURATION) -> Iterator[str]:
+        """Yields the formatted events of the stream, until the stream is closed or reaches its maximal duration.
+
+        Keep-alive comments are yielded while there are no events. The stream is closed when the
+        generator is closed (i.e. when the client disconnects).
+        """
+        try:
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            deadline = time.monotonic() + max_duration
+            while not self._closed:
+                timeout = min(heartbeat_interval, deadline - time.monotonic())
+                if timeout <= 0:
+                    break
+                try:
+                    event = self._queue.get(timeout = timeout)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield event
+        finally:
+            self.close()
+
+class StreamPublisher(object):
+    """Publishes the new items of the upstream feed to the connected streams."""
+
+    def __init__(self, fetch_parsed_feed: Callable[[], ParsedFeed], match_mode: MatchMode = MatchMode.CASEFOLD,
+                 poll_interval: float = STREAM_POLL_INTERVAL, max_streams: int = MAX_STREAMS):
+        """Initialize the publisher.
+
+        Args:
+            fetch_parsed_feed:
+                Fetches and parses the upstream feed, used for polling while streams are connected.
+            match_mode:
+                The mode used for matching CTF names to titles.
+            poll_interval:
+                The interval (in seconds) between polls of the upstream feed.
+            max_streams:
+                The maximal amount of concurrently connected streams.
+        """
+        self._fetch_parsed_feed = fetch_parsed_feed
+        self._match_mode = match_mode
+        self._poll_interval = poll_interval
+        self._max_streams = max_streams
+        self._subscriptions = set()
+        self._last_version = None
+        self._published_items = PublishedItems()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._poller = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._subscriptions)
+
+    def subscribe(self, ctf_names: CtfNameSet) -> Optional[StreamSubscription]:
+        """Connects a stream following the given CTF names.
+
+        Returns:
+            The subscription, or None if the maximal amount of streams are already connected.
+        """
+        subscription = StreamSubscription(self, ctf_names)
+        with self._lock:
+            if len(self._subscriptions) >= self._max_streams:
+                return None
+            self._subscriptions.add(subscription)
+            if self._poller is None:
+                self._poller = threading.Thread(target = self._poll, daemon = True)
+                self._poller.start()
+            self._wakeup.notify_all()
+        return subscription
+
+    def unsubscribe(self, subscription: StreamSubscription) -> None:
+        """Disconnects a stream."""
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, parsed_feed: ParsedFeed) -> int:
+        """Publishes the items of the feed which weren't published yet.
+
+        The first published snapshot only serves as a reference for the following ones.
+        Each new item is matched once against the distinct CTF name sets of all connected streams.
+
+        Returns:
+            The amount of streams which received events.
+        """
+        with self._lock:
+            if self._last_version == parsed_feed.version:
+                return 0
+            is_first = self._last_version is None
+            self._last_version = parsed_feed.version
+
+            new_indices = set(self._published_items.new_item_indices(parsed_feed))
+            self._published_items.record(parsed_feed)
+            subscriptions = list(self._subscriptions)
+        if is_first or len(subscriptions) == 0 or len(new_indices) == 0:
+            return 0
+
+        # CtfNameSet instances are interned, so streams following the same names share the match
+        ctf_name_sets = {subscription.ctf_names: subscription.ctf_names for subscription in subscriptions}
+        matches = parsed_feed.match_many(ctf_name_sets, self._match_mode)
+
+        events = {}
+        for i in new_indices:
+            item = parsed_feed.items[i]
+            events[i] = format_event(formats.render_ndjson(parsed_feed, [i]).rstrip("\n"),
+                                     event = EVENT_WRITEUP, event_id = item.guid or item.link)
+
+        published = 0
+        for subscription in subscriptions:
+            subscription_events = [events[i] for i in matches[subscription.ctf_names] if i in new_indices]
+            if len(subscription_events) > 0 and subscription.put(subscription_events):
+                published += 1
+        return published
+
+    def _poll(self) -> None:
+        """Polls the upstream feed while streams are connected."""
+        while True:
+            with self._lock:
+                while len(self._subscriptions) == 0:
+                    self._wakeup.wait()
+            try:
+                self.publish(self._fetch_parsed_feed())
+            except Exception as e:
+                logger.error(e)
+            time.sleep(self._poll_interval)
@@ -0,0 +1,64 @@
+from assets import build_assets, select_encoding, get_content_hash
+from werkzeug.datastructures import Accept
+
+import unittest
+import tempfile
+import gzip
+import os
+
+
+class TestBuildAssets(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.static_folder = os.path.join(tmp_dir.name, "static")
+        self.build_folder = os.path.join(tmp_dir.name, "build")
+
+        self.script = b"function test() { return 1; }\n" * 100
+        self.image = os.urandom(256)
+        self._write("js/logic.js", self.script)
+        self._write("images/image.png", self.image)
+
+    def _write(self, relative_path, data):
+        path = os.path.join(self.static_folder, *relative_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def test_content_addressed(self):
+        built = build_assets(self.static_folder, self.build_folder)
+        self.assertEqual(set(built.keys()), {"js/logic.js", "images/image.png"})
+
+        script = built["js/logic.js"]
+        self.assertEqual(script.hash, get_content_hash(os.path.join(self.static_folder, "js", "logic.js")))
+        self.assertIn(script.hash, script.path)
+        with open(script.path, "rb") as f:
+            self.assertEqual(f.read(), self.script)
+
+    def test_compressed_variants(self):
+        built = build_assets(self.static_folder, self.build_folder)
+        script = built["js/logic.js"]
+        with open(script.encodings["gzip"], "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), self.script)
+        self.assertEqual(built["images/image.png"].encodings, {})
+
+    def test_hash_changes_with_contents(self):
+        before = build_assets(self.static_folder, self.build_folder)["js/logic.js"]
+        self._write("js/logic.js", self.script + b"// Changed\n")
+        after = build_assets(self.static_folder, self.build_folder)["js/logic.js"]
+        self.assertNotEqual(before.hash, after.hash)
+        self.assertTrue(os.path.exists(before.path))
+
+    def test_rebuild(self):
+        first = build_assets(self.static_folder, self.build_folder)
+        second = build_assets(self.static_folder, self.build_folder)
+        self.assertEqual(first, second)
+
+    def test_select_encoding(self):
+        script = build_assets(self.static_folder, self.build_folder)["js/logic.js"]
+        self.assertEqual(select_encoding(script, Accept([("gzip", 1)])), (script.encodings["gzip"], "gzip"))
+        self.assertEqual(select_encoding(script, Accept([("gzip", 0)])), (script.path, None))
+        self.assertEqual(select_encoding(script, Accept()), (script.path, None))
+
+if __name__ == '__main__':
+    unittest.main()
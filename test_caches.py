@@ -0,0 +1,123 @@
+from caches import BoundedCache, CacheException, CachePolicy, MemoryBudget, ENTRY_OVERHEAD, estimate_size
+
+import sys
+import unittest
+
+
+def _entry_size(value_size):
+    return value_size + ENTRY_OVERHEAD
+
+class TestEstimateSize(unittest.TestCase):
+    def test_containers(self):
+        text = "x" * 1000
+        self.assertGreaterEqual(estimate_size([text]), sys.getsizeof(text) + sys.getsizeof([text]))
+        # Shared objects are counted once
+        self.assertEqual(estimate_size([text, text]) - estimate_size([text]), sys.getsizeof([text, text]) - sys.getsizeof([text]))
+
+    def test_objects(self):
+        class Holder(object):
+            def __init__(self, value):
+                self.value = value
+        self.assertGreater(estimate_size(Holder("x" * 1000)), 1000)
+
+class TestBoundedCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = BoundedCache("test", _entry_size(100) * 3)
+        for key in "abc":
+            self.assertTrue(cache.put(key, key, size = 100))
+        self.assertEqual(cache.get("a"), "a")
+        cache.put("d", "d", size = 100)
+        self.assertNotIn("b", cache)
+        self.assertEqual(sorted(key for key in "abcd" if key in cache), ["a", "c", "d"])
+        self.assertEqual(cache.stats["evictions"], 1)
+        self.assertEqual(cache.resident_bytes, _entry_size(100) * 3)
+
+    def test_size_accounting(self):
+        cache = BoundedCache("test", _entry_size(100) * 3)
+        cache.put("a", "a", size = 100)
+        cache.put("b", "b", size = 200)
+        self.assertEqual(cache.resident_bytes, _entry_size(100) + _entry_size(200))
+        # A large entry evicts as many entries as needed
+        cache.put("c", "c", size = _entry_size(100) * 2)
+        self.assertEqual(len(cache), 1)
+        cache.pop("c")
+        self.assertEqual(cache.resident_bytes, 0)
+
+    def test_replace(self):
+        cache = BoundedCache("test", _entry_size(100) * 2)
+        cache.put("a", 1, size = 100)
+        cache.put("a", 2, size = 100)
+        self.assertEqual(cache.get("a"), 2)
+        self.assertEqual(cache.resident_bytes, _entry_size(100))
+
+    def test_oversized_rejected(self):
+        cache = BoundedCache("test", 1000)
+        self.assertFalse(cache.put("a", "a", size = 1000))
+        self.assertEqual(cache.stats["rejections"], 1)
+
+    def test_max_entries(self):
+        cache = BoundedCache("test", 1 << 20, max_entries = 2)
+        for key in "abc":
+            cache.put(key, key, size = 1)
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn("a", cache)
+
+    def test_evict(self):
+        cache = BoundedCache("test", 1 << 20)
+        for key in range(10):
+            cache.put(key, key, size = 1)
+        self.assertEqual(cache.evict(lambda key: key % 2 == 0), 5)
+        self.assertEqual(len(cache), 5)
+        self.assertEqual(cache.resident_bytes, _entry_size(1) * 5)
+
+    def test_tinylfu_admission(self):
+        cache = BoundedCache("test", _entry_size(100) * 2, CachePolicy.TINYLFU)
+        for key in ("popular1", "popular2"):
+            for _ in range(5):
+                cache.get(key)
+            cache.put(key, key, size = 100)
+
+        # A one-off entry doesn't replace popular entries
+        cache.get("one-off")
+        self.assertFalse(cache.put("one-off", "one-off", size = 100))
+        self.assertIn("popular1", cache)
+        self.assertIn("popular2", cache)
+        self.assertEqual(cache.stats["rejections"], 1)
+
+        # An entry which becomes more popular is admitted
+        for _ in range(10):
+            cache.get("rising")
+        self.assertTrue(cache.put("rising", "rising", size = 100))
+        self.assertNotIn("popular1", cache)
+
+    def test_lru_admits_everything(self):
+        cache = BoundedCache("test", _entry_size(100) * 2, CachePolicy.LRU)
+        for key in ("popular1", "popular2"):
+            for _ in range(5):
+                cache.get(key)
+            cache.put(key, key, size = 100)
+        self.assertTrue(cache.put("one-off", "one-off", size = 100))
+
+class TestMemoryBudget(unittest.TestCase):
+    def test_shares(self):
+        budget = MemoryBudget(1000, {"a": 0.25, "b": 0.75})
+        cache_a = budget.create_cache("a")
+        cache_b = budget.create_cache("b")
+        self.assertEqual(cache_a.max_bytes, 250)
+        self.assertEqual(cache_b.max_bytes, 750)
+        cache_b.put("key", "value", size = 10)
+        self.assertEqual(budget.resident_bytes, _entry_size(10))
+        self.assertEqual(budget.stats()["b"]["entries"], 1)
+
+    def test_invalid(self):
+        with self.assertRaises(CacheException):
+            MemoryBudget(1000, {"a": 0.5, "b": 0.6})
+        budget = MemoryBudget(1000, {"a": 1})
+        with self.assertRaises(CacheException):
+            budget.create_cache("unknown")
+        budget.create_cache("a")
+        with self.assertRaises(CacheException):
+            budget.create_cache("a")
+
+if __name__ == '__main__':
+    unittest.main()
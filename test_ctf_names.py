@@ -0,0 +1,50 @@
+from ctf_names import CtfNameSet
+
+import unittest
+import pickle
+import gc
+
+
+class TestCtfNameSet(unittest.TestCase):
+    def test_normalized(self):
+        name_set = CtfNameSet.from_names(["HITCON", "DEF CON", "hitcon", "", "Straße"])
+        self.assertEqual(name_set.names, ("def con", "hitcon", "strasse"))
+        self.assertEqual(len(name_set), 3)
+        self.assertIn("hitcon", name_set)
+
+    def test_empty(self):
+        self.assertEqual(len(CtfNameSet.from_names([""])), 0)
+        self.assertIs(CtfNameSet.from_names([""]), CtfNameSet.from_names([]))
+
+    def test_interned(self):
+        a = CtfNameSet.from_names(["MyCTF", "OtherCTF"])
+        b = CtfNameSet.from_names(["otherctf", "MYCTF", "MyCTF"])
+        self.assertIs(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertIsNot(a, CtfNameSet.from_names(["MyCTF"]))
+
+    def test_names_shared(self):
+        a = CtfNameSet.from_names(["".join(["Shared", "CTF"]), "A"])
+        b = CtfNameSet.from_names(["".join(["shared", "ctf"]), "B"])
+        self.assertIs(a.names[1], b.names[1])
+
+    def test_released_when_unreferenced(self):
+        name_set = CtfNameSet.from_names(["UnreferencedCTF"])
+        count = CtfNameSet.interned_count()
+        del name_set
+        gc.collect()
+        self.assertEqual(CtfNameSet.interned_count(), count - 1)
+
+    def test_hash_stable_when_reinterned(self):
+        name_set = CtfNameSet.from_names(["ReinternedCTF"])
+        name_set_hash = hash(name_set)
+        del name_set
+        gc.collect()
+        self.assertEqual(hash(CtfNameSet.from_names(["reinternedctf"])), name_set_hash)
+
+    def test_pickle(self):
+        name_set = CtfNameSet.from_names(["MyCTF"])
+        self.assertIs(pickle.loads(pickle.dumps(name_set)), name_set)
+
+if __name__ == '__main__':
+    unittest.main()
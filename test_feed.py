@@ -0,0 +1,50 @@
+from feed import FeedRecorder, FeedException, UpstreamFeed, fetch_feed, load_captured_feeds, FETCH_TIMEOUT
+from unittest import mock
+
+import os
+import tempfile
+import unittest
+
+import requests
+
+
+class TestFetchFeed(unittest.TestCase):
+    def test_timeout(self):
+        with mock.patch("feed.requests.get", side_effect = requests.Timeout()) as get:
+            with self.assertRaises(FeedException):
+                fetch_feed()
+        self.assertEqual(get.call_args.kwargs["timeout"], FETCH_TIMEOUT)
+
+class TestFeedCapture(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.capture_dir = os.path.join(self.tmp_dir.name, "capture")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_replay_in_order(self):
+        recorder = FeedRecorder(self.capture_dir)
+        snapshots = ["<rss>1</rss>", "<rss>1</rss>", "<rss>2</rss>", "<rss>1</rss>"]
+        digests = [recorder.record(UpstreamFeed(text, 200, "application/rss+xml", None), fetch_time = i)
+                   for i, text in enumerate(snapshots)]
+
+        captured = list(load_captured_feeds(self.capture_dir))
+        self.assertEqual([c.upstream.text for c in captured], snapshots)
+        self.assertEqual([c.time for c in captured], [0, 1, 2, 3])
+        self.assertEqual([c.digest for c in captured], digests)
+        self.assertEqual(digests[0], digests[1])
+        self.assertNotEqual(digests[0], digests[2])
+
+    def test_snapshots_stored_once(self):
+        recorder = FeedRecorder(self.capture_dir)
+        for text in ["<rss>1</rss>", "<rss>1</rss>", "<rss>2</rss>"]:
+            recorder.record(UpstreamFeed(text, 200, "application/rss+xml", None))
+        self.assertEqual(len(os.listdir(os.path.join(self.capture_dir, "snapshots"))), 2)
+
+    def test_missing_capture(self):
+        with self.assertRaises(FeedException):
+            list(load_captured_feeds(self.capture_dir))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+from caches import MemoryBudget
+from ctf_names import CtfNameSet
+from feed_cache import FeedCache
+from formats import OutputFormat
+from test_filter import WriteupsRssFeed, _generate_rss_item
+
+import unittest
+
+
+class TestFeedCache(unittest.TestCase):
+    def setUp(self):
+        self.feed = str(WriteupsRssFeed.from_item_list([_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF")]))
+        self.name_set = CtfNameSet.from_names(["MyCTF"])
+
+    def test_parsed_once(self):
+        cache = FeedCache(memory_budget = MemoryBudget(1 << 24))
+        parsed_feed = cache.get_parsed_feed(self.feed)
+        self.assertIs(cache.get_parsed_feed(self.feed), parsed_feed)
+        self.assertEqual(cache.render(parsed_feed, self.name_set, OutputFormat.RSS),
+                         cache.render(parsed_feed, self.name_set, OutputFormat.RSS))
+        stats = cache.stats
+        self.assertEqual((stats["parsed_hits"], stats["parsed_misses"]), (1, 1))
+        self.assertEqual((stats["rendered_hits"], stats["rendered_misses"]), (1, 1))
+
+    def test_oversized_parsed_feed(self):
+        # The parsed feed doesn't fit in its share of the budget, but the rendered feeds do
+        cache = FeedCache(memory_budget = MemoryBudget(10000, {"parsed_feeds": 0.1, "rendered_feeds": 0.9}))
+        with self.assertLogs("feed_cache", "WARNING"):
+            parsed_feed = cache.get_parsed_feed(self.feed)
+        content = cache.render(parsed_feed, self.name_set, OutputFormat.RSS)
+
+        # The latest version is kept, along with its rendered feeds
+        self.assertIs(cache.get_parsed_feed(self.feed), parsed_feed)
+        self.assertEqual(cache.render(parsed_feed, self.name_set, OutputFormat.RSS), content)
+        self.assertEqual(cache.stats["rendered_hits"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,10 @@
 from defusedxml import ElementTree
-from filter import filter_writeups, FilterException
+from filter import filter_writeups, FilterException, ParsedFeed, MatchMode, PublishedItems
 from typing import List
+from unittest import mock
 
+import pickle
+import threading
 import unittest
 import textwrap
 import string
@@ -237,6 +240,11 @@ class TestFilter(unittest.TestCase):
         output = WriteupsRssFeed.from_xml_string(filter_writeups(str(feed), [ctf_name.lower()]))
         self.assertEqual(feed, output)
 
+    def test_single_item_casefold(self):
+        feed = WriteupsRssFeed.from_item_list([_generate_rss_item("Straße CTF")])
+        output = WriteupsRssFeed.from_xml_string(filter_writeups(str(feed), ["STRASSE"]))
+        self.assertEqual(feed, output)
+
     def test_special_regex_characters(self):
         items_to_be_removed = [_generate_rss_item("CTF"), _generate_rss_item("Other"), _generate_rss_item("MyCTF")]
         items_to_remain = [_generate_rss_item("Other|CTF")]
@@ -251,5 +259,115 @@ class TestFilter(unittest.TestCase):
         with self.assertRaises(FilterException):
             filter_writeups(xml, ["Test"])
 
+class TestUnicodeMatchMode(unittest.TestCase):
+    def test_full_width(self):
+        feed = WriteupsRssFeed.from_item_list([_generate_rss_item("ＭｙＣＴＦ")])
+        output = WriteupsRssFeed.from_xml_string(filter_writeups(str(feed), ["myctf"], MatchMode.UNICODE))
+        self.assertEqual(feed, output)
+
+    def test_full_width_casefold_mode(self):
+        feed = WriteupsRssFeed.from_item_list([_generate_rss_item("ＭｙＣＴＦ")])
+        output = WriteupsRssFeed.from_xml_string(filter_writeups(str(feed), ["myctf"], MatchMode.CASEFOLD))
+        self.assertEqual(WriteupsRssFeed.from_item_list([]), output)
+
+    def test_decomposed_accents(self):
+        feed = WriteupsRssFeed.from_item_list([_generate_rss_item("Ce\u0301sar CTF")])
+        output = WriteupsRssFeed.from_xml_string(filter_writeups(str(feed), ["C\u00c9SAR"], MatchMode.UNICODE))
+        self.assertEqual(feed, output)
+
+    def test_normalized_titles_computed_once(self):
+        parsed_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list([_generate_rss_item("ＭｙＣＴＦ")])))
+        titles = parsed_feed.normalized_titles(MatchMode.UNICODE)
+        self.assertEqual(parsed_feed.match(["myctf"], MatchMode.UNICODE), [0])
+        self.assertIs(parsed_feed.normalized_titles(MatchMode.UNICODE), titles)
+
+class TestParsedFeed(unittest.TestCase):
+    def test_match_many(self):
+        item_list = [_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF"), _generate_rss_item("NewCTF")]
+        parsed_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list(item_list)))
+        matches = parsed_feed.match_many({"a": ["MyCTF"], "b": ["OtherCTF", "newctf"], "c": ["Missing"], "d": [""]})
+        self.assertEqual(matches, {"a": [0], "b": [1, 2], "c": [], "d": []})
+
+    def test_name_matches_cached(self):
+        item_list = [_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF"), _generate_rss_item("MyCTF")]
+        parsed_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list(item_list)))
+        self.assertEqual(parsed_feed.match(["myctf"]), [0, 2])
+        with mock.patch.object(ParsedFeed, "normalized_titles", autospec = True) as normalized_titles:
+            self.assertEqual(parsed_feed.match(["MYCTF", "myctf"]), [0, 2])
+            self.assertEqual(parsed_feed.match_many({"a": ["myctf"], "b": ["MyCTF"], "c": [""]}), {"a": [0, 2], "b": [0, 2], "c": []})
+            normalized_titles.assert_not_called()
+        self.assertEqual(parsed_feed.match(["myctf", "otherctf"]), [0, 1, 2])
+
+    def test_pickle(self):
+        item_list = [_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF")]
+        parsed_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list(item_list)))
+        self.assertEqual(parsed_feed.match(["myctf"]), [0])
+        restored = pickle.loads(pickle.dumps(parsed_feed))
+        self.assertEqual(restored.version, parsed_feed.version)
+        self.assertEqual(restored.match(["myctf", "otherctf"]), [0, 1])
+        self.assertEqual(restored.filter(["OtherCTF"]), parsed_feed.filter(["OtherCTF"]))
+
+    @mock.patch("filter.MAX_CACHED_NAME_MATCHES_BYTES", 2000)
+    def test_name_matches_bounded(self):
+        item_list = [_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF")]
+        parsed_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list(item_list)))
+        names = [f"ctf{i}" for i in range(200)] + ["myctf"]
+        barrier = threading.Barrier(4)
+        results = []
+
+        def match():
+            barrier.wait()
+            results.append(parsed_feed.match_many({name: [name] for name in names}))
+
+        threads = [threading.Thread(target = match) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Uncached names are still matched
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result["myctf"] == [0] and result["ctf0"] == [] for result in results))
+        cached = sum(len(name_matches) for name_matches in parsed_feed._name_matches.values())
+        self.assertGreater(cached, 0)
+        self.assertLess(cached, len(names))
+        self.assertLessEqual(parsed_feed._name_matches_bytes, 2000)
+
+    def test_explain(self):
+        item_list = [_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF"), _generate_rss_item("MyCTF OtherCTF")]
+        parsed_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list(item_list)))
+        self.assertEqual(parsed_feed.explain(["otherctf", "myctf", "missing"]), {0: ["myctf"], 1: ["otherctf"], 2: ["myctf", "otherctf"]})
+        self.assertEqual(parsed_feed.explain([""]), {})
+        with self.assertRaises(FilterException):
+            parsed_feed.explain(["", "myctf"])
+
+    def test_match_many_invalid_list(self):
+        parsed_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list([_generate_rss_item("MyCTF")])))
+        with self.assertRaises(FilterException):
+            parsed_feed.match_many({"a": ["MyCTF"], "b": ["", "MyCTF"]})
+
+    def test_filter_multiple_times(self):
+        item_list = [_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF")]
+        parsed_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list(item_list)))
+        for i, name in enumerate(["MyCTF", "OtherCTF"]):
+            output = WriteupsRssFeed.from_xml_string(parsed_feed.filter([name]))
+            self.assertEqual(WriteupsRssFeed.from_item_list([item_list[i]]), output)
+
+    def test_published_items(self):
+        item_list = [_generate_rss_item("MyCTF") for _ in range(3)]
+        previous = ParsedFeed(str(WriteupsRssFeed.from_item_list(item_list[1:])))
+        current = ParsedFeed(str(WriteupsRssFeed.from_item_list(item_list[:2])))
+        published_items = PublishedItems(max_size = 3)
+        published_items.record(previous)
+        self.assertEqual(published_items.new_item_indices(current), [0])
+        published_items.record(current)
+        self.assertEqual(published_items.new_item_indices(current), [])
+        self.assertEqual(published_items.new_item_indices(previous), [])
+
+        # The least recently seen items are forgotten first
+        published_items.record(ParsedFeed(str(WriteupsRssFeed.from_item_list([_generate_rss_item("MyCTF")]))))
+        self.assertEqual(len(published_items), 3)
+        self.assertEqual(published_items.new_item_indices(previous), [1])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
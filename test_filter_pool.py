@@ -0,0 +1,74 @@
+from concurrent.futures import ProcessPoolExecutor
+from filter import ParsedFeed, FilterException, MatchMode, get_feed_version
+from filter_pool import FilterPool
+from formats import OutputFormat, render
+from test_filter import WriteupsRssFeed, _generate_rss_item
+from unittest import mock
+
+import threading
+import unittest
+
+
+class TestFilterPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = FilterPool(workers = 2, min_feed_size = 0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_parsed_in_worker_matches_inline(self):
+        items = [_generate_rss_item(name) for name in ("MyCTF", "OtherCTF", "MYCTF", "ＭｙＣＴＦ")]
+        feed = str(WriteupsRssFeed.from_item_list(items))
+        expected = ParsedFeed(feed)
+        for mode in MatchMode:
+            parsed_feed = self.pool.parse(expected.version, feed, mode)
+            self.assertEqual(parsed_feed.version, expected.version)
+            self.assertEqual(parsed_feed.items, expected.items)
+            self.assertEqual(parsed_feed.normalized_titles(mode), expected.normalized_titles(mode))
+            for output_format in OutputFormat:
+                self.assertEqual(render(parsed_feed, parsed_feed.match(["myctf"], mode), output_format),
+                                 render(expected, expected.match(["myctf"], mode), output_format))
+
+    def test_invalid_feed(self):
+        with self.assertRaises(FilterException):
+            self.pool.parse(get_feed_version("<rss>"), "<rss>")
+
+    def test_small_feed_inline(self):
+        pool = FilterPool(workers = 1, min_feed_size = 1 << 30)
+        try:
+            feed = str(WriteupsRssFeed.from_item_list([_generate_rss_item("MyCTF")]))
+            parsed_feed = pool.parse(get_feed_version(feed), feed)
+            self.assertEqual(parsed_feed.filter(["MyCTF"]), ParsedFeed(feed).filter(["MyCTF"]))
+            # Workers are only started for offloaded feeds
+            self.assertIsNone(pool._executor)
+        finally:
+            pool.close()
+
+    def test_concurrent_parse(self):
+        feed = str(WriteupsRssFeed.from_item_list([_generate_rss_item("MyCTF")]))
+        version = get_feed_version(feed)
+        num_threads = 4
+        barrier = threading.Barrier(num_threads)
+        results = []
+
+        def parse():
+            barrier.wait()
+            results.append(self.pool.parse(version, feed))
+
+        # Threads requesting the same version share a single parse
+        submit = ProcessPoolExecutor.submit
+        with mock.patch.object(ProcessPoolExecutor, "submit", autospec = True, side_effect = submit) as spy:
+            threads = [threading.Thread(target = parse) for _ in range(num_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(spy.call_count, 1)
+        self.assertEqual(len(results), num_threads)
+        self.assertTrue(all(result is results[0] for result in results))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+from filter import ParsedFeed
+from formats import OutputFormat, negotiate_format, render, JSON_FEED_VERSION
+from test_filter import WriteupsRssFeed, _generate_rss_item
+from werkzeug.datastructures import MIMEAccept
+
+import unittest
+import json
+
+
+class TestNegotiateFormat(unittest.TestCase):
+    def test_default(self):
+        self.assertEqual(negotiate_format(None, MIMEAccept()), OutputFormat.RSS)
+        self.assertEqual(negotiate_format(None, MIMEAccept([("*/*", 1)])), OutputFormat.RSS)
+
+    def test_accept_header(self):
+        self.assertEqual(negotiate_format(None, MIMEAccept([("application/feed+json", 1)])), OutputFormat.JSON_FEED)
+        self.assertEqual(negotiate_format(None, MIMEAccept([("application/x-ndjson", 1), ("*/*", 0.1)])), OutputFormat.NDJSON)
+
+    def test_format_param(self):
+        self.assertEqual(negotiate_format("ndjson", MIMEAccept([("application/rss+xml", 1)])), OutputFormat.NDJSON)
+        with self.assertRaises(ValueError):
+            negotiate_format("atom", MIMEAccept())
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.items = [_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF"), _generate_rss_item("MyCTF")]
+        self.parsed_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list(self.items)))
+        self.indices = self.parsed_feed.match(["MyCTF"])
+
+    def test_rss(self):
+        output = WriteupsRssFeed.from_xml_string(render(self.parsed_feed, self.indices, OutputFormat.RSS))
+        self.assertEqual(output, WriteupsRssFeed.from_item_list([self.items[0], self.items[2]]))
+
+    def test_json_feed(self):
+        output = json.loads(render(self.parsed_feed, self.indices, OutputFormat.JSON_FEED))
+        self.assertEqual(output["version"], JSON_FEED_VERSION)
+        self.assertEqual(output["title"], "CTFtime.org: New writeups")
+        self.assertEqual([item["id"] for item in output["items"]], [self.items[0].guid, self.items[2].guid])
+        self.assertEqual(output["items"][0]["title"], self.items[0].title)
+        self.assertEqual(output["items"][0]["url"], self.items[0].link)
+        self.assertEqual(output["items"][0]["external_url"], self.items[0].original_url)
+
+    def test_ndjson(self):
+        lines = render(self.parsed_feed, self.indices, OutputFormat.NDJSON).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [dict(title = item.title, link = item.link, guid = item.guid) for item in (self.items[0], self.items[2])])
+
+    def test_ndjson_empty(self):
+        self.assertEqual(render(self.parsed_feed, [], OutputFormat.NDJSON), "")
+
+if __name__ == '__main__':
+    unittest.main()
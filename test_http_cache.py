@@ -0,0 +1,116 @@
+from http_cache import add_cache_headers, get_feed_etag, FEED_SHARED_MAX_AGE
+from flask import Flask, Response, request
+from werkzeug.test import Client
+
+import unittest
+
+
+class CachingProxy(object):
+    """A minimal shared cache, standing in for a reverse proxy (e.g. nginx / varnish).
+
+    Stores cacheable responses for their s-maxage, keyed by the path and by
+    the values of the request headers listed in Vary. Expired entries are revalidated
+    using If-None-Match.
+    """
+    def __init__(self, app: Flask, clock):
+        self.client = app.test_client()
+        self.clock = clock
+        self.vary = {}
+        self.entries = {}
+
+    def _key(self, path, headers):
+        return (path,) + tuple(headers.get(header, "") for header in self.vary.get(path, ()))
+
+    def get(self, path, headers = None):
+        headers = headers or {}
+        entry = self.entries.get(self._key(path, headers))
+        if entry is not None:
+            if self.clock() < entry["expires"]:
+                return entry["response"]
+            revalidation_headers = dict(headers, **{"If-None-Match": entry["response"].headers["ETag"]})
+            response = self.client.get(path, headers = revalidation_headers)
+            if response.status_code == 304:
+                entry["expires"] = self.clock() + response.cache_control.s_maxage
+                return entry["response"]
+        else:
+            response = self.client.get(path, headers = headers)
+
+        if response.status_code == 200 and response.cache_control.public:
+            self.vary[path] = tuple(response.vary)
+            self.entries[self._key(path, headers)] = dict(response = response,
+                                                          expires = self.clock() + response.cache_control.s_maxage)
+        return response
+
+class TestCacheHeaders(unittest.TestCase):
+    def test_etag_depends_on_inputs(self):
+        etag = get_feed_etag("v1", ["myctf"], "rss")
+        self.assertEqual(etag, get_feed_etag("v1", ["myctf"], "rss"))
+        self.assertNotEqual(etag, get_feed_etag("v2", ["myctf"], "rss"))
+        self.assertNotEqual(etag, get_feed_etag("v1", ["otherctf"], "rss"))
+        self.assertNotEqual(etag, get_feed_etag("v1", ["myctf"], "json"))
+
+class TestCachingProxy(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.hits = 0
+        self.feed_version = "v1"
+
+        app = Flask(__name__)
+
+        @app.route("/writeups/<string:uid>")
+        def writeups(uid):
+            self.hits += 1
+            output_format = "json" if request.accept_mimetypes.best == "application/feed+json" else "rss"
+            res = Response(f"{self.feed_version}-{output_format}")
+            add_cache_headers(res, get_feed_etag(self.feed_version, [uid], output_format))
+            return res.make_conditional(request)
+
+        self.proxy = CachingProxy(app, lambda: self.now)
+
+    def test_headers(self):
+        response = self.proxy.get("/writeups/user1")
+        self.assertTrue(response.cache_control.public)
+        self.assertGreater(response.cache_control.max_age, 0)
+        self.assertEqual(response.cache_control.s_maxage, FEED_SHARED_MAX_AGE)
+        self.assertIsNotNone(response.cache_control.stale_while_revalidate)
+        self.assertIn("Accept", response.vary)
+        self.assertIsNotNone(response.headers.get("ETag"))
+        # The upstream modification date doesn't cover the user's filter
+        self.assertIsNone(response.headers.get("Last-Modified"))
+
+    def test_repeat_polls_served_by_proxy(self):
+        for _ in range(10):
+            response = self.proxy.get("/writeups/user1")
+            self.assertEqual(response.get_data(as_text = True), "v1-rss")
+            self.now += 1
+        self.assertEqual(self.hits, 1)
+
+    def test_vary(self):
+        self.proxy.get("/writeups/user1")
+        response = self.proxy.get("/writeups/user1", headers = {"Accept": "application/feed+json"})
+        self.assertEqual(response.get_data(as_text = True), "v1-json")
+        self.assertEqual(self.hits, 2)
+
+    def test_revalidation(self):
+        self.proxy.get("/writeups/user1")
+        self.now += FEED_SHARED_MAX_AGE + 1
+        response = self.proxy.get("/writeups/user1")
+        self.assertEqual(response.get_data(as_text = True), "v1-rss")
+        self.assertEqual(self.hits, 2)
+
+        self.now += FEED_SHARED_MAX_AGE + 1
+        self.feed_version = "v2"
+        response = self.proxy.get("/writeups/user1")
+        self.assertEqual(response.get_data(as_text = True), "v2-rss")
+
+    def test_conditional_request(self):
+        client = Client(self.proxy.client.application)
+        response = client.get("/writeups/user1")
+        response = client.get("/writeups/user1", headers = {"If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, 304)
+        # A date alone doesn't validate the response
+        response = client.get("/writeups/user1", headers = {"If-Modified-Since": "Sat, 21 Nov 2020 17:56:26 GMT"})
+        self.assertEqual(response.status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+from profiling import RequestProfiler, ProfilingException, merge_profiles, PROFILING_HEADER
+
+import unittest
+import tempfile
+import os
+
+
+def _busy_leaf(n):
+    return sum(i * i for i in range(n))
+
+def _busy_root():
+    return _busy_leaf(20000) + _busy_leaf(20000)
+
+class TestRequestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_sample_rate_bounds(self):
+        with self.assertRaises(ValueError):
+            RequestProfiler(self.tmp_dir.name, sample_rate = 1.5)
+
+    def test_should_profile_sampling(self):
+        self.assertFalse(RequestProfiler(self.tmp_dir.name, sample_rate = 0.0).should_profile({}))
+        self.assertTrue(RequestProfiler(self.tmp_dir.name, sample_rate = 1.0).should_profile({}))
+
+    def test_should_profile_token(self):
+        profiler = RequestProfiler(self.tmp_dir.name, token = "secret")
+        self.assertTrue(profiler.should_profile({PROFILING_HEADER: "secret"}))
+        self.assertFalse(profiler.should_profile({PROFILING_HEADER: "wrong"}))
+        self.assertFalse(profiler.should_profile({}))
+
+    def test_header_ignored_without_token(self):
+        profiler = RequestProfiler(self.tmp_dir.name)
+        self.assertFalse(profiler.should_profile({PROFILING_HEADER: ""}))
+
+    def test_profile_and_merge(self):
+        profiler = RequestProfiler(self.tmp_dir.name, sample_rate = 1.0)
+        for _ in range(2):
+            with profiler.profile("test"):
+                _busy_root()
+
+        output_prefix = os.path.join(self.tmp_dir.name, "merged")
+        self.assertEqual(merge_profiles(self.tmp_dir.name, output_prefix), 2)
+        self.assertTrue(os.path.exists(output_prefix + ".pstats"))
+
+        with open(output_prefix + ".collapsed") as f:
+            lines = f.read().splitlines()
+        leaf_stacks = [line for line in lines if "_busy_root" in line and "_busy_leaf" in line]
+        self.assertGreater(len(leaf_stacks), 0)
+        for line in lines:
+            stack, weight = line.rsplit(" ", 1)
+            self.assertGreater(int(weight), 0)
+
+    def test_concurrent_requests_not_profiled(self):
+        profiler = RequestProfiler(self.tmp_dir.name, sample_rate = 1.0)
+        profiler.request_started()
+
+        # Another request is in flight when the profiled request starts
+        profiler.request_started()
+        with profiler.profile("test"):
+            _busy_root()
+        profiler.request_finished()
+
+        # Another request starts while the request is profiled
+        with self.assertLogs("profiling", "WARNING"):
+            with profiler.profile("test"):
+                profiler.request_started()
+                _busy_root()
+                profiler.request_finished()
+        profiler.request_finished()
+
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+        with profiler.profile("test"):
+            _busy_root()
+        self.assertEqual(len(os.listdir(self.tmp_dir.name)), 1)
+
+    def test_merge_empty_dir(self):
+        with self.assertRaises(ProfilingException):
+            merge_profiles(self.tmp_dir.name, os.path.join(self.tmp_dir.name, "merged"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+from ratelimit import RateLimiter
+from unittest import mock
+
+import os
+import unittest
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst(self):
+        limiter = RateLimiter(rate = 1, burst = 3, clock = self.clock)
+        for _ in range(3):
+            self.assertEqual(limiter.acquire("a"), 0)
+        self.assertAlmostEqual(limiter.acquire("a"), 1.0)
+
+    def test_refill(self):
+        limiter = RateLimiter(rate = 0.5, burst = 1, clock = self.clock)
+        self.assertEqual(limiter.acquire("a"), 0)
+        self.clock.now += 1
+        self.assertAlmostEqual(limiter.acquire("a"), 1.0)
+        self.clock.now += 1
+        self.assertEqual(limiter.acquire("a"), 0)
+
+    def test_keys_independent(self):
+        limiter = RateLimiter(rate = 1, burst = 1, clock = self.clock)
+        self.assertEqual(limiter.acquire("a"), 0)
+        self.assertGreater(limiter.acquire("a"), 0)
+        self.assertEqual(limiter.acquire("b"), 0)
+
+    def test_idle_eviction(self):
+        limiter = RateLimiter(rate = 1, burst = 2, clock = self.clock)
+        limiter.acquire("a")
+        self.clock.now += 1
+        limiter.acquire("b")
+        self.assertEqual(len(limiter), 2)
+        self.clock.now += 1.5
+        limiter.acquire("c")
+        self.assertEqual(len(limiter), 2)
+        self.clock.now += 10
+        limiter.acquire("c")
+        self.assertEqual(len(limiter), 1)
+
+    def test_max_keys(self):
+        limiter = RateLimiter(rate = 1, burst = 1, max_keys = 2, clock = self.clock)
+        for key in ["a", "b", "c"]:
+            self.assertEqual(limiter.acquire(key), 0)
+        self.assertEqual(len(limiter), 2)
+        # "a" was evicted, so it starts with a full bucket
+        self.assertEqual(limiter.acquire("a"), 0)
+        self.assertGreater(limiter.acquire("c"), 0)
+
+    def test_cost(self):
+        limiter = RateLimiter(rate = 1, burst = 5, clock = self.clock)
+        self.assertEqual(limiter.acquire("a", 3), 0)
+        self.assertAlmostEqual(limiter.acquire("a", 3), 1.0)
+        self.assertEqual(limiter.acquire("a", 2), 0)
+
+    def test_cost_above_burst(self):
+        limiter = RateLimiter(rate = 1, burst = 5, clock = self.clock)
+        self.assertEqual(limiter.acquire("a"), 0)
+        # Requires a full bucket
+        self.assertAlmostEqual(limiter.acquire("a", 10), 1.0)
+        self.clock.now += 1
+        self.assertEqual(limiter.acquire("a", 10), 0)
+        # The bucket is in debt until it refilled the whole cost, and isn't evicted meanwhile
+        self.clock.now += 5
+        self.assertAlmostEqual(limiter.acquire("a"), 1.0)
+        self.clock.now += 1
+        self.assertEqual(limiter.acquire("a"), 0)
+
+    def test_from_environment(self):
+        with mock.patch.dict(os.environ, {"TEST_RATE_LIMIT": "2,10"}):
+            limiter = RateLimiter.from_environment("TEST_RATE_LIMIT", (1, 1))
+            for _ in range(10):
+                self.assertEqual(limiter.acquire("a"), 0)
+            self.assertGreater(limiter.acquire("a"), 0)
+        with mock.patch.dict(os.environ, {"TEST_RATE_LIMIT": "off"}):
+            self.assertIsNone(RateLimiter.from_environment("TEST_RATE_LIMIT", (1, 1)))
+        with mock.patch.dict(os.environ, {"TEST_RATE_LIMIT": "fast"}):
+            with self.assertRaises(ValueError):
+                RateLimiter.from_environment("TEST_RATE_LIMIT", (1, 1))
+
+    def test_invalid_configuration(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(rate = 0, burst = 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+from contextlib import redirect_stdout
+from ctf_names import CtfNameSet
+from feed import FeedRecorder, UpstreamFeed
+from test_filter import WriteupsRssFeed, _generate_rss_item
+from unittest import mock
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import replay
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.capture_dir = os.path.join(self.tmp_dir.name, "capture")
+
+        # Two fetches, the second adding an item
+        items = [_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF")]
+        recorder = FeedRecorder(self.capture_dir)
+        for i, feed_items in enumerate([items, items + [_generate_rss_item("MyCTF")]]):
+            feed = UpstreamFeed(str(WriteupsRssFeed.from_item_list(feed_items)), 200, "application/rss+xml", None)
+            recorder.record(feed, fetch_time = i)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_replay(self, *args) -> list:
+        """Runs the replay entry point, returning the lines of its output."""
+        output = io.StringIO()
+        with mock.patch("sys.argv", ["replay.py", self.capture_dir, *args]), redirect_stdout(output):
+            replay.main()
+        return output.getvalue().splitlines()
+
+    def test_replay(self):
+        lines = self.run_replay("--users", "10", "--names-per-user", "1", "--baseline")
+        # Index, date, time, snapshot, items, added, parse hit, render hits, processing and baseline times
+        fetches = [line.split() for line in lines[1:3]]
+        self.assertEqual([fetch[4:7] for fetch in fetches], [["2", "2", "no"], ["3", "1", "no"]])
+        self.assertNotEqual(fetches[0][3], fetches[1][3])
+        # Users sharing a filter hit the feed rendered for the first of them
+        self.assertTrue(lines[4].startswith("Users: 10 ("))
+        distinct_filters = int(lines[4].split("(")[1].split()[0])
+        self.assertEqual([fetch[7] for fetch in fetches], [f"{10 - distinct_filters}/10"] * 2)
+        self.assertIn("Parsed feed cache hit rate: 0.0% (0/2)", lines)
+        self.assertTrue(any(line.startswith("Total baseline time") for line in lines))
+
+    def test_replay_users_file(self):
+        users_file = os.path.join(self.tmp_dir.name, "users.json")
+        with open(users_file, "w") as f:
+            json.dump({"a": ["MyCTF"], "b": ["myctf"], "c": ["OtherCTF"]}, f)
+        lines = self.run_replay("--users-file", users_file, "--format", "json")
+        # "a" and "b" share a filter, so only the first of them is rendered per fetch
+        self.assertEqual([line.split()[7] for line in lines[1:3]], ["1/3", "1/3"])
+        self.assertIn("Users: 3 (2 distinct filters)", lines)
+        self.assertIn("Rendered feed cache hit rate: 33.3% (2/6)", lines)
+
+    def test_replay_users_export(self):
+        users_file = os.path.join(self.tmp_dir.name, "users.json")
+        with open(users_file, "w", encoding = "utf-8") as f:
+            json.dump({"a": {"ctf_names": "MyCTF␞OtherCTF"}, "b": {"ctf_names": "myctf"}, "c": {"webhook_url": "x"}},
+                      f, ensure_ascii = False)
+        self.assertEqual(replay._load_users(users_file),
+                         {"a": CtfNameSet.from_names(["MyCTF", "OtherCTF"]), "b": CtfNameSet.from_names(["MyCTF"])})
+        lines = self.run_replay("--users-file", users_file)
+        self.assertIn("Users: 2 (2 distinct filters)", lines)
+
+    def test_invalid_users_file(self):
+        users_file = os.path.join(self.tmp_dir.name, "users.json")
+        with open(users_file, "w") as f:
+            json.dump({"a": "MyCTF"}, f)
+        with self.assertRaises(ValueError):
+            replay._load_users(users_file)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from resilience import ResilienceException, ResilientReader, UserListSnapshot, UserLists
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+class DatabaseStandIn(object):
+    """A local HTTP server standing in for the Realtime Database REST API.
+
+    Serves the JSON value stored at each path, after the next delay configured for that path (0 by default),
+    or answers with the next status code configured for that path (200 by default).
+    """
+    def __init__(self, data: dict):
+        self.data = data
+        self.delays = {}
+        self.status_codes = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.requests += 1
+                    delays = stand_in.delays.get(self.path, [])
+                    delay = delays.pop(0) if len(delays) > 0 else 0
+                    status_codes = stand_in.status_codes.get(self.path, [])
+                    status_code = status_codes.pop(0) if len(status_codes) > 0 else 200
+                time.sleep(delay)
+                value = stand_in.data
+                for key in self.path[1:-len(".json")].split("/"):
+                    value = value.get(key) if isinstance(value, dict) else None
+                body = json.dumps(value).encode() if status_code == 200 else b"{}"
+                self.send_response(status_code)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+
+    def path(self, uid: str) -> str:
+        return f"/data/{uid}/ctf_names.json"
+
+    def reader(self, uid: str):
+        """Returns a function reading the CTF names of the given user, like Reference.get()."""
+        def get():
+            response = requests.get(f"http://127.0.0.1:{self.server.server_address[1]}{self.path(uid)}", timeout = 5)
+            response.raise_for_status()
+            return response.json()
+        return get
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TestResilientReader(unittest.TestCase):
+    def setUp(self):
+        self.stand_in = DatabaseStandIn({"data": {"alice": {"ctf_names": "a␞b"}, "bob": {"ctf_names": "c"}}})
+        self.reader = ResilientReader(timeout = 1, hedge_delay = 0.1, max_attempts = 3, workers = 8)
+
+    def tearDown(self):
+        self.stand_in.close()
+
+    def test_read(self):
+        self.assertEqual(self.reader.read_user_list("alice", self.stand_in.reader("alice")), "a␞b")
+        self.assertIsNone(self.reader.read_user_list("nobody", self.stand_in.reader("nobody")))
+        metrics = self.reader.metrics
+        self.assertEqual(metrics["reads"], 2)
+        self.assertEqual(metrics["hedged_attempts"], 0)
+        self.assertEqual(metrics["snapshot_size"], 1)
+
+    def test_hedged_read(self):
+        self.stand_in.delays[self.stand_in.path("alice")] = [0.8]
+        start = time.monotonic()
+        self.assertEqual(self.reader.read_user_list("alice", self.stand_in.reader("alice")), "a␞b")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(self.reader.metrics["hedged_attempts"], 1)
+        self.assertEqual(self.reader.metrics["fallbacks"], 0)
+
+    def test_retried_read(self):
+        self.stand_in.status_codes[self.stand_in.path("alice")] = [500, 503]
+        self.assertEqual(self.reader.read_user_list("alice", self.stand_in.reader("alice")), "a␞b")
+        self.assertEqual(self.reader.metrics["retried_attempts"], 2)
+
+    def test_failed_read(self):
+        self.stand_in.status_codes[self.stand_in.path("alice")] = [500] * 3
+        with self.assertRaises(ResilienceException):
+            self.reader.read(self.stand_in.reader("alice"))
+        self.assertEqual(self.stand_in.requests, 3)
+        self.assertEqual(self.reader.metrics["failures"], 1)
+
+    def test_timeout(self):
+        self.stand_in.delays[self.stand_in.path("alice")] = [2] * 3
+        start = time.monotonic()
+        with self.assertRaises(ResilienceException):
+            self.reader.read(self.stand_in.reader("alice"), timeout = 0.5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.reader.metrics["timeouts"], 1)
+
+    def test_queued_attempts_cancelled(self):
+        # A single pool thread: the hedged attempts queue behind the stalled one
+        reader = ResilientReader(timeout = 0.3, hedge_delay = 0.05, max_attempts = 3, workers = 1)
+        self.stand_in.delays[self.stand_in.path("alice")] = [1] * 3
+        with self.assertRaises(ResilienceException):
+            reader.read(self.stand_in.reader("alice"))
+        time.sleep(1.5)
+        self.assertEqual(self.stand_in.requests, 1)
+
+    def test_fallback(self):
+        self.assertEqual(self.reader.read_user_list("alice", self.stand_in.reader("alice")), "a␞b")
+
+        # The list changed, but the database is unavailable
+        self.stand_in.data["data"]["alice"]["ctf_names"] = "d"
+        self.stand_in.status_codes[self.stand_in.path("alice")] = [500] * 3
+        self.stand_in.status_codes[self.stand_in.path("bob")] = [500] * 3
+        self.assertEqual(self.reader.read_user_list("alice", self.stand_in.reader("alice")), "a␞b")
+        with self.assertRaises(ResilienceException):
+            self.reader.read_user_list("bob", self.stand_in.reader("bob"))
+
+        # The database recovered
+        self.assertEqual(self.reader.read_user_list("alice", self.stand_in.reader("alice")), "d")
+        metrics = self.reader.metrics
+        self.assertEqual(metrics["fallbacks"], 1)
+        self.assertEqual(metrics["fallback_misses"], 1)
+
+    def test_read_user_lists(self):
+        self.assertEqual(self.reader.read_user_lists(["alice", "bob", "nobody"], lambda uid: self.stand_in.reader(uid)()),
+                         UserLists({"alice": "a␞b", "bob": "c"}, set()))
+        self.assertEqual(self.stand_in.requests, 3)
+
+        # Only the reads of bob and carol fail: bob is served from the snapshot, and carol is unavailable
+        self.stand_in.status_codes[self.stand_in.path("bob")] = [500] * 3
+        self.stand_in.status_codes[self.stand_in.path("carol")] = [500] * 3
+        self.assertEqual(self.reader.read_user_lists(["alice", "bob", "carol"], lambda uid: self.stand_in.reader(uid)()),
+                         UserLists({"alice": "a␞b", "bob": "c"}, {"carol"}))
+        self.assertEqual(self.reader.metrics["fallbacks"], 1)
+        self.assertEqual(self.reader.metrics["fallback_misses"], 1)
+
+    def test_read_user_lists_deadline(self):
+        self.assertEqual(self.reader.read_user_list("alice", self.stand_in.reader("alice")), "a␞b")
+        uids = ["alice"] + [f"user{i}" for i in range(20)]
+        for uid in uids:
+            self.stand_in.delays[self.stand_in.path(uid)] = [2] * 3
+
+        # The whole batch is bounded, rather than each read
+        start = time.monotonic()
+        user_lists = self.reader.read_user_lists(uids, lambda uid: self.stand_in.reader(uid)(), timeout = 0.5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(user_lists, UserLists({"alice": "a␞b"}, set(uids[1:])))
+
+class TestUserListSnapshot(unittest.TestCase):
+    def test_persist(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "snapshot", "user_lists.json")
+            snapshot = UserListSnapshot(path, persist_interval = 60)
+            snapshot.update("alice", "a␞b")
+            snapshot.update("bob", "c")
+            snapshot.update("bob", None)
+            snapshot.persist()
+
+            restored = UserListSnapshot(path)
+            self.assertEqual(len(restored), 1)
+            self.assertEqual(restored.get("alice"), "a␞b")
+            self.assertIsNone(restored.get("bob"))
+
+    def test_bounded(self):
+        snapshot = UserListSnapshot(max_entries = 2)
+        snapshot.update("alice", "a")
+        snapshot.update("bob", "b")
+        # Reading alice's list again makes bob's list the least recently read
+        snapshot.update("alice", "a")
+        snapshot.update("carol", "c")
+        self.assertEqual(len(snapshot), 2)
+        self.assertIsNone(snapshot.get("bob"))
+        self.assertEqual(snapshot.get("alice"), "a")
+
+    def test_merged_between_processes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "user_lists.json")
+            first = UserListSnapshot(path, persist_interval = 60)
+            second = UserListSnapshot(path, persist_interval = 60)
+            first.update("alice", "a")
+            first.update("bob", "b")
+            second.update("carol", "c")
+            first.persist()
+            second.persist()
+            first.update("bob", None)
+            first.persist()
+
+            restored = UserListSnapshot(path)
+            self.assertEqual(len(restored), 2)
+            self.assertEqual(restored.get("alice"), "a")
+            self.assertEqual(restored.get("carol"), "c")
+
+            # The persisted snapshot is bounded too
+            self.assertEqual(len(UserListSnapshot(path, max_entries = 1)), 1)
+
+    def test_corrupt_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "user_lists.json")
+            with open(path, "w") as f:
+                f.write("{")
+            snapshot = UserListSnapshot(path)
+            self.assertEqual(len(snapshot), 0)
+            snapshot.update("alice", "a")
+            snapshot.persist()
+            self.assertEqual(UserListSnapshot(path).get("alice"), "a")
+
+if __name__ == '__main__':
+    unittest.main()
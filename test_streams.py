@@ -0,0 +1,101 @@
+from ctf_names import CtfNameSet
+from filter import ParsedFeed
+from streams import StreamPublisher, format_event, STREAM_QUEUE_SIZE
+from test_filter import WriteupsRssFeed, _generate_rss_item
+from unittest import mock
+
+import json
+import unittest
+
+
+def _parse_events(chunks):
+    """Returns the (event, id, data) of the events in the given stream chunks, ignoring comments and fields."""
+    res = []
+    for chunk in chunks:
+        fields = dict(line.split(": ", 1) for line in chunk.strip("\n").split("\n") if not line.startswith(":") and ": " in line)
+        if "data" in fields:
+            res.append((fields.get("event"), fields.get("id"), json.loads(fields["data"])))
+    return res
+
+class TestStreams(unittest.TestCase):
+    def setUp(self):
+        self.publisher = StreamPublisher(lambda: None, max_streams = 3)
+        self.items = [_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF")]
+        self.publisher.publish(ParsedFeed(str(WriteupsRssFeed.from_item_list(self.items))))
+
+    def _publish(self, new_items) -> int:
+        self.items = new_items + self.items
+        return self.publisher.publish(ParsedFeed(str(WriteupsRssFeed.from_item_list(self.items))))
+
+    def _drain(self, subscription):
+        """Returns the events queued to the stream so far."""
+        return _parse_events(subscription.events(heartbeat_interval = 0.01, max_duration = 0.05))
+
+    def test_format_event(self):
+        self.assertEqual(format_event("a\nb", event = "e", event_id = "1"), "id: 1\nevent: e\ndata: a\ndata: b\n\n")
+
+    def test_new_matching_items(self):
+        stream1 = self.publisher.subscribe(CtfNameSet.from_names(["MyCTF"]))
+        stream2 = self.publisher.subscribe(CtfNameSet.from_names(["OtherCTF"]))
+
+        new_items = [_generate_rss_item("MyCTF"), _generate_rss_item("MyCTF")]
+        self.assertEqual(self._publish(new_items), 1)
+        # The same snapshot isn't published twice
+        self.assertEqual(self.publisher.publish(ParsedFeed(str(WriteupsRssFeed.from_item_list(self.items)))), 0)
+
+        events = self._drain(stream1)
+        self.assertEqual([data["title"] for _, _, data in events], [item.title for item in new_items])
+        self.assertEqual([event_id for _, event_id, _ in events], [item.guid for item in new_items])
+        self.assertTrue(all(event == "writeup" for event, _, _ in events))
+        self.assertEqual(self._drain(stream2), [])
+
+    def test_out_of_order_snapshots(self):
+        stream = self.publisher.subscribe(CtfNameSet.from_names(["MyCTF"]))
+        old_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list(self.items)))
+
+        new_items = [_generate_rss_item("MyCTF")]
+        self.assertEqual(self._publish(new_items), 1)
+        new_feed = ParsedFeed(str(WriteupsRssFeed.from_item_list(self.items)))
+        # Concurrent requests observed the older snapshot, then the newer one again
+        self.assertEqual(self.publisher.publish(old_feed), 0)
+        self.assertEqual(self.publisher.publish(new_feed), 0)
+
+        self.assertEqual([data["title"] for _, _, data in self._drain(stream)], [item.title for item in new_items])
+
+    def test_matched_once_per_name_set(self):
+        streams = [self.publisher.subscribe(CtfNameSet.from_names(names)) for names in (["MyCTF"], ["myctf"], ["OtherCTF"])]
+        with mock.patch.object(ParsedFeed, "match_many", autospec = True, side_effect = ParsedFeed.match_many) as match_many:
+            self._publish([_generate_rss_item("MyCTF")])
+        self.assertEqual(match_many.call_count, 1)
+        self.assertEqual(len(match_many.call_args.args[1]), 2)
+        self.assertEqual([len(self._drain(stream)) for stream in streams], [1, 1, 0])
+
+    def test_max_streams(self):
+        streams = [self.publisher.subscribe(CtfNameSet.from_names(["MyCTF"])) for _ in range(3)]
+        self.assertIsNone(self.publisher.subscribe(CtfNameSet.from_names(["MyCTF"])))
+        streams[0].close()
+        self.assertEqual(len(self.publisher), 2)
+        self.assertIsNotNone(self.publisher.subscribe(CtfNameSet.from_names(["MyCTF"])))
+
+    def test_slow_stream_closed(self):
+        self.publisher.subscribe(CtfNameSet.from_names(["MyCTF"]))
+        self.assertEqual(self._publish([_generate_rss_item("MyCTF") for _ in range(STREAM_QUEUE_SIZE + 1)]), 0)
+        self.assertEqual(len(self.publisher), 0)
+
+    def test_heartbeat_and_duration(self):
+        stream = self.publisher.subscribe(CtfNameSet.from_names(["MyCTF"]))
+        chunks = list(stream.events(heartbeat_interval = 0.01, max_duration = 0.05))
+        self.assertTrue(chunks[0].startswith("retry:"))
+        self.assertIn(": keep-alive\n\n", chunks)
+        # The stream is closed once the generator ends
+        self.assertEqual(len(self.publisher), 0)
+
+    def test_disconnect(self):
+        stream = self.publisher.subscribe(CtfNameSet.from_names(["MyCTF"]))
+        events = stream.events()
+        next(events)
+        events.close()
+        self.assertEqual(len(self.publisher), 0)
+
+if __name__ == '__main__':
+    unittest.main()
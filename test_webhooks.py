@@ -0,0 +1,246 @@
+from collections import namedtuple
+from ctf_names import CtfNameSet
+from feed import UpstreamFeed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from test_filter import WriteupsRssFeed, _generate_rss_item
+from unittest import mock
+from webhooks import DeliveryQueue, WebhookNotifier, SIGNATURE_HEADER, TIMESTAMP_HEADER, \
+                     is_public_address, is_valid_webhook_url, sign_payload
+
+import ipaddress
+import json
+import socket
+import threading
+import unittest
+
+Subscription = namedtuple("Subscription", "webhook_url webhook_secret ctf_names")
+
+SECRET = "0123456789abcdef" * 4
+
+# The receiver listens on the loopback address, which deliveries don't connect to by default
+def allow_loopback(address: str) -> bool:
+    return ipaddress.ip_address(address).is_loopback
+
+class Receiver(object):
+    """A local HTTP server standing in for webhook receivers.
+
+    Records the JSON body (and the headers) posted to each path, and answers with the next status code
+    configured for that path (200 by default).
+    """
+    def __init__(self):
+        self.received = {}
+        self.headers = {}
+        self.status_codes = {}
+        self.lock = threading.Lock()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                with receiver.lock:
+                    status_codes = receiver.status_codes.get(self.path, [])
+                    status_code = status_codes.pop(0) if len(status_codes) > 0 else 200
+                    if status_code == 200:
+                        receiver.received.setdefault(self.path, []).append(json.loads(body))
+                        receiver.headers.setdefault(self.path, []).append((dict(self.headers), body))
+                self.send_response(status_code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TestWebhookUrl(unittest.TestCase):
+    def test_webhook_url(self):
+        self.assertTrue(is_valid_webhook_url("https://example.com/hook"))
+        self.assertFalse(is_valid_webhook_url("http://example.com/hook"))
+        self.assertFalse(is_valid_webhook_url("https:///hook"))
+        self.assertFalse(is_valid_webhook_url("file:///etc/passwd", ("file", "https")))
+
+    def test_public_address(self):
+        self.assertTrue(is_public_address("93.184.216.34"))
+        self.assertTrue(is_public_address("2606:2800:220:1::1"))
+        for address in ("127.0.0.1", "10.1.2.3", "172.16.0.1", "192.168.1.1", "169.254.169.254", "100.64.0.1",
+                        "0.0.0.0", "224.0.0.1", "240.0.0.1", "::1", "fe80::1%eth0", "fc00::1", "::ffff:127.0.0.1"):
+            self.assertFalse(is_public_address(address), address)
+
+class TestDeliveryQueue(unittest.TestCase):
+    def setUp(self):
+        self.receiver = Receiver()
+        self.queue = DeliveryQueue(workers = 4, max_size = 10, max_attempts = 3, backoff = 0.01, timeout = 5,
+                                   address_filter = allow_loopback)
+        self.queue.start()
+
+    def tearDown(self):
+        self.queue.stop()
+        self.receiver.close()
+
+    def test_delivery(self):
+        for i in range(5):
+            self.assertTrue(self.queue.submit(self.receiver.url(f"/hook{i}"), json.dumps(i).encode(), SECRET))
+        self.assertTrue(self.queue.join(timeout = 10))
+        self.assertEqual(self.receiver.received, {f"/hook{i}": [i] for i in range(5)})
+        self.assertEqual(self.queue.stats["delivered"], 5)
+
+    def test_retry(self):
+        self.receiver.status_codes["/hook"] = [500, 429]
+        self.queue.submit(self.receiver.url("/hook"), b"1", SECRET)
+        self.assertTrue(self.queue.join(timeout = 10))
+        self.assertEqual(self.receiver.received, {"/hook": [1]})
+        self.assertEqual(self.queue.stats, dict(delivered = 1, failed = 0, dropped = 0, retried = 2))
+
+    def test_give_up(self):
+        self.receiver.status_codes["/retry"] = [503] * 3
+        self.receiver.status_codes["/permanent"] = [404]
+        self.queue.submit(self.receiver.url("/retry"), b"1", SECRET)
+        self.queue.submit(self.receiver.url("/permanent"), b"1", SECRET)
+        self.assertTrue(self.queue.join(timeout = 10))
+        self.assertEqual(self.receiver.received, {})
+        self.assertEqual(self.queue.stats, dict(delivered = 0, failed = 2, dropped = 0, retried = 2))
+
+    def test_bounded(self):
+        queue = DeliveryQueue(workers = 1, max_size = 3)
+        for _ in range(3):
+            self.assertTrue(queue.submit(self.receiver.url("/hook"), b"1", SECRET))
+        self.assertFalse(queue.submit(self.receiver.url("/hook"), b"1", SECRET))
+        self.assertEqual(queue.stats["dropped"], 1)
+
+    def test_signature(self):
+        self.queue.submit(self.receiver.url("/hook"), b"1", SECRET)
+        self.assertTrue(self.queue.join(timeout = 10))
+        [(headers, body)] = self.receiver.headers["/hook"]
+        self.assertEqual(headers[SIGNATURE_HEADER], sign_payload(SECRET, headers[TIMESTAMP_HEADER], body))
+        self.assertNotEqual(headers[SIGNATURE_HEADER], sign_payload("other", headers[TIMESTAMP_HEADER], body))
+
+    def test_disallowed_address(self):
+        queue = DeliveryQueue(workers = 1, max_attempts = 3, backoff = 0.01)
+        queue.start()
+        try:
+            for host in ("127.0.0.1", "localhost"):
+                queue.submit(self.receiver.url("/hook").replace("127.0.0.1", host), b"1", SECRET)
+            self.assertTrue(queue.join(timeout = 10))
+        finally:
+            queue.stop()
+        self.assertEqual(self.receiver.received, {})
+        # Not retried
+        self.assertEqual(queue.stats, dict(delivered = 0, failed = 2, dropped = 0, retried = 0))
+
+    def _resolve(self, addresses):
+        """Returns a getaddrinfo() replacement resolving "hooks.example" to the given addresses."""
+        getaddrinfo = socket.getaddrinfo
+        def resolve(host, port, *args, **kwargs):
+            if host == "hooks.example":
+                return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (address, port)) for address in addresses]
+            return getaddrinfo(host, port, *args, **kwargs)
+        return resolve
+
+    def test_connects_to_resolved_address(self):
+        url = self.receiver.url("/hook").replace("127.0.0.1", "hooks.example")
+        with mock.patch("webhooks.socket.getaddrinfo", side_effect = self._resolve(["127.0.0.1"])):
+            self.queue.submit(url, b"1", SECRET)
+            self.assertTrue(self.queue.join(timeout = 10))
+        self.assertEqual(self.receiver.received, {"/hook": [1]})
+
+    def test_any_disallowed_resolved_address(self):
+        url = self.receiver.url("/hook").replace("127.0.0.1", "hooks.example")
+        with mock.patch("webhooks.socket.getaddrinfo", side_effect = self._resolve(["127.0.0.1", "10.0.0.1"])):
+            self.queue.submit(url, b"1", SECRET)
+            self.assertTrue(self.queue.join(timeout = 10))
+        self.assertEqual(self.receiver.received, {})
+        self.assertEqual(self.queue.stats["failed"], 1)
+
+class TestWebhookNotifier(unittest.TestCase):
+    def setUp(self):
+        self.receiver = Receiver()
+        self.queue = DeliveryQueue(workers = 2, backoff = 0.01, address_filter = allow_loopback)
+        self.queue.start()
+        self.feed = ""
+        self.subscriptions = {
+            "user1": Subscription(self.receiver.url("/user1"), SECRET, CtfNameSet.from_names(["MyCTF"])),
+            "user2": Subscription(self.receiver.url("/user2"), SECRET, CtfNameSet.from_names(["OtherCTF"])),
+            "user3": Subscription(self.receiver.url("/user3"), SECRET, CtfNameSet.from_names(["myctf"])),
+        }
+        self.subscriptions_error = None
+        self.notifier = WebhookNotifier(self._get_subscriptions, self.queue,
+                                        fetch_feed = lambda: UpstreamFeed(self.feed, 200, "application/rss+xml", None),
+                                        allowed_schemes = ("http",))
+
+    def tearDown(self):
+        self.queue.stop()
+        self.receiver.close()
+
+    def _get_subscriptions(self):
+        if self.subscriptions_error is not None:
+            raise self.subscriptions_error
+        return self.subscriptions
+
+    def _poll(self, items) -> int:
+        self.feed = str(WriteupsRssFeed.from_item_list(items))
+        submitted = self.notifier.poll()
+        self.assertTrue(self.queue.join(timeout = 10))
+        return submitted
+
+    def _received_titles(self, path):
+        return [[item["title"] for item in feed["items"]] for feed in self.receiver.received.get(path, [])]
+
+    def test_only_new_items(self):
+        old_items = [_generate_rss_item("MyCTF"), _generate_rss_item("OtherCTF")]
+        self.assertEqual(self._poll(old_items), 0)
+        self.assertEqual(self._poll(old_items), 0)
+
+        new_item = _generate_rss_item("MyCTF")
+        self.assertEqual(self._poll([new_item] + old_items), 2)
+        self.assertEqual(self._received_titles("/user1"), [[new_item.title]])
+        self.assertEqual(self._received_titles("/user3"), [[new_item.title]])
+        self.assertEqual(self._received_titles("/user2"), [])
+
+        # Items which dropped out of the feed aren't new
+        self.assertEqual(self._poll([new_item]), 0)
+
+    def test_out_of_order_snapshots(self):
+        old_items = [_generate_rss_item("MyCTF")]
+        new_items = [_generate_rss_item("MyCTF")] + old_items
+        self._poll(old_items)
+        self.assertEqual(self._poll(new_items), 2)
+        # The upstream feed flaps back to the older snapshot, then to the newer one again
+        self.assertEqual(self._poll(old_items), 0)
+        self.assertEqual(self._poll(new_items), 0)
+        self.assertEqual(self._received_titles("/user1"), [[new_items[0].title]])
+
+    def test_subscriptions_unavailable(self):
+        self._poll([])
+        self.subscriptions_error = RuntimeError("The database is unavailable")
+        item = _generate_rss_item("MyCTF")
+        with self.assertRaises(RuntimeError):
+            self._poll([item])
+
+        # The items are delivered once the subscriptions can be read
+        self.subscriptions_error = None
+        self.assertEqual(self._poll([item]), 2)
+        self.assertEqual(self._received_titles("/user1"), [[item.title]])
+
+    def test_invalid_webhook_skipped(self):
+        self.subscriptions["user1"] = Subscription("ftp://example.com/hook", SECRET, CtfNameSet.from_names(["MyCTF"]))
+        self._poll([])
+        self.assertEqual(self._poll([_generate_rss_item("MyCTF")]), 1)
+        self.assertEqual(list(self.receiver.received), ["/user3"])
+
+    def test_webhook_without_secret_skipped(self):
+        self.subscriptions["user1"] = self.subscriptions["user1"]._replace(webhook_secret = None)
+        self._poll([])
+        self.assertEqual(self._poll([_generate_rss_item("MyCTF")]), 1)
+        self.assertEqual(list(self.receiver.received), ["/user3"])
+
+if __name__ == '__main__':
+    unittest.main()
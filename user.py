@@ -1,5 +1,6 @@
 """Represents a user in the system."""
-from typing import List
+from typing import Dict, List, Set, Tuple
+from ctf_names import CtfNameSet
 import database
 
 # Maximum amount of CTFs a user can follow
@@ -43,12 +44,30 @@ class User(object):
         return uid.isalnum()
 
     @property
-    def ctf_list(self) -> List[str]:
-        """Returns the list of CTF names this user ID is subscribed to.
+    def ctf_list(self) -> CtfNameSet:
+        """Returns the normalized set of CTF names this user ID is subscribed to.
         
         Raises a RuntimeError if the number of CTFs is above the limit.
         """
         ctf_list = database.get_ctf_names(self.user_id)
-        if len(ctf_list) > MAX_CTF_ENTRIES:
-            raise RuntimeError(f"Failed to read CTF list for user {self.user_id}: Too many entries ({ctf_list})")
+        self.validate_ctf_list(self.user_id, ctf_list)
         return ctf_list
+
+    @staticmethod
+    def validate_ctf_list(user_id: str, ctf_list: CtfNameSet) -> None:
+        """Validates a list of CTF names read for the given user ID.
+
+        Raises a RuntimeError if the number of CTFs is above the limit.
+        """
+        if len(ctf_list) > MAX_CTF_ENTRIES:
+            raise RuntimeError(f"Failed to read CTF list for user {user_id}: Too many entries ({ctf_list})")
+
+    @staticmethod
+    def get_ctf_lists(users: List["User"]) -> Tuple[Dict[str, CtfNameSet], Set[str]]:
+        """Returns the sets of CTF names multiple users are subscribed to, reading only the lists of these users.
+
+        Unknown users are omitted from the result. The user IDs whose list is currently
+        unavailable (see database.get_ctf_names_bulk()) are returned separately.
+        The lists are not validated, see validate_ctf_list().
+        """
+        return database.get_ctf_names_bulk(user.user_id for user in users)
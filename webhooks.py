@@ -0,0 +1,461 @@
+"""Push notifications of newly published writeups via webhooks.
+
+Instead of polling their filtered feed, users can register a webhook URL (see database.py).
+A WebhookNotifier polls the upstream feed, and whenever a new snapshot is published, it computes
+the items added since the previous snapshot, matches them against the CTF names of each subscribed
+user, and posts the matching new items (as a JSON Feed) to the user's webhook. Deliveries go through
+a DeliveryQueue, which bounds the amount of pending deliveries and of concurrent requests, and
+retries failed deliveries with exponential backoff.
+
+Webhook URLs are user provided, so deliveries only connect to publicly routable addresses: the
+host is resolved when connecting, and the connection is made to the validated address itself
+(rather than resolving the host again), so that DNS rebinding can't redirect it to an internal host.
+Each delivery is signed with the user's webhook secret (see sign_payload()), so that receivers
+can authenticate it.
+
+The notifier should run as a single background process, rather than within each web server worker
+(which would deliver every notification once per worker):
+
+    python webhooks.py
+"""
+from collections import namedtuple
+from filter import MatchMode, ParsedFeed, PublishedItems
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+import hashlib
+import heapq
+import hmac
+import ipaddress
+import itertools
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+import feed
+import formats
+import requests
+import urllib3
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+
+# Environment variable holding the interval (in seconds) between polls of the upstream feed
+ENV_POLL_INTERVAL = "WEBHOOKS_POLL_INTERVAL"
+DEFAULT_POLL_INTERVAL = 60
+
+# Amount of concurrent deliveries
+DELIVERY_WORKERS = 8
+
+# Maximal amount of pending deliveries. Further deliveries are dropped
+DELIVERY_QUEUE_SIZE = 10000
+
+# Maximal amount of attempts to deliver a notification
+DELIVERY_MAX_ATTEMPTS = 5
+
+# Delay (in seconds) before the first retry, doubled on each further retry, up to the maximal delay
+DELIVERY_BACKOFF = 2.0
+DELIVERY_MAX_BACKOFF = 300.0
+
+# Timeout (in seconds) of a single delivery attempt
+DELIVERY_TIMEOUT = 10
+
+# URL schemes allowed for webhooks
+ALLOWED_SCHEMES = ("https",)
+
+REQUEST_HEADERS = {
+    'User-Agent': 'CTFTime Writeups Filter 1.0',
+    'Content-Type': formats.OutputFormat.JSON_FEED.content_type,
+}
+
+# Headers holding the signature of a delivery and the time (in seconds since the epoch) it was signed at,
+# see sign_payload()
+SIGNATURE_HEADER = "X-Writeups-Signature"
+TIMESTAMP_HEADER = "X-Writeups-Timestamp"
+
+# HTTP status codes which indicate a temporary failure (in addition to 5xx)
+_RETRYABLE_STATUS_CODES = {408, 429}
+
+# A pending delivery: The webhook URL, the request body, the webhook secret and the amount of previous attempts
+Delivery = namedtuple("Delivery", "url payload secret attempts")
+
+logger = logging.getLogger(__name__)
+
+class WebhookException(Exception):
+    """Represents an exception thrown by the webhooks module."""
+    pass
+
+def is_valid_webhook_url(url: str, allowed_schemes: Tuple[str, ...] = ALLOWED_SCHEMES) -> bool:
+    """Returns True iff the given URL can be used as a webhook."""
+    try:
+        parsed_url = urlparse(url)
+    except ValueError:
+        return False
+    return parsed_url.scheme in allowed_schemes and bool(parsed_url.hostname)
+
+def is_public_address(address: str) -> bool:
+    """Returns True iff the given IP address is publicly routable.
+
+    Loopback, private, link-local (e.g. cloud metadata services), shared, multicast, reserved and
+    unspecified addresses aren't. IPv4-mapped IPv6 addresses are checked as IPv4 addresses.
+    """
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not (ip.is_loopback or ip.is_private or ip.is_link_local or ip.is_multicast
+                                 or ip.is_reserved or ip.is_unspecified)
+
+def sign_payload(secret: str, timestamp: str, payload: bytes) -> str:
+    """Returns the signature of a delivery, sent in the SIGNATURE_HEADER header.
+
+    The signature is "sha256=" followed by the hex HMAC-SHA256 of "<timestamp>.<payload>", keyed by the
+    user's webhook secret. The timestamp is sent in the TIMESTAMP_HEADER header, and allows receivers
+    to reject replayed deliveries.
+    """
+    return "sha256=" + hmac.new(secret.encode(), timestamp.encode() + b"." + payload, hashlib.sha256).hexdigest()
+
+def _connect_to_allowed_address(conn: urllib3.connection.HTTPConnection,
+                                address_filter: Callable[[str], bool]) -> socket.socket:
+    """Resolves the host of a connection, and connects to one of its addresses if all of them are allowed.
+
+    Raises:
+        WebhookException: The host resolves to an address which isn't allowed.
+    """
+    try:
+        address_infos = socket.getaddrinfo(conn.host, conn.port, type = socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise NameResolutionError(conn.host, conn, e) from e
+
+    for address_info in address_infos:
+        if not address_filter(address_info[4][0]):
+            raise WebhookException(f"Webhook host {conn.host} resolves to a disallowed address {address_info[4][0]}")
+
+    last_error = None
+    for address_info in address_infos:
+        try:
+            return urllib3.util.connection.create_connection((address_info[4][0], conn.port), conn.timeout,
+                                                             source_address = conn.source_address,
+                                                             socket_options = conn.socket_options)
+        except socket.timeout as e:
+            raise ConnectTimeoutError(conn, f"Connection to {conn.host} timed out") from e
+        except OSError as e:
+            last_error = e
+    raise NewConnectionError(conn, f"Failed to establish a new connection: {last_error}")
+
+class _PinnedHTTPConnection(urllib3.connection.HTTPConnection):
+    """An HTTP connection to a validated address of its host, see _connect_to_allowed_address()."""
+
+    def __init__(self, *args, address_filter: Callable[[str], bool] = is_public_address, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._address_filter = address_filter
+
+    def _new_conn(self) -> socket.socket:
+        return _connect_to_allowed_address(self, self._address_filter)
+
+class _PinnedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    """An HTTPS connection to a validated address of its host, see _connect_to_allowed_address().
+
+    The certificate is still verified against the host name.
+    """
+
+    def __init__(self, *args, address_filter: Callable[[str], bool] = is_public_address, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._address_filter = address_filter
+
+    def _new_conn(self) -> socket.socket:
+        return _connect_to_allowed_address(self, self._address_filter)
+
+class _PinnedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _PinnedHTTPConnection
+
+class _PinnedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _PinnedHTTPSConnection
+
+class _PinnedPoolManager(urllib3.PoolManager):
+    """A pool manager whose connections only connect to the addresses allowed by the address filter."""
+
+    def __init__(self, address_filter: Callable[[str], bool], **kwargs):
+        super().__init__(**kwargs)
+        self._address_filter = address_filter
+        self.pool_classes_by_scheme = {"http": _PinnedHTTPConnectionPool, "https": _PinnedHTTPSConnectionPool}
+
+    def _new_pool(self, scheme, host, port, request_context = None):
+        pool = super()._new_pool(scheme, host, port, request_context)
+        pool.conn_kw["address_filter"] = self._address_filter
+        return pool
+
+class _PinnedAdapter(requests.adapters.HTTPAdapter):
+    """A transport adapter which only connects to the addresses allowed by the address filter."""
+
+    def __init__(self, address_filter: Callable[[str], bool], **kwargs):
+        self._address_filter = address_filter
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block = False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _PinnedPoolManager(self._address_filter, num_pools = connections, maxsize = maxsize,
+                                              block = block, **pool_kwargs)
+
+class DeliveryQueue(object):
+    """A bounded queue of webhook deliveries, delivered concurrently by worker threads.
+
+    A delivery succeeds if the webhook responds with a 2xx status code. Deliveries which fail due
+    to a connection error, a timeout, a 5xx status code, 408 or 429 are retried with exponential
+    backoff (and jitter), up to a maximal amount of attempts. Other failures (including webhooks
+    resolving to a disallowed address) aren't retried.
+    """
+
+    def __init__(self, workers: int = DELIVERY_WORKERS, max_size: int = DELIVERY_QUEUE_SIZE,
+                 max_attempts: int = DELIVERY_MAX_ATTEMPTS, backoff: float = DELIVERY_BACKOFF,
+                 max_backoff: float = DELIVERY_MAX_BACKOFF, timeout: float = DELIVERY_TIMEOUT,
+                 address_filter: Callable[[str], bool] = is_public_address):
+        """Initialize the queue. Call start() to start delivering.
+
+        Args:
+            workers:
+                The amount of concurrent deliveries.
+            max_size:
+                The maximal amount of pending deliveries (including deliveries waiting for a retry).
+            max_attempts:
+                The maximal amount of attempts to deliver a notification.
+            backoff:
+                The delay (in seconds) before the first retry, doubled on each further retry.
+            max_backoff:
+                The maximal delay (in seconds) before a retry.
+            timeout:
+                The timeout (in seconds) of a single delivery attempt.
+            address_filter:
+                Returns True iff deliveries may connect to the given IP address.
+        """
+        self._workers = workers
+        self._max_size = max_size
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._timeout = timeout
+
+        self._session = requests.Session()
+        # Proxies configured in the environment would connect to the webhooks on our behalf, bypassing the address filter
+        self._session.trust_env = False
+        adapter = _PinnedAdapter(address_filter, pool_connections = workers, pool_maxsize = workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        # Pending deliveries, as (due time, sequence number, delivery)
+        self._pending = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stats = dict(delivered = 0, failed = 0, dropped = 0, retried = 0)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Counters of delivered, failed (after all attempts), dropped (queue full) and retried deliveries."""
+        with self._condition:
+            return dict(self._stats)
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._pending) + self._in_flight
+
+    def start(self) -> None:
+        """Starts the worker threads."""
+        for _ in range(self._workers):
+            thread = threading.Thread(target = self._work, daemon = True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Stops the worker threads, after the deliveries in flight complete. Pending deliveries are discarded."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, url: str, payload: bytes, secret: str) -> bool:
+        """Queues a delivery, signed with the given webhook secret (see sign_payload()).
+
+        Returns:
+            True if the delivery was queued, False if it was dropped since the queue is full.
+        """
+        with self._condition:
+            if len(self._pending) + self._in_flight >= self._max_size:
+                self._stats["dropped"] += 1
+                return False
+            heapq.heappush(self._pending, (time.monotonic(), next(self._sequence), Delivery(url, payload, secret, 0)))
+            self._condition.notify()
+            return True
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Waits until there are no pending deliveries.
+
+        Returns:
+            True if all deliveries completed, False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._pending) + self._in_flight == 0, timeout)
+
+    def _next(self) -> Optional[Delivery]:
+        """Waits for the next due delivery. Returns None when stopping."""
+        with self._condition:
+            while not self._stopping:
+                if len(self._pending) > 0:
+                    delay = self._pending[0][0] - time.monotonic()
+                    if delay <= 0:
+                        self._in_flight += 1
+                        return heapq.heappop(self._pending)[2]
+                    self._condition.wait(delay)
+                else:
+                    self._condition.wait()
+            return None
+
+    def _attempt(self, delivery: Delivery) -> Optional[bool]:
+        """Attempts a delivery.
+
+        Returns:
+            True if delivered, None if the attempt should be retried, False otherwise.
+        """
+        timestamp = str(int(time.time()))
+        headers = dict(REQUEST_HEADERS)
+        headers[TIMESTAMP_HEADER] = timestamp
+        headers[SIGNATURE_HEADER] = sign_payload(delivery.secret, timestamp, delivery.payload)
+        try:
+            r = self._session.post(delivery.url, data = delivery.payload, headers = headers,
+                                   timeout = self._timeout, allow_redirects = False)
+        except WebhookException as e:
+            logger.warning(f"Not delivering to {delivery.url}: {e}")
+            return False
+        except requests.RequestException as e:
+            logger.warning(f"Failed to deliver to {delivery.url}: {e}")
+            return None
+        if 200 <= r.status_code < 300:
+            return True
+        logger.warning(f"Failed to deliver to {delivery.url}: HTTP {r.status_code}")
+        return None if (r.status_code >= 500 or r.status_code in _RETRYABLE_STATUS_CODES) else False
+
+    def _work(self) -> None:
+        while (delivery := self._next()) is not None:
+            result = self._attempt(delivery)
+            with self._condition:
+                self._in_flight -= 1
+                if result:
+                    self._stats["delivered"] += 1
+                elif result is None and delivery.attempts + 1 < self._max_attempts:
+                    self._stats["retried"] += 1
+                    delay = min(self._max_backoff, self._backoff * (2 ** delivery.attempts)) * random.uniform(0.5, 1)
+                    heapq.heappush(self._pending, (time.monotonic() + delay, next(self._sequence),
+                                                   delivery._replace(attempts = delivery.attempts + 1)))
+                else:
+                    self._stats["failed"] += 1
+                self._condition.notify_all()
+
+class WebhookNotifier(object):
+    """Notifies subscribed users about new writeups matching their CTF names."""
+
+    def __init__(self, get_subscriptions: Callable[[], Dict], delivery_queue: DeliveryQueue,
+                 fetch_feed: Callable[[], feed.UpstreamFeed] = feed.fetch_feed,
+                 match_mode: MatchMode = MatchMode.CASEFOLD, allowed_schemes: Tuple[str, ...] = ALLOWED_SCHEMES):
+        """Initialize the notifier.
+
+        Args:
+            get_subscriptions:
+                Returns a dictionary mapping user IDs to subscriptions (see database.get_subscriptions()).
+            delivery_queue:
+                The queue to submit deliveries to.
+            fetch_feed:
+                Fetches the upstream feed.
+            match_mode:
+                The mode used for matching CTF names to titles.
+            allowed_schemes:
+                URL schemes allowed for webhooks.
+        """
+        self._get_subscriptions = get_subscriptions
+        self._delivery_queue = delivery_queue
+        self._fetch_feed = fetch_feed
+        self._match_mode = match_mode
+        self._allowed_schemes = allowed_schemes
+        self._last_version = None
+        self._published_items = PublishedItems()
+
+    def poll(self) -> int:
+        """Fetches the upstream feed, and notifies the subscribed users about the items which weren't delivered yet.
+
+        The first poll only records the current snapshot of the feed, since there is nothing to compare it to.
+        The items of a snapshot are only recorded as delivered once the deliveries were submitted, so they
+        are delivered by the next poll if the subscriptions can't be read.
+
+        Returns:
+            The amount of deliveries submitted.
+
+        Raises:
+            FeedException: The feed could not be fetched.
+            FilterException: The feed could not be processed.
+            DatabaseException: The subscriptions could not be read.
+        """
+        parsed_feed = ParsedFeed(self._fetch_feed().text)
+        if self._last_version == parsed_feed.version:
+            return 0
+        new_indices = set(self._published_items.new_item_indices(parsed_feed))
+        if self._last_version is None or len(new_indices) == 0:
+            self._published_items.record(parsed_feed)
+            self._last_version = parsed_feed.version
+            return 0
+
+        subscriptions = {uid: subscription for uid, subscription in self._get_subscriptions().items()
+                         if is_valid_webhook_url(subscription.webhook_url, self._allowed_schemes) and subscription.webhook_secret}
+        matches = parsed_feed.match_many({uid: subscription.ctf_names for uid, subscription in subscriptions.items()},
+                                         self._match_mode)
+
+        # Users following the same CTF names (see ctf_names.CtfNameSet) share the rendered payload
+        payloads = {}
+        submitted = 0
+        for uid, indices in matches.items():
+            indices = [i for i in indices if i in new_indices]
+            if len(indices) == 0:
+                continue
+            subscription = subscriptions[uid]
+            payload = payloads.get(subscription.ctf_names)
+            if payload is None:
+                payload = formats.render(parsed_feed, indices, formats.OutputFormat.JSON_FEED).encode()
+                payloads[subscription.ctf_names] = payload
+            if self._delivery_queue.submit(subscription.webhook_url, payload, subscription.webhook_secret):
+                submitted += 1
+
+        self._published_items.record(parsed_feed)
+        self._last_version = parsed_feed.version
+        return submitted
+
+    def run(self, interval: float, stop_event: threading.Event) -> None:
+        """Polls the upstream feed every given interval (in seconds), until the event is set."""
+        while not stop_event.is_set():
+            try:
+                submitted = self.poll()
+                if submitted > 0:
+                    logger.info(f"Submitted {submitted} deliveries ({self._delivery_queue.stats})")
+            except Exception as e:
+                logger.error(e)
+            stop_event.wait(interval)
+
+def main():
+    # The database module connects to Firebase when imported
+    import database
+
+    logging.basicConfig(level = logging.INFO, format = "%(asctime)s %(levelname)s %(message)s")
+    delivery_queue = DeliveryQueue()
+    delivery_queue.start()
+    notifier = WebhookNotifier(database.get_subscriptions, delivery_queue, match_mode = MatchMode.from_environment())
+    try:
+        notifier.run(float(os.environ.get(ENV_POLL_INTERVAL, DEFAULT_POLL_INTERVAL)), threading.Event())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        delivery_queue.stop()
+
+if __name__ == "__main__":
+    main()